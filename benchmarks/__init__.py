@@ -0,0 +1,6 @@
+"""Benchmarks that drive the API in process, without a server or network.
+
+Run them from the root of the repository, for example:
+
+    PYTHONPATH=src python -m benchmarks.load --backends in-memory redis
+"""
@@ -0,0 +1,84 @@
+"""A minimal in-process ASGI client.
+
+Requests are passed straight to the app's ASGI callable, so a benchmark
+measures the app rather than sockets, HTTP parsing or a client library.
+"""
+import asyncio
+import contextlib
+from typing import AsyncIterator, Optional
+
+
+class ASGIClient:
+
+    def __init__(self, app):
+        self.app = app
+
+    async def request(self, method: str, path: str, body: bytes = b"",
+                      headers: Optional[dict[str, str]] = None) -> tuple[int, bytes]:
+        """Sends a request, returning the response status and body."""
+        path, _, query_string = path.partition("?")
+        headers = {"content-type": "application/json", **(headers or {}),
+                   "content-length": str(len(body))}
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "query_string": query_string.encode(),
+            "root_path": "",
+            "headers": [(name.lower().encode(), value.encode())
+                        for name, value in headers.items()],
+            "client": ("127.0.0.1", 0),
+            "server": ("benchmark", 80),
+        }
+        request_sent, response_complete = False, asyncio.Event()
+        status, chunks = None, []
+
+        async def receive():
+            nonlocal request_sent
+            if not request_sent:
+                request_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            await response_complete.wait()
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+                if not message.get("more_body", False):
+                    response_complete.set()
+
+        await self.app(scope, receive, send)
+        return status, b"".join(chunks)
+
+    async def wait_until_ready(self, timeout: float = 60.0):
+        """Polls /ready until the app's backend has started."""
+        deadline = asyncio.get_running_loop().time() + timeout
+        while (await self.request("GET", "/ready"))[0] != 200:
+            if asyncio.get_running_loop().time() > deadline:
+                raise RuntimeError(f"The app was not ready within {timeout} seconds")
+            await asyncio.sleep(0.01)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(self) -> AsyncIterator[None]:
+        """Runs the app's startup and shutdown events around the block."""
+        received, sent = asyncio.Queue(), asyncio.Queue()
+        task = asyncio.ensure_future(
+            self.app({"type": "lifespan", "asgi": {"version": "3.0"}}, received.get, sent.put)
+        )
+        await received.put({"type": "lifespan.startup"})
+        message = await sent.get()
+        if message["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"Startup failed: {message.get('message')}")
+        try:
+            yield
+        finally:
+            await received.put({"type": "lifespan.shutdown"})
+            await sent.get()
+            await task
@@ -0,0 +1,86 @@
+"""The backends that benchmarks can run against, and in-process stand-ins for servers."""
+import argparse
+import contextlib
+import functools
+import os
+import tempfile
+from typing import Iterator
+
+from per_object_permissions.api import config, main
+from per_object_permissions.backends import redis_backend
+
+BACKENDS = {
+    "in-memory": "per_object_permissions.backends.in_memory_backend::InMemoryBackend",
+    "columnar": "per_object_permissions.backends.columnar_backend::ColumnarBackend",
+    "shared-memory": "per_object_permissions.backends.shared_memory_backend::SharedMemoryBackend",
+    "redis": "benchmarks.backends::FakeRedisBackend",
+    # These need a server, configured with the usual settings
+    "redis-server": "per_object_permissions.backends.redis_backend::RedisBackend",
+    "postgres": "per_object_permissions.backends.postgres.backend::PostgresBackend",
+    "mongodb": "per_object_permissions.backends.mongodb_backend::MongoBackend",
+    "neo4j": "per_object_permissions.backends.neo4j_backend::Neo4jBackend",
+}
+# Backends that run without a server. The fakeredis stand-in is much slower
+# than a real Redis server, so it is only run when asked for.
+OFFLINE_BACKENDS = ("in-memory", "columnar", "shared-memory", "redis")
+DEFAULT_BACKENDS = ("in-memory", "columnar", "shared-memory")
+
+DESTROY_WARNING = ("Benchmarks delete every triple in the database that the settings point "
+                   "at. Pass --allow-destroy to run against {}.")
+
+
+def check_destructive(parser: argparse.ArgumentParser, args: argparse.Namespace):
+    """Refuses to benchmark backends that keep their data on a server without --allow-destroy.
+
+    Offline backends only ever store data in a temporary directory.
+    """
+    destructive = [name for name in args.backends if name not in OFFLINE_BACKENDS]
+    if destructive and not args.allow_destroy:
+        parser.error(DESTROY_WARNING.format(", ".join(destructive)))
+
+
+class FakeRedisBackend(redis_backend.RedisBackend):
+    """The Redis backend, connected to an in-process fakeredis server."""
+
+    def __init__(self, settings, **kwargs):
+        # Only needed, and so only imported, when this stand-in is used
+        import fakeredis
+        from fakeredis import aioredis
+
+        client_class = functools.partial(aioredis.FakeRedis, server=fakeredis.FakeServer())
+        super().__init__(settings, client_class=client_class, **kwargs)
+
+
+def _clear_caches():
+    for cached in (main.get_settings, main.get_backend,
+                   main.get_check_batcher, main.get_read_batcher):
+        cached.cache_clear()
+
+
+@contextlib.contextmanager
+def use_backend(name: str) -> Iterator[None]:
+    """Configures the app to use the named backend inside the block.
+
+    File-backed backends are given a temporary directory, so benchmarks
+    never touch their configured data. The in-memory backend only persists
+    its writes there if persistence is configured.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        environment = {
+            "BACKEND": BACKENDS.get(name, name),
+            "SHARED_MEMORY_PATH": os.path.join(directory, "perms"),
+            "IN_MEMORY_DATA_DIR": (os.path.join(directory, "in-memory")
+                                   if config.Settings().in_memory_data_dir else ""),
+        }
+        previous = {key: os.environ.get(key) for key in environment}
+        os.environ.update(environment)
+        _clear_caches()
+        try:
+            yield
+        finally:
+            for key, value in previous.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+            _clear_caches()
@@ -0,0 +1,237 @@
+"""Load test of the API, driven in process with many concurrent clients.
+
+A synthetic dataset is created through the API, then concurrent workers
+send a weighted mix of requests until the requested number has been
+sent. Throughput and latency percentiles are reported per backend and
+operation:
+
+    PYTHONPATH=src python -m benchmarks.load --backends in-memory redis \\
+        --concurrency 100 --requests 20000 --mix read=60,check=30,write=5,delete=5
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+
+from benchmarks.asgi import ASGIClient
+from benchmarks.backends import BACKENDS, DEFAULT_BACKENDS, check_destructive, use_backend
+from per_object_permissions.api import main as api
+
+CREATE_CHUNK_SIZE = 10000
+
+
+@dataclass
+class Dataset:
+    subject_uuids: list[str]
+    predicates: list[str]
+    object_uuids: list[str]
+    triples: list[dict]
+
+    @classmethod
+    def generate(cls, size: int, subjects: int, objects: int, predicates: int,
+                 rng: random.Random) -> "Dataset":
+        subject_uuids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(subjects)]
+        object_uuids = [str(uuid.UUID(int=rng.getrandbits(128))) for _ in range(objects)]
+        predicate_names = [f"predicate-{index}" for index in range(predicates)]
+        size = min(size, subjects * objects * predicates)
+        keys = set()
+        while len(keys) < size:
+            keys.add((rng.randrange(subjects), rng.randrange(predicates), rng.randrange(objects)))
+        triples = [{"subject_uuid": subject_uuids[subject],
+                    "predicate": predicate_names[predicate],
+                    "object_uuid": object_uuids[object_]}
+                   for subject, predicate, object_ in keys]
+        return cls(subject_uuids, predicate_names, object_uuids, triples)
+
+    def random_triple(self, rng: random.Random) -> dict:
+        """Returns a stored triple half the time, and otherwise most likely a missing one."""
+        if self.triples and rng.random() < 0.5:
+            return rng.choice(self.triples)
+        return {"subject_uuid": rng.choice(self.subject_uuids),
+                "predicate": rng.choice(self.predicates),
+                "object_uuid": rng.choice(self.object_uuids)}
+
+
+def read_request(dataset: Dataset, rng: random.Random) -> tuple[str, dict]:
+    return "/read-perms", {"subject_uuids": [rng.choice(dataset.subject_uuids)]}
+
+
+def check_request(dataset: Dataset, rng: random.Random) -> tuple[str, dict]:
+    return "/check-perm", dataset.random_triple(rng)
+
+
+def write_request(dataset: Dataset, rng: random.Random) -> tuple[str, list]:
+    return "/create-perms?return=none", [dataset.random_triple(rng)]
+
+
+def delete_request(dataset: Dataset, rng: random.Random) -> tuple[str, dict]:
+    triple = dataset.random_triple(rng)
+    return "/delete-perms?return=none", {"subject_uuids": [triple["subject_uuid"]],
+                                         "object_uuids": [triple["object_uuid"]]}
+
+
+REQUESTS = {
+    "read": read_request,
+    "check": check_request,
+    "write": write_request,
+    "delete": delete_request,
+}
+
+
+def parse_mix(value: str) -> dict[str, float]:
+    """Parses weights of operations, e.g. "read=60,check=40"."""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in REQUESTS:
+            raise argparse.ArgumentTypeError(f"Unknown operation {name!r}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def percentile(values: list[float], percent: float) -> float:
+    """Returns the percentile of sorted values, interpolating between neighbours."""
+    if not values:
+        return float("nan")
+    position = (len(values) - 1) * percent / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+@dataclass
+class Results:
+    backend: str
+    seconds: float = 0.0
+    load_seconds: float = 0.0
+    latencies: dict[str, list[float]] = field(default_factory=lambda: defaultdict(list))
+    errors: dict[str, int] = field(default_factory=lambda: defaultdict(int))
+
+    def rows(self) -> list[dict]:
+        operations = {"all": sorted(latency for latencies in self.latencies.values()
+                                    for latency in latencies)}
+        operations.update((name, sorted(latencies))
+                          for name, latencies in sorted(self.latencies.items()))
+        return [{
+            "backend": self.backend,
+            "operation": name,
+            "requests": len(latencies),
+            "errors": (sum(self.errors.values()) if name == "all"
+                       else self.errors.get(name, 0)),
+            "requests_per_second": len(latencies) / self.seconds,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+        } for name, latencies in operations.items()]
+
+
+async def load_dataset(client: ASGIClient, dataset: Dataset):
+    for start in range(0, len(dataset.triples), CREATE_CHUNK_SIZE):
+        body = json.dumps(dataset.triples[start:start + CREATE_CHUNK_SIZE]).encode()
+        status, response = await client.request("POST", "/create-perms?return=none", body)
+        if status != 200:
+            raise RuntimeError(f"Loading the dataset failed with {status}: {response[:200]!r}")
+
+
+async def run_load(client: ASGIClient, dataset: Dataset, mix: dict[str, float],
+                   concurrency: int, total_requests: int, seed: int, results: Results):
+    names, weights = list(mix), list(mix.values())
+    remaining = total_requests
+
+    async def worker(rng: random.Random):
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            name = rng.choices(names, weights)[0]
+            path, payload = REQUESTS[name](dataset, rng)
+            body = json.dumps(payload).encode()
+            started = time.perf_counter()
+            status, _ = await client.request("POST", path, body)
+            results.latencies[name].append(time.perf_counter() - started)
+            if status != 200:
+                results.errors[name] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(random.Random(seed + index))
+                           for index in range(concurrency)))
+    results.seconds = time.perf_counter() - started
+
+
+async def benchmark(backend: str, args: argparse.Namespace) -> Results:
+    rng = random.Random(args.seed)
+    dataset = Dataset.generate(args.triples, args.subjects, args.objects, args.predicates, rng)
+    results = Results(backend)
+    with use_backend(backend):
+        client = ASGIClient(api.app)
+        async with client.lifespan():
+            await client.wait_until_ready()
+            started = time.perf_counter()
+            await load_dataset(client, dataset)
+            results.load_seconds = time.perf_counter() - started
+            try:
+                await run_load(client, dataset, args.mix, args.concurrency, args.requests,
+                               args.seed, results)
+            finally:
+                await client.request("POST", "/delete-perms?return=none", b"{}")
+    return results
+
+
+def print_report(all_results: list[Results]):
+    print(f"{'BACKEND':<15}{'OPERATION':<11}{'REQUESTS':>9}{'ERRORS':>8}{'REQ/S':>10}"
+          f"{'P50_MS':>9}{'P95_MS':>9}{'P99_MS':>9}")
+    for results in all_results:
+        for row in results.rows():
+            print(f"{row['backend']:<15}{row['operation']:<11}{row['requests']:>9}"
+                  f"{row['errors']:>8}{row['requests_per_second']:>10.1f}"
+                  f"{row['p50_ms']:>9.2f}{row['p95_ms']:>9.2f}{row['p99_ms']:>9.2f}")
+    print()
+    for results in all_results:
+        print(f"{results.backend}: dataset loaded in {results.load_seconds:.3f} seconds")
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", nargs="+", default=list(DEFAULT_BACKENDS),
+                        help=f"Names from {', '.join(BACKENDS)}, or module::Class paths. "
+                             f"Redis runs against fakeredis; redis-server, postgres, mongodb "
+                             f"and neo4j need a server, all of whose triples are deleted.")
+    parser.add_argument("--concurrency", type=int, default=50,
+                        help="Number of clients sending requests at once.")
+    parser.add_argument("--requests", type=int, default=10000,
+                        help="Total number of requests to send.")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("read=60,check=30,write=5,"
+                                                                   "delete=5"),
+                        help="Weights of each operation, e.g. read=60,check=30,write=5,delete=5.")
+    parser.add_argument("--triples", type=int, default=10000,
+                        help="Number of triples created before the load starts.")
+    parser.add_argument("--subjects", type=int, default=1000)
+    parser.add_argument("--objects", type=int, default=1000)
+    parser.add_argument("--predicates", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", metavar="PATH",
+                        help="Also write the results to a JSON file.")
+    parser.add_argument("--allow-destroy", action="store_true",
+                        help="Allow running against servers, deleting all of their triples.")
+    args = parser.parse_args(argv)
+    check_destructive(parser, args)
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    all_results = []
+    for backend in args.backends:
+        all_results.append(asyncio.run(benchmark(backend, args)))
+    print_report(all_results)
+    if args.json:
+        with open(args.json, "w") as fileobj:
+            json.dump([row for results in all_results for row in results.rows()],
+                      fileobj, indent=2)
+
+
+if __name__ == "__main__":
+    main()
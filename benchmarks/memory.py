@@ -0,0 +1,311 @@
+"""Memory footprint and query latency of backends as their dataset grows.
+
+Synthetic triples are created directly through each backend, growing the
+dataset through each of the requested sizes. At each size the benchmark
+reports the load time so far and the memory used per triple, then times
+reads by subject and by object and existence checks:
+
+    PYTHONPATH=src python -m benchmarks.memory --backends in-memory columnar \\
+        --sizes 10000 100000 1000000 10000000
+
+Memory is measured as growth since the backend was created. Backends
+that keep their triples in process are measured with tracemalloc and by
+the resident set size (RSS) of the process. Servers report the size of
+their own data where they can: postgres the size of its table and
+indexes, mongodb the size of its collection and indexes, and redis the
+memory it uses. Tracing allocations slows loading down and adds its own
+bookkeeping to the RSS, so pass --no-tracemalloc for accurate load times
+and RSS.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import time
+import tracemalloc
+import uuid
+from collections import namedtuple
+from dataclasses import asdict, dataclass
+from importlib import import_module
+from typing import Iterator, Optional
+
+from benchmarks.backends import BACKENDS, DEFAULT_BACKENDS, check_destructive, use_backend
+from benchmarks.load import percentile
+from per_object_permissions.api import main as api
+
+Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
+
+DEFAULT_SIZES = (10 ** 4, 10 ** 5, 10 ** 6)
+CREATE_CHUNK_SIZE = 10000
+
+# Distinguish subject from object UUIDs, which are otherwise numbered alike
+SUBJECT_UUID_BASE = 1 << 64
+OBJECT_UUID_BASE = 2 << 64
+
+
+@dataclass(frozen=True)
+class Dataset:
+    """A deterministic dataset of any size, generated without being held in memory.
+
+    Each subject has triples_per_subject triples, each with a different
+    object from the pool of objects, so reads by subject return the same
+    number of triples at any size while reads by object return more.
+    """
+
+    triples_per_subject: int
+    objects: int
+    predicates: int
+
+    def triple(self, index: int) -> Triple:
+        subject, position = divmod(index, self.triples_per_subject)
+        object_ = (subject * 7919 + position) % self.objects
+        return Triple(uuid.UUID(int=SUBJECT_UUID_BASE + subject),
+                      f"predicate-{index % self.predicates}",
+                      uuid.UUID(int=OBJECT_UUID_BASE + object_))
+
+    def triples(self, start: int, stop: int) -> Iterator[Triple]:
+        return (self.triple(index) for index in range(start, stop))
+
+
+def current_rss() -> Optional[int]:
+    """Returns the resident set size of this process in bytes, where /proc has it."""
+    try:
+        with open("/proc/self/statm") as fileobj:
+            return int(fileobj.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+async def postgres_bytes(settings) -> int:
+    import psycopg
+
+    async with await psycopg.AsyncConnection.connect(host=settings.postgres_host,
+                                                     dbname=settings.postgres_dbname,
+                                                     user=settings.postgres_user,
+                                                     password=settings.postgres_password
+                                                     ) as connection:
+        cursor = await connection.execute(
+            "SELECT coalesce(pg_total_relation_size(to_regclass('perms')), 0)"
+        )
+        (size,) = await cursor.fetchone()
+        return size
+
+
+async def mongodb_bytes(settings) -> int:
+    from pymongo.errors import OperationFailure
+
+    from per_object_permissions.backends import mongodb_backend
+
+    client = mongodb_backend.client_factory(settings.mongo_user, settings.mongo_password,
+                                            settings.mongo_host)()
+    try:
+        stats = await client.db.command("collStats", "perms")
+    except OperationFailure:
+        return 0
+    finally:
+        client.close()
+    return stats["size"] + stats["totalIndexSize"]
+
+
+async def redis_bytes(settings) -> int:
+    import redis.asyncio as redis
+
+    connection = redis.Redis(host=settings.redis_host)
+    try:
+        return (await connection.info("memory"))["used_memory"]
+    finally:
+        await connection.close()
+
+
+# Backends whose triples are stored by a server, and how to ask it for their size
+SERVER_BYTES = {
+    "postgres": postgres_bytes,
+    "mongodb": mongodb_bytes,
+    "redis-server": redis_bytes,
+    "neo4j": None,
+}
+
+
+@dataclass
+class Measurement:
+    backend: str
+    size: int
+    load_seconds: float
+    rss_bytes_per_triple: Optional[float]
+    traced_bytes_per_triple: Optional[float]
+    server_bytes_per_triple: Optional[float]
+    read_subject_p50_ms: float
+    read_subject_p95_ms: float
+    read_object_p50_ms: float
+    read_object_p95_ms: float
+    exists_p50_ms: float
+    exists_p95_ms: float
+
+
+class Footprint:
+    """Measures the memory used since it was created, in process and on a server."""
+
+    def __init__(self, trace: bool, server_bytes=None, settings=None):
+        self._trace = trace
+        self._server_bytes = server_bytes
+        self._settings = settings
+
+    async def start(self):
+        gc.collect()
+        if self._trace:
+            tracemalloc.start()
+        self._rss = current_rss()
+        self._server = await self._server_bytes(self._settings) if self._server_bytes else None
+
+    async def bytes_used(self) -> tuple[Optional[int], Optional[int], Optional[int]]:
+        """Returns the growth in RSS, traced allocations and server memory."""
+        gc.collect()
+        rss = current_rss()
+        return (
+            rss - self._rss if rss is not None and self._rss is not None else None,
+            tracemalloc.get_traced_memory()[0] if self._trace else None,
+            (await self._server_bytes(self._settings) - self._server
+             if self._server_bytes else None),
+        )
+
+    def stop(self):
+        if self._trace:
+            tracemalloc.stop()
+
+
+async def time_queries(call, count: int) -> tuple[float, float]:
+    """Returns the p50 and p95 latency in milliseconds of count calls."""
+    latencies = []
+    for _ in range(count):
+        started = time.perf_counter()
+        await call()
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000
+
+
+async def measure_queries(backend, dataset: Dataset, size: int, count: int,
+                          rng: random.Random) -> dict[str, float]:
+    def sampled() -> Triple:
+        return dataset.triple(rng.randrange(size))
+
+    timings = {}
+    timings["read_subject"] = await time_queries(
+        lambda: backend.read(subject_uuids=[sampled().subject_uuid]), count
+    )
+    timings["read_object"] = await time_queries(
+        lambda: backend.read(object_uuids=[sampled().object_uuid]), count
+    )
+    timings["exists"] = await time_queries(lambda: backend.exists(*sampled()), count)
+    return {f"{name}_{stat}_ms": value for name, (p50, p95) in timings.items()
+            for stat, value in (("p50", p50), ("p95", p95))}
+
+
+async def benchmark(name: str, args: argparse.Namespace) -> list[Measurement]:
+    dataset = Dataset(args.triples_per_subject, args.objects, args.predicates)
+    rng = random.Random(args.seed)
+    measurements = []
+    with use_backend(name):
+        settings = api.get_settings()
+        module_path, class_name = settings.backend.split("::")
+        backend = getattr(import_module(module_path), class_name)(settings=settings)
+        # Backends with connection pools and tables set them up at startup, as in the app
+        if hasattr(backend, "startup"):
+            await backend.startup()
+        await backend.delete(returning=False)
+        in_process = name not in SERVER_BYTES
+        footprint = Footprint(trace=args.tracemalloc and in_process,
+                              server_bytes=SERVER_BYTES.get(name), settings=settings)
+        await footprint.start()
+        loaded, load_seconds = 0, 0.0
+        try:
+            for size in sorted(args.sizes):
+                for start in range(loaded, size, CREATE_CHUNK_SIZE):
+                    chunk = list(dataset.triples(start, min(start + CREATE_CHUNK_SIZE, size)))
+                    started = time.perf_counter()
+                    await backend.create(chunk, returning=False)
+                    load_seconds += time.perf_counter() - started
+                    del chunk
+                loaded = size
+
+                rss, traced, server = await footprint.bytes_used()
+                latencies = await measure_queries(backend, dataset, size, args.queries, rng)
+                measurements.append(Measurement(
+                    backend=name,
+                    size=size,
+                    load_seconds=load_seconds,
+                    rss_bytes_per_triple=rss / size if rss is not None else None,
+                    traced_bytes_per_triple=traced / size if traced is not None else None,
+                    server_bytes_per_triple=server / size if server is not None else None,
+                    **latencies,
+                ))
+                print_measurement(measurements[-1])
+        finally:
+            footprint.stop()
+            await backend.delete(returning=False)
+            if hasattr(backend, "shutdown"):
+                await backend.shutdown()
+    return measurements
+
+
+def _format(value: Optional[float], width: int, precision: int) -> str:
+    return f"{'n/a':>{width}}" if value is None else f"{value:>{width}.{precision}f}"
+
+
+HEADER = (f"{'BACKEND':<15}{'TRIPLES':>10}{'LOAD_S':>10}{'RSS_B':>9}{'TRACED_B':>10}"
+          f"{'SERVER_B':>10}{'SUBJECT_MS':>12}{'OBJECT_MS':>11}{'EXISTS_MS':>11}")
+
+
+def print_measurement(measurement: Measurement):
+    print(f"{measurement.backend:<15}{measurement.size:>10}"
+          f"{measurement.load_seconds:>10.2f}"
+          f"{_format(measurement.rss_bytes_per_triple, 9, 1)}"
+          f"{_format(measurement.traced_bytes_per_triple, 10, 1)}"
+          f"{_format(measurement.server_bytes_per_triple, 10, 1)}"
+          f"{measurement.read_subject_p50_ms:>12.3f}"
+          f"{measurement.read_object_p50_ms:>11.3f}"
+          f"{measurement.exists_p50_ms:>11.3f}", flush=True)
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--backends", nargs="+", default=list(DEFAULT_BACKENDS),
+                        help=f"Names from {', '.join(BACKENDS)}, or module::Class paths. "
+                             f"Backends with servers have all of their triples deleted.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES),
+                        help="Numbers of triples at which to measure.")
+    parser.add_argument("--queries", type=int, default=100,
+                        help="Number of each kind of query timed at each size.")
+    parser.add_argument("--triples-per-subject", type=int, default=10)
+    parser.add_argument("--objects", type=int, default=100000)
+    parser.add_argument("--predicates", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tracemalloc", action=argparse.BooleanOptionalAction, default=True,
+                        help="Trace allocations of backends that store triples in process.")
+    parser.add_argument("--json", metavar="PATH",
+                        help="Also write the measurements to a JSON file.")
+    parser.add_argument("--allow-destroy", action="store_true",
+                        help="Allow running against servers, deleting all of their triples.")
+    args = parser.parse_args(argv)
+    check_destructive(parser, args)
+    if args.triples_per_subject > args.objects:
+        parser.error("--triples-per-subject cannot be more than --objects")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print("Memory is in bytes per triple and query latency is the median.")
+    print(HEADER)
+    measurements = []
+    for backend in args.backends:
+        measurements.extend(asyncio.run(benchmark(backend, args)))
+    if args.json:
+        with open(args.json, "w") as fileobj:
+            json.dump([asdict(measurement) for measurement in measurements], fileobj, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,107 @@
+"""Compares the durations of the integration tests across backends and runs.
+
+Each junit XML file in the output directory holds one run of the tests
+against one backend, named after the backend. Repeated runs are named
+with a suffix, e.g. postgres.xml, postgres.2.xml and postgres.3.xml, and
+the median of their durations is used for each test.
+
+With --save-baseline the medians, and the median absolute deviations
+(MAD) of the runs, are written to a baseline file. With --check the runs
+are compared with the baseline, and the script exits with status 1 if
+any test slowed down by more than the noise allows: the larger of
+--mads scaled MADs, --min-change of the baseline median and
+--min-seconds.
+"""
+import argparse
+import json
+import math
 import os
+import statistics
+import sys
 from collections import defaultdict
 
 import junitparser
 
+DEFAULT_OUTPUT_DIR = './test_output'
+DEFAULT_BASELINE = './test_baseline.json'
+
+# Scales a MAD to estimate the standard deviation of normally distributed durations
+MAD_SCALE = 1.4826
+
 
-def main():
-    dirpath, _, filenames = next(os.walk("./test_output"))
-    results_by_backend = {}
-    for filename in filenames:
-        backend_name, _ = os.path.splitext(filename)
+def read_runs(dirpath):
+    """Returns the durations of each backend's tests, as lists with one duration per run."""
+    durations = defaultdict(lambda: defaultdict(list))
+    for filename in sorted(os.listdir(dirpath)):
+        if not filename.endswith('.xml'):
+            continue
+        backend_name = filename.split('.')[0]
         results = junitparser.JUnitXml.fromfile(os.path.join(dirpath, filename))
-        test_suite = next(iter(results))
-        results_by_backend[backend_name] = test_suite
+        for test_suite in results:
+            for result in test_suite:
+                durations[backend_name][f'{result.classname}::{result.name}'].append(result.time)
+    return durations
+
+
+def summarise(times):
+    median = statistics.median(times)
+    mad = statistics.median(abs(time - median) for time in times)
+    return {'median': median, 'mad': mad, 'runs': len(times)}
+
+
+def summarise_runs(durations):
+    return {backend_name: {test_name: summarise(times) for test_name, times in sorted(tests.items())}
+            for backend_name, tests in sorted(durations.items())}
+
+
+def threshold(baseline, current, mads, min_change, min_seconds):
+    """Returns how much a test's median may change before it is not noise."""
+    noise = MAD_SCALE * math.hypot(baseline['mad'], current['mad'])
+    return max(mads * noise, min_change * baseline['median'], min_seconds)
+
+
+def compare(baseline, summaries, mads, min_change, min_seconds):
+    """Returns rows of tests whose median changed by more than the threshold."""
+    rows = []
+    for backend_name, tests in summaries.items():
+        for test_name, current in tests.items():
+            base = baseline.get(backend_name, {}).get(test_name)
+            if base is None:
+                continue
+            change = current['median'] - base['median']
+            if abs(change) <= threshold(base, current, mads, min_change, min_seconds):
+                continue
+            rows.append({'backend': backend_name, 'test': test_name,
+                         'baseline': base['median'], 'current': current['median'],
+                         'change': change,
+                         'ratio': (base['median'] / current['median']
+                                   if current['median'] else math.inf)})
+    return rows
 
-    results_by_test = defaultdict(list)
-    for backend_name, results in results_by_backend.items():
-        for result in results:
-            results_by_test[f'{result.classname}::{result.name}'].append((result.time, backend_name))
 
-    durations = sorted((sum(test.time for test in tests), name)
-                       for name, tests in results_by_backend.items())
+def print_changes(title, rows):
+    print(f'\n{title}')
+    if not rows:
+        print('  none')
+        return
+    print(f'  {"BACKEND": <15} {"BASELINE": >10} {"CURRENT": >10} {"SPEEDUP": >8}  TEST')
+    for row in rows:
+        print(f'  {row["backend"]: <15} {row["baseline"]: >9.3f}s {row["current"]: >9.3f}s '
+              f'{row["ratio"]: >7.2f}x  {row["test"]}')
+
+
+def print_durations(summaries):
+    durations = sorted((sum(test['median'] for test in tests.values()), name)
+                       for name, tests in summaries.items())
     print('BACKEND_NAME         TOTAL_DURATION')
     for duration, backend_name in durations:
         print(f'{backend_name: <20} {duration:0.3f} seconds')
 
+    results_by_test = defaultdict(list)
+    for backend_name, tests in summaries.items():
+        for test_name, summary in tests.items():
+            results_by_test[test_name].append((summary['median'], backend_name))
+
     print('\n\nFASTEST DURATIONS FOR EACH TEST')
     for test_name, results in sorted(results_by_test.items()):
         print(f'\n{test_name}')
@@ -31,5 +109,66 @@ def main():
             print(f'  {backend}: {time:0.3f} seconds')
 
 
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--output-dir', default=DEFAULT_OUTPUT_DIR,
+                        help='Directory of junit XML files, one per backend and run.')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help='JSON file of baseline durations.')
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument('--save-baseline', action='store_true',
+                        help="Write the runs' durations to the baseline file, replacing the "
+                             "backends they cover.")
+    action.add_argument('--check', action='store_true',
+                        help='Compare the runs with the baseline and fail on slowdowns.')
+    parser.add_argument('--mads', type=float, default=3.0,
+                        help='Changes within this many scaled MADs are noise.')
+    parser.add_argument('--min-change', type=float, default=0.1,
+                        help='Changes within this fraction of the baseline are noise.')
+    parser.add_argument('--min-seconds', type=float, default=0.005,
+                        help='Changes within this many seconds are noise.')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    summaries = summarise_runs(read_runs(args.output_dir))
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as fileobj:
+                baseline = json.load(fileobj)
+        baseline.update(summaries)
+        with open(args.baseline, 'w') as fileobj:
+            json.dump(baseline, fileobj, indent=2, sort_keys=True)
+        print(f'Saved baseline durations of {", ".join(summaries)} to {args.baseline}')
+        return 0
+
+    if not args.check:
+        print_durations(summaries)
+        return 0
+
+    with open(args.baseline) as fileobj:
+        baseline = json.load(fileobj)
+    changes = compare(baseline, summaries, args.mads, args.min_change, args.min_seconds)
+    slowdowns = sorted((row for row in changes if row['change'] > 0),
+                       key=lambda row: row['ratio'])
+    speedups = sorted((row for row in changes if row['change'] < 0),
+                      key=lambda row: -row['ratio'])
+    print_changes('SLOWDOWNS', slowdowns)
+    print_changes('SPEEDUPS', speedups)
+
+    missing = sorted(f'{backend_name}::{test_name}'
+                     for backend_name, tests in summaries.items()
+                     for test_name in tests.keys() - baseline.get(backend_name, {}).keys())
+    if missing:
+        print(f'\n{len(missing)} tests have no baseline:')
+        for name in missing:
+            print(f'  {name}')
+
+    return 1 if slowdowns else 0
+
+
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""Micro-batching of small backend queries that arrive at about the same time.
+
+Under load, many requests each check one triple or read one subject's
+triples, paying a backend round trip apiece. A Batcher collects these
+for a short window, or until it has a full batch, then makes one backend
+query for all of them and hands each caller its own part of the result.
+With no window, it collects what arrives within one event loop iteration.
+"""
+import asyncio
+from collections import defaultdict
+from typing import Awaitable, Callable, Generic, Optional, Sequence, TypeVar
+
+from per_object_permissions import protocols
+from per_object_permissions.uuid_arrays import UUIDArray, uuid_strings
+
+K = TypeVar("K")
+V = TypeVar("V")
+
+
+class Batcher(Generic[K, V]):
+    """Collects items requested at about the same time and loads them together.
+
+    The batch function is given the items in the order they were requested
+    and returns one result for each.
+    """
+
+    def __init__(self, load_batch: Callable[[list[K]], Awaitable[Sequence[V]]],
+                 window: float = 0.0, max_size: int = 1000):
+        self._load_batch = load_batch
+        self._window = window
+        self._max_size = max_size
+        self._items: list[K] = []
+        self._futures: list[asyncio.Future] = []
+        self._handle: Optional[asyncio.Handle] = None
+        self._tasks: set[asyncio.Task] = set()
+
+    async def load(self, item: K) -> V:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._items.append(item)
+        self._futures.append(future)
+        if len(self._items) >= self._max_size:
+            self._dispatch()
+        elif self._handle is None:
+            if self._window > 0:
+                self._handle = loop.call_later(self._window, self._dispatch)
+            else:
+                self._handle = loop.call_soon(self._dispatch)
+        return await future
+
+    def _dispatch(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+        items, futures = self._items, self._futures
+        self._items, self._futures = [], []
+        if items:
+            task = asyncio.ensure_future(self._run(items, futures))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, items: list[K], futures: list[asyncio.Future]):
+        try:
+            results = await self._load_batch(items)
+        except Exception as error:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(error)
+            return
+        except BaseException:
+            for future in futures:
+                future.cancel()
+            raise
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+
+
+async def check_batch(backend: protocols.PerObjectPermissionBackend,
+                      perms: list[protocols.PermTriple]) -> list[bool]:
+    """Checks the triples with one backend query."""
+    if len(perms) == 1:
+        perm = perms[0]
+        return [await backend.exists(perm.subject_uuid, perm.predicate, perm.object_uuid)]
+    return list(await backend.check(perms))
+
+
+def _union(filters: list) -> Optional[set]:
+    """Returns the union of the filter values, or None if any filter is empty."""
+    if not all(filters):
+        return None
+    return set().union(*filters)
+
+
+async def read_subjects_batch(backend: protocols.PerObjectPermissionBackend,
+                              queries: list[dict]) -> list[list[protocols.PermTriple]]:
+    """Answers reads of one subject each with a single backend read.
+
+    The combined read asks for every subject, and for the union of the
+    queries' predicates and objects, so each query's triples are among
+    its results. They are then filtered down to each query's own filters.
+    """
+    if len(queries) == 1:
+        return [list(await backend.read(**queries[0]))]
+
+    subjects = [uuid_strings(query["subject_uuids"])[0] for query in queries]
+    predicates = _union([query["predicates"] for query in queries])
+    object_filters = [set(uuid_strings(query["object_uuids"] or ())) for query in queries]
+    objects = _union(object_filters)
+    triples = await backend.read(
+        subject_uuids=UUIDArray(sorted(set(subjects))),
+        predicates=sorted(predicates) if predicates else None,
+        object_uuids=UUIDArray(sorted(objects)) if objects else None,
+    )
+
+    by_subject = defaultdict(list)
+    for triple in triples:
+        by_subject[str(triple.subject_uuid)].append(triple)
+    results = []
+    for subject, query, object_filter in zip(subjects, queries, object_filters):
+        matches = by_subject[subject]
+        if query["predicates"]:
+            query_predicates = set(query["predicates"])
+            matches = [triple for triple in matches if triple.predicate in query_predicates]
+        if object_filter:
+            matches = [triple for triple in matches
+                       if str(triple.object_uuid) in object_filter]
+        results.append(matches)
+    return results
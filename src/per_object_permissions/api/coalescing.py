@@ -0,0 +1,59 @@
+"""Coalescing of identical backend queries that are in flight at once.
+
+When many clients ask the same question at the same moment, e.g. everyone
+opening a popular document, only the first caller queries the backend and
+the rest await its result. A query is only shared while it is running, so
+no caller receives a result that was complete before it asked. Nor is a
+query shared across a write: keys include the number of writes finished
+when the query was made, so a client reading its own write never joins a
+query that began before the write finished.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable, TypeVar
+
+from per_object_permissions.uuid_arrays import UUIDArray
+
+T = TypeVar("T")
+
+
+def query_key(operation: str, **filters: Any) -> tuple[Hashable, ...]:
+    """Returns a key that is equal for queries matching the same triples."""
+    key = [operation]
+    for name, value in sorted(filters.items()):
+        if isinstance(value, UUIDArray):
+            value = value.strings
+        if isinstance(value, (list, tuple, set, frozenset)):
+            value = frozenset(value) or None
+        key.append((name, value))
+    return tuple(key)
+
+
+class SingleFlight:
+    """Shares one call among concurrent callers asking with the same key."""
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Future] = {}
+        self.writes = 0
+
+    def wrote(self):
+        """Stops calls made before now being shared with callers asking from now on."""
+        self.writes += 1
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        """Awaits the call in flight for the key, or makes it if there is none.
+
+        A caller being cancelled does not cancel the call shared with the others.
+        """
+        future = self._calls.get(key)
+        if future is None or future.done():
+            future = self._calls[key] = asyncio.ensure_future(call())
+            future.add_done_callback(lambda done: self._forget(key, done))
+        return await asyncio.shield(future)
+
+    def _forget(self, key: Hashable, future: asyncio.Future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
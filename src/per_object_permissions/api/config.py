@@ -1,23 +1,49 @@
+from typing import Optional
+
 import pydantic
 
 
 class Settings(pydantic.BaseSettings):
     backend: str = "per_object_permissions.backends.in_memory_backend::InMemoryBackend"
 
+    in_memory_data_dir: Optional[str] = None
+    in_memory_snapshot_interval: float = 300.0
+
+    shared_memory_path: str = "/dev/shm/per_object_permissions"
+    shared_memory_initial_capacity: int = 65536
+
+    ingest_chunk_size: int = 10000
+    read_page_size: int = 1000
+    coalesce_reads: bool = True
+    batch_window_ms: float = 0.0
+    batch_max_size: int = 1000
+    server_timing: bool = False
+    slow_query_seconds: float = 1.0
+    warm_up: bool = False
+
+    cache_enabled: bool = False
+    cache_max_entries: int = 10000
+    cache_ttl: float = 5.0
+
     redis_host: str = "redis"
+    redis_pool_size: int = 50
 
     postgres_host: str = "postgres"
     postgres_dbname: str = "per_object_perms"
     postgres_user: str = "username"
     postgres_password: str = "password"
+    postgres_pool_min_size: int = 1
+    postgres_pool_max_size: int = 10
 
     mongo_host: str = "mongo"
     mongo_user: str = "username"
     mongo_password: str = "password"
+    mongo_pool_size: int = 100
 
     neo4j_host: str = "neo4j"
     neo4j_user: str = "user"
     neo4j_password: str = "password"
+    neo4j_pool_size: int = 100
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,59 @@
+"""ASGI middleware recording request metrics for each endpoint."""
+import time
+
+from per_object_permissions import metrics
+
+# Label for paths that are not routes, so that they cannot add unbounded label values
+OTHER_ENDPOINT = "other"
+
+
+class MetricsMiddleware:
+    """Records the latency, status, body sizes and concurrency of requests.
+
+    Bodies are measured as they are received and sent, so streamed
+    requests and responses are counted in full without being buffered.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._paths = None
+
+    def _endpoint(self, scope) -> str:
+        if self._paths is None:
+            self._paths = {route.path for route in scope["app"].routes}
+        path = scope["path"]
+        return path if path in self._paths else OTHER_ENDPOINT
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        endpoint = self._endpoint(scope)
+        request_bytes, response_bytes, status = 0, 0, 500
+
+        async def counting_receive():
+            nonlocal request_bytes
+            message = await receive()
+            request_bytes += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal response_bytes, status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_bytes += len(message.get("body", b""))
+            await send(message)
+
+        in_flight = metrics.HTTP_IN_FLIGHT.labels(endpoint)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            metrics.HTTP_SECONDS.labels(endpoint).observe(time.perf_counter() - started)
+            metrics.HTTP_REQUESTS.labels(endpoint, str(status)).inc()
+            metrics.HTTP_REQUEST_BYTES.labels(endpoint).observe(request_bytes)
+            metrics.HTTP_RESPONSE_BYTES.labels(endpoint).observe(response_bytes)
+            in_flight.dec()
@@ -4,16 +4,55 @@ A RESTful API would be cumbersome for use cases like bulk creation and deletion.
 Additionally, it would not add much value to identify permissions in URLs.
 A RPC approach is used instead.
 """
+import asyncio
+import base64
+import contextlib
+import json
+import logging
+import time
 from functools import cache
 from importlib import import_module
-from typing import List
+from typing import Iterable, List, Optional
 
 import fastapi
+from fastapi.exceptions import RequestValidationError
+from fastapi.utils import create_response_field
+from pydantic.error_wrappers import ErrorWrapper
 
-from per_object_permissions import protocols
-from per_object_permissions.api import config, schema
+from per_object_permissions import cursors, metrics, protocols
+from per_object_permissions.api import (batching, coalescing, config, instrumentation, packed,
+                                        schema, serialization, timing)
+from per_object_permissions.backends import caching_backend, instrumented_backend
 
 app = fastapi.FastAPI()
+app.add_middleware(instrumentation.MetricsMiddleware)
+app.add_middleware(timing.ServerTimingMiddleware, enabled=lambda: get_settings().server_timing)
+
+# Set once the backend has started, and cleared when it stops
+app.state.ready = False
+
+read_flights = coalescing.SingleFlight()
+
+logger = logging.getLogger(__name__)
+
+PACKED_CONTENT = {packed.MEDIA_TYPE: {"schema": {"type": "string", "format": "binary"}}}
+PACKED_RESPONSE = {200: {"content": PACKED_CONTENT,
+                         "description": "Packed binary triples when requested with the "
+                                        "Accept header."}}
+STREAMED_RESPONSE = {200: {"content": {**PACKED_CONTENT, serialization.NDJSON_MEDIA_TYPE: {}},
+                           "description": "Packed binary triples, or one JSON triple "
+                                          "per line, when requested with the Accept header. "
+                                          "Paged reads send next_cursor in the Next-Cursor "
+                                          "header."}}
+TRIPLES_BODY = {"requestBody": {
+    "required": True,
+    "content": {
+        "application/json": {
+            "schema": {"type": "array", "items": {"$ref": "#/components/schemas/PermTriple"}}
+        },
+        **PACKED_CONTENT,
+    },
+}}
 
 
 @cache
@@ -21,30 +60,334 @@ def get_settings():
     return config.Settings()
 
 
+def triples_response(key: str, triples: Iterable[protocols.PermTriple],
+                     accept: Optional[str], **fields) -> fastapi.Response:
+    """Responds with triples written straight to JSON or packed, skipping the response model.
+
+    The endpoint's response model still documents the JSON schema. Packed
+    responses carry any other fields as headers, e.g. Next-Cursor.
+    """
+    with timing.phase("serialize"):
+        if packed.accepts_packed(accept):
+            headers = {name.replace("_", "-").title(): value
+                       for name, value in fields.items() if value is not None}
+            return fastapi.Response(packed.encode(triples), media_type=packed.MEDIA_TYPE,
+                                    headers=headers)
+        return fastapi.Response(serialization.json_triples(key, triples, **fields),
+                                media_type="application/json")
+
+
+TRIPLES_FIELD = create_response_field(name="perms", type_=List[schema.PermTriple])
+
+
+async def triples_body(request: fastapi.Request) -> List[protocols.PermTriple]:
+    """Parses a list of triples from a JSON or packed request body."""
+    with timing.phase("parse"):
+        return await _parse_triples_body(request)
+
+
+async def _parse_triples_body(request: fastapi.Request) -> List[protocols.PermTriple]:
+    body = await request.body()
+    if packed.is_packed(request.headers.get("content-type")):
+        try:
+            return packed.decode(body)
+        except ValueError as error:
+            raise fastapi.HTTPException(status_code=422, detail=str(error))
+    try:
+        data = json.loads(body)
+    except ValueError as error:
+        raise RequestValidationError([ErrorWrapper(error, loc=("body",))])
+    try:
+        return serialization.parse_json_triples(data)
+    except ValueError:
+        pass
+    # Leave coercion and error reporting to pydantic
+    perms, errors = TRIPLES_FIELD.validate(data, {}, loc=("body",))
+    if errors:
+        raise RequestValidationError(errors if isinstance(errors, list) else [errors])
+    return perms
+
+
 @cache
 def get_backend() -> protocols.PerObjectPermissionBackend:
     settings = get_settings()
     module_path, class_name = settings.backend.split("::")
     backend_class = getattr(import_module(module_path), class_name)
-    return backend_class(settings=settings)
+    with timing.phase("backend_init"):
+        backend = instrumented_backend.InstrumentedBackend(
+            backend_class(settings=settings),
+            slow_query_seconds=settings.slow_query_seconds,
+        )
+    if settings.cache_enabled:
+        backend = caching_backend.CachingBackend(backend, settings=settings)
+    return backend
+
 
+async def start_backend():
+    """Creates the backend and runs its startup, e.g. opening its connection pool and
+    creating its tables, so that the first requests pay for neither.
 
-@app.post("/create-perms", response_model=schema.CreateResults)
-async def create_perms(perms: List[schema.PermTriple]):
+    With the warm_up setting, every triple is counted too, reading the data
+    and indexes into the database's cache before the app reports ready.
+    """
     backend = get_backend()
-    created_perms = await backend.create(perms)
-    return {"created": [schema.PermTriple.from_orm(perm) for perm in created_perms]}
+    startup = getattr(backend, "startup", None)
+    if startup is not None:
+        await startup()
+    if get_settings().warm_up:
+        count = await backend.count()
+        logger.info("Warmed up the backend by counting %d triples", count)
+    app.state.ready = True
+
+
+def _log_startup_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("The backend failed to start", exc_info=task.exception())
 
 
-@app.post("/read-perms", response_model=schema.ReadResults)
-async def read_perms(query: schema.PermQuery):
+@app.on_event("startup")
+async def begin_backend_startup():
+    """Starts the backend in the background, so that the app serves /ready, with a 503,
+    while the backend waits for its database."""
+    app.state.backend_startup = asyncio.ensure_future(start_backend())
+    app.state.backend_startup.add_done_callback(_log_startup_failure)
+
+
+@app.on_event("shutdown")
+async def stop_backend():
+    app.state.ready = False
+    app.state.backend_startup.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await app.state.backend_startup
+    shutdown = getattr(get_backend(), "shutdown", None)
+    if shutdown is not None:
+        await shutdown()
+
+
+async def coalesced(operation: str, call, **arguments):
+    """Awaits the backend call, sharing it with identical calls already in flight."""
+    if not get_settings().coalesce_reads:
+        return await call(**arguments)
+    key = (read_flights.writes, coalescing.query_key(operation, **arguments))
+    return await read_flights.do(key, lambda: call(**arguments))
+
+
+@contextlib.contextmanager
+def writing():
+    """Counts a write once it finishes, failed or not, so that later reads are not
+    coalesced with reads that may have missed it."""
+    try:
+        yield
+    finally:
+        read_flights.wrote()
+
+
+def _batcher(load_batch) -> batching.Batcher:
+    settings = get_settings()
+    return batching.Batcher(lambda items: load_batch(get_backend(), items),
+                            window=settings.batch_window_ms / 1000,
+                            max_size=settings.batch_max_size)
+
+
+@cache
+def get_check_batcher() -> batching.Batcher:
+    return _batcher(batching.check_batch)
+
+
+@cache
+def get_read_batcher() -> batching.Batcher:
+    return _batcher(batching.read_subjects_batch)
+
+
+async def batched_read(**filters) -> List[protocols.PermTriple]:
+    return await get_read_batcher().load(filters)
+
+
+def cache_stats() -> dict[tuple, int]:
+    backend = get_backend()
+    if not isinstance(backend, caching_backend.CachingBackend):
+        return {}
+    return {(event,): count for event, count in backend.stats.items() if event != "entries"}
+
+
+metrics.Collected("perms_cache_events_total", "Cache hits, misses, invalidations and evictions.",
+                  "counter", cache_stats, labelnames=["event"])
+metrics.Collected("perms_coalesced_reads_in_flight",
+                  "Distinct backend reads currently shared between requests.",
+                  "gauge", lambda: {(): read_flights.in_flight})
+
+
+RETURN_QUERY = fastapi.Query(schema.Return.full, alias="return",
+                             description="Respond with the triples, their count or nothing.")
+
+
+@app.post("/create-perms", response_model=schema.CreateResults,
+          response_model_exclude_unset=True, responses=PACKED_RESPONSE,
+          openapi_extra=TRIPLES_BODY)
+async def create_perms(perms: List[protocols.PermTriple] = fastapi.Depends(triples_body),
+                       accept: Optional[str] = fastapi.Header(None),
+                       return_: schema.Return = RETURN_QUERY):
+    timing.parsed()
+    backend = get_backend()
+    try:
+        if return_ is not schema.Return.full:
+            with timing.phase("backend"), writing():
+                count = await backend.create(perms, returning=False)
+            return {"count": count} if return_ is schema.Return.count else {}
+        with timing.phase("backend"), writing():
+            created_perms = await backend.create(perms)
+    except protocols.UnsupportedTriple as error:
+        raise fastapi.HTTPException(status_code=422, detail=str(error))
+    return triples_response("created", created_perms, accept)
+
+
+@app.post(
+    "/ingest-perms",
+    response_model=schema.IngestResults,
+    openapi_extra={"requestBody": {
+        "required": True,
+        "description": "One JSON permission triple per line, or packed triples.",
+        "content": {
+            serialization.NDJSON_MEDIA_TYPE: {
+                "schema": {"$ref": "#/components/schemas/PermTriple"}
+            },
+            **PACKED_CONTENT,
+        },
+    }},
+)
+async def ingest_perms(request: fastapi.Request):
+    """Create triples from an NDJSON or packed body in fixed-size chunks as it arrives.
+
+    If a line is invalid, the chunks created before it are kept and the
+    error reports how many triples were ingested.
+    """
     backend = get_backend()
-    perms = await backend.read(**query.dict())
-    return {"results": [schema.PermTriple.from_orm(perm) for perm in perms]}
+    chunk_size = get_settings().ingest_chunk_size
+    started = time.perf_counter()
+    ingested, chunks, chunk = 0, 0, []
 
+    async def flush():
+        nonlocal ingested, chunks, chunk
+        with writing():
+            await backend.create(chunk, returning=False)
+        ingested += len(chunk)
+        chunks += 1
+        chunk = []
+        elapsed = time.perf_counter() - started
+        logger.info("Ingested %d triples in %d chunks (%.0f triples/s)",
+                    ingested, chunks, ingested / elapsed)
 
-@app.post("/delete-perms", response_model=schema.DeleteResults)
-async def delete_perms(query: schema.PermQuery):
+    try:
+        if packed.is_packed(request.headers.get("content-type")):
+            triples = packed.aiter_decode(request.stream())
+        else:
+            triples = serialization.aiter_ndjson_triples(request.stream())
+        async for triple in triples:
+            chunk.append(triple)
+            if len(chunk) == chunk_size:
+                await flush()
+    except ValueError as error:
+        raise fastapi.HTTPException(
+            status_code=422,
+            detail={"message": str(error), "ingested": ingested, "chunks": chunks},
+        )
+    if chunk:
+        await flush()
+
+    return {"ingested": ingested, "chunks": chunks,
+            "seconds": time.perf_counter() - started}
+
+
+@app.post("/read-perms", response_model=schema.ReadResults,
+          response_model_exclude_unset=True, responses=STREAMED_RESPONSE)
+async def read_perms(
+    query: schema.ReadQuery,
+    accept: Optional[str] = fastapi.Header(None),
+    return_: schema.ReadReturn = fastapi.Query(schema.ReadReturn.full, alias="return",
+                                               description="Respond with the triples "
+                                                           "or their count."),
+):
+    timing.parsed()
+    backend = get_backend()
+    filters = query.dict(exclude={"limit", "cursor"})
+    if return_ is schema.ReadReturn.count:
+        with timing.phase("backend"):
+            return {"count": await coalesced("count", backend.count, **filters)}
+    if query.limit is not None or query.cursor is not None:
+        try:
+            with timing.phase("backend"):
+                perms, next_cursor = await coalesced(
+                    "read_page", backend.read_page, **filters,
+                    limit=query.limit or get_settings().read_page_size,
+                    cursor=query.cursor,
+                )
+        except cursors.InvalidCursor as error:
+            raise fastapi.HTTPException(status_code=422, detail=str(error))
+        return triples_response("results", perms, accept, next_cursor=next_cursor)
+    if serialization.accepts_ndjson(accept) and not packed.accepts_packed(accept):
+        return fastapi.responses.StreamingResponse(
+            serialization.aiter_ndjson(backend.stream(**filters)),
+            media_type=serialization.NDJSON_MEDIA_TYPE,
+        )
+    subject_uuids = filters["subject_uuids"]
+    read = batched_read if subject_uuids and len(subject_uuids) == 1 else backend.read
+    with timing.phase("backend"):
+        perms = await coalesced("read", read, **filters)
+    return triples_response("results", perms, accept)
+
+
+@app.post("/check-perm", response_model=schema.CheckResult)
+async def check_perm(perm: schema.PermTriple):
+    timing.parsed()
+    with timing.phase("backend"):
+        exists = await get_check_batcher().load(perm)
+    return {"exists": exists}
+
+
+@app.post("/check-perms", response_model=schema.CheckResults,
+          response_model_exclude_none=True)
+async def check_perms(perms: List[schema.PermTriple],
+                      as_bitmask: bool = fastapi.Query(False, alias="packed",
+                                                       description="Respond with the results "
+                                                                   "as a bitmask.")):
+    timing.parsed()
     backend = get_backend()
-    perms = await backend.delete(**query.dict())
-    return {"deleted": [schema.PermTriple.from_orm(perm) for perm in perms]}
+    with timing.phase("backend"):
+        results = await backend.check(perms)
+    if as_bitmask:
+        return {"bitmask": base64.b64encode(packed.pack_bits(results)).decode()}
+    return {"results": results}
+
+
+@app.post("/delete-perms", response_model=schema.DeleteResults,
+          response_model_exclude_unset=True, responses=STREAMED_RESPONSE)
+async def delete_perms(query: schema.PermQuery,
+                       accept: Optional[str] = fastapi.Header(None),
+                       return_: schema.Return = RETURN_QUERY):
+    timing.parsed()
+    backend = get_backend()
+    if return_ is not schema.Return.full:
+        with timing.phase("backend"), writing():
+            count = await backend.delete(**query.dict(), returning=False)
+        return {"count": count} if return_ is schema.Return.count else {}
+    with timing.phase("backend"), writing():
+        perms = await backend.delete(**query.dict())
+    if serialization.accepts_ndjson(accept) and not packed.accepts_packed(accept):
+        return fastapi.responses.StreamingResponse(
+            serialization.iter_ndjson(perms),
+            media_type=serialization.NDJSON_MEDIA_TYPE,
+        )
+    return triples_response("deleted", perms, accept)
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return fastapi.Response(metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+
+@app.get("/ready", include_in_schema=False)
+async def get_ready():
+    """Responds once the backend has started, for readiness probes."""
+    if not app.state.ready:
+        raise fastapi.HTTPException(status_code=503, detail="The backend has not started")
+    return {"ready": True}
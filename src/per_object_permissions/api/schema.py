@@ -1,8 +1,11 @@
+import enum
 import uuid
 from typing import List, Optional
 
 import pydantic
 
+from per_object_permissions.uuid_arrays import UUIDArray
+
 
 class PermTriple(pydantic.BaseModel):
     subject_uuid: uuid.UUID
@@ -13,19 +16,68 @@ class PermTriple(pydantic.BaseModel):
         orm_mode = True  # Allows creating from object attributes using from_orm
 
 
+class Return(str, enum.Enum):
+    """What a create or delete responds with: the triples, their count or nothing."""
+    full = "full"
+    count = "count"
+    none = "none"
+
+
+class ReadReturn(str, enum.Enum):
+    """What a read responds with: the triples or their count."""
+    full = "full"
+    count = "count"
+
+
 class PermQuery(pydantic.BaseModel):
-    subject_uuids: Optional[List[uuid.UUID]]
+    # UUID filters are validated in bulk and passed to backends as UUIDArrays
+    subject_uuids: Optional[UUIDArray]
     predicates: Optional[List[str]]
-    object_uuids: Optional[List[uuid.UUID]]
+    object_uuids: Optional[UUIDArray]
+
+
+class ReadQuery(PermQuery):
+    limit: Optional[int] = pydantic.Field(
+        gt=0,
+        description="The most triples to return, reading one page at a time. "
+                    "Paged reads are always returned as JSON.",
+    )
+    cursor: Optional[str] = pydantic.Field(
+        description="The next_cursor of the previous page."
+    )
+
+
+class CheckResult(pydantic.BaseModel):
+    exists: bool
+
+
+class CheckResults(pydantic.BaseModel):
+    results: Optional[List[bool]]
+    bitmask: Optional[str] = pydantic.Field(
+        description="Base64 encoded results, one bit per triple with the first "
+                    "triple in the least significant bit of the first byte."
+    )
 
 
 class CreateResults(pydantic.BaseModel):
-    created: List[PermTriple]
+    created: Optional[List[PermTriple]]
+    count: Optional[int]
+
+
+class IngestResults(pydantic.BaseModel):
+    ingested: int
+    chunks: int
+    seconds: float
 
 
 class ReadResults(pydantic.BaseModel):
-    results: List[PermTriple]
+    results: Optional[List[PermTriple]]
+    count: Optional[int]
+    next_cursor: Optional[str] = pydantic.Field(
+        description="Passed back to read the next page, or null after the last page."
+    )
 
 
 class DeleteResults(pydantic.BaseModel):
-    deleted: List[PermTriple]
+    deleted: Optional[List[PermTriple]]
+    count: Optional[int]
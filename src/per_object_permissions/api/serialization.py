@@ -0,0 +1,166 @@
+"""Serialisation of permission triples outside of pydantic response models.
+
+Triples from backends are written straight to JSON rather than being
+validated into models first, which dominates the cost of large responses.
+This is also used for streaming responses, where rows are written as they
+arrive from the backend, and for parsing streamed request bodies line by line.
+"""
+import json
+from collections import namedtuple
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Iterable, Iterator
+from uuid import UUID
+
+from per_object_permissions.protocols import PermTriple
+from per_object_permissions.uuid_arrays import UUIDArray
+
+Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+# Number of triples written to the response at once
+NDJSON_CHUNK_SIZE = 1000
+
+# Longest line of a streamed NDJSON body, far longer than any reasonable triple
+MAX_NDJSON_LINE_BYTES = 64 * 1024
+
+
+def accepts_ndjson(accept: str | None) -> bool:
+    return bool(accept) and NDJSON_MEDIA_TYPE in accept
+
+
+def triple_encoder() -> Callable[[PermTriple], str]:
+    """Returns a function writing a triple as a JSON object.
+
+    UUIDs and predicates repeat across the triples of a response, so their
+    encoded forms are cached for the lifetime of the encoder. Streams use a
+    new encoder for each chunk, so that their caches do not grow with the
+    whole stream.
+    """
+    uuid_strings = {}
+    predicate_strings = {}
+
+    def encode(triple: PermTriple) -> str:
+        subject_uuid, predicate, object_uuid = (triple.subject_uuid,
+                                                triple.predicate,
+                                                triple.object_uuid)
+        try:
+            subject_string = uuid_strings[subject_uuid]
+        except KeyError:
+            subject_string = uuid_strings[subject_uuid] = str(subject_uuid)
+        try:
+            object_string = uuid_strings[object_uuid]
+        except KeyError:
+            object_string = uuid_strings[object_uuid] = str(object_uuid)
+        try:
+            predicate_string = predicate_strings[predicate]
+        except KeyError:
+            predicate_string = predicate_strings[predicate] = json.dumps(predicate)
+        return (f'{{"subject_uuid":"{subject_string}",'
+                f'"predicate":{predicate_string},'
+                f'"object_uuid":"{object_string}"}}')
+
+    return encode
+
+
+def json_triples(key: str, triples: Iterable[PermTriple], **fields: Any) -> bytes:
+    """Writes a JSON object holding the triples as a list under the key, plus any fields."""
+    encoded = ",".join(map(triple_encoder(), triples))
+    extra = "".join(f",{json.dumps(name)}:{json.dumps(value)}"
+                    for name, value in fields.items())
+    return f'{{{json.dumps(key)}:[{encoded}]{extra}}}'.encode()
+
+
+def _ndjson_chunk(lines: list[str]) -> bytes:
+    return ("\n".join(lines) + "\n").encode()
+
+
+def iter_ndjson(triples: Iterable[PermTriple]) -> Iterator[bytes]:
+    encode = triple_encoder()
+    chunk = []
+    for triple in triples:
+        chunk.append(encode(triple))
+        if len(chunk) == NDJSON_CHUNK_SIZE:
+            yield _ndjson_chunk(chunk)
+            encode, chunk = triple_encoder(), []
+    if chunk:
+        yield _ndjson_chunk(chunk)
+
+
+def parse_json_triples(data: Any) -> list[Triple]:
+    """Parses decoded JSON triples with their UUIDs validated in bulk.
+
+    Only exactly typed input is accepted, raising ValueError otherwise,
+    so that anything unusual can be left to pydantic's validation.
+    """
+    if not isinstance(data, list):
+        raise ValueError("Expected a list of permission triples")
+    try:
+        subject_uuids = UUIDArray.parse([item["subject_uuid"] for item in data])
+        predicates = [item["predicate"] for item in data]
+        object_uuids = UUIDArray.parse([item["object_uuid"] for item in data])
+    except (TypeError, KeyError):
+        raise ValueError("Expected a list of permission triples")
+    if not all(type(predicate) is str for predicate in predicates):
+        raise ValueError("Expected the predicates to be strings")
+    return list(map(Triple, subject_uuids, predicates, object_uuids))
+
+
+def parse_ndjson_line(line: bytes) -> Triple:
+    """Parses one line of NDJSON into a triple, raising ValueError if it is invalid."""
+    try:
+        data = json.loads(line)
+        triple = Triple(UUID(data["subject_uuid"]),
+                        data["predicate"],
+                        UUID(data["object_uuid"]))
+    except (KeyError, TypeError, AttributeError) as error:
+        raise ValueError(f"Expected a JSON permission triple: {error!r}")
+    if not isinstance(triple.predicate, str):
+        raise ValueError("Expected the predicate to be a string")
+    return triple
+
+
+async def aiter_ndjson_triples(body: AsyncIterable[bytes],
+                               max_line_bytes: int = MAX_NDJSON_LINE_BYTES
+                               ) -> AsyncIterator[Triple]:
+    """Parses triples from NDJSON as the body arrives, skipping blank lines.
+
+    Raises ValueError for a line longer than max_line_bytes, rather than
+    buffering a body without newlines in memory.
+    """
+    line_number = 0
+    buffer = b""
+    async for data in body:
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            line_number += 1
+            _check_line_length(line, line_number, max_line_bytes)
+            if line.strip():
+                yield _parse_numbered_line(line, line_number)
+        _check_line_length(buffer, line_number + 1, max_line_bytes)
+    if buffer.strip():
+        yield _parse_numbered_line(buffer, line_number + 1)
+
+
+def _check_line_length(line: bytes, line_number: int, max_line_bytes: int):
+    if len(line) > max_line_bytes:
+        raise ValueError(f"Line {line_number}: Longer than {max_line_bytes} bytes")
+
+
+def _parse_numbered_line(line: bytes, line_number: int) -> Triple:
+    try:
+        return parse_ndjson_line(line)
+    except ValueError as error:
+        raise ValueError(f"Line {line_number}: {error}")
+
+
+async def aiter_ndjson(triples: AsyncIterable[PermTriple]) -> AsyncIterator[bytes]:
+    encode = triple_encoder()
+    chunk = []
+    async for triple in triples:
+        chunk.append(encode(triple))
+        if len(chunk) == NDJSON_CHUNK_SIZE:
+            yield _ndjson_chunk(chunk)
+            encode, chunk = triple_encoder(), []
+    if chunk:
+        yield _ndjson_chunk(chunk)
@@ -0,0 +1,100 @@
+"""Per-request timing of request handling phases, sent in a Server-Timing header.
+
+Timing is enabled for every request by the server_timing setting, or for
+one request by sending the X-Server-Timing header. Phases are timed
+around the code that runs them, e.g. parsing a body or querying the
+backend, and their durations are summed by name. Each phase is also
+logged at debug level.
+"""
+import contextlib
+import contextvars
+import logging
+import time
+from typing import Callable, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+REQUEST_HEADER = b"x-server-timing"
+
+_timings: contextvars.ContextVar[Optional["Timings"]] = contextvars.ContextVar("timings",
+                                                                              default=None)
+
+
+class Timings:
+    """Durations of the phases of handling one request, in seconds."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: dict[str, float] = {}
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+
+    def add_unattributed(self, name: str):
+        """Adds the time since the request started that no other phase accounts for."""
+        elapsed = time.perf_counter() - self.started
+        self.add(name, max(elapsed - sum(self.phases.values()), 0.0))
+
+    def header(self) -> str:
+        """Returns the Server-Timing header value, with durations in milliseconds."""
+        phases = {**self.phases, "total": time.perf_counter() - self.started}
+        return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in phases.items())
+
+
+@contextlib.contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Times the block as a phase of the current request, if it is being timed."""
+    timings = _timings.get()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - started
+        timings.add(name, seconds)
+        logger.debug("%s took %.3fms", name, seconds * 1000)
+
+
+def parsed():
+    """Attributes the time before an endpoint runs, e.g. receiving and validating the
+    body, to the parse phase."""
+    timings = _timings.get()
+    if timings is not None:
+        timings.add_unattributed("parse")
+
+
+class ServerTimingMiddleware:
+    """Times requests that ask for it and adds the Server-Timing header to their responses.
+
+    Phases that run after the response has started, such as writing a
+    streamed body, are not included.
+    """
+
+    def __init__(self, app, enabled: Callable[[], bool] = lambda: False):
+        self.app = app
+        self._enabled = enabled
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not (
+            self._enabled() or any(name == REQUEST_HEADER for name, _ in scope["headers"])
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        timings = Timings()
+        token = _timings.set(timings)
+
+        async def send_with_timings(message):
+            if message["type"] == "http.response.start":
+                header = timings.header()
+                logger.debug("%s %s: %s", scope["method"], scope["path"], header)
+                message = {**message, "headers": [*message.get("headers", []),
+                                                  (b"server-timing", header.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            _timings.reset(token)
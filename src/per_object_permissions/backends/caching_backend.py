@@ -0,0 +1,267 @@
+import time
+from collections import OrderedDict, defaultdict, namedtuple
+from typing import AsyncIterator, Callable, Hashable, Iterable, Optional
+from uuid import UUID
+
+from per_object_permissions.protocols import PermTriple, PerObjectPermissionBackend
+
+Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
+
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL = 5.0
+
+# Beyond this many triple and entry comparisons, a create clears the cache
+# rather than working out exactly which entries it affects.
+MAX_INVALIDATION_COMPARISONS = 1_000_000
+
+READ, COUNT, EXISTS = "read", "count", "exists"
+
+
+def _filter(values: Optional[Iterable]) -> Optional[frozenset]:
+    return frozenset(values) if values else None
+
+
+def _overlaps(first: Optional[frozenset], second: Optional[frozenset]) -> bool:
+    return first is None or second is None or not first.isdisjoint(second)
+
+
+def _matches(key: tuple, triple: PermTriple) -> bool:
+    _, subject_uuids, predicates, object_uuids = key
+    return ((subject_uuids is None or triple.subject_uuid in subject_uuids)
+            and (predicates is None or triple.predicate in predicates)
+            and (object_uuids is None or triple.object_uuid in object_uuids))
+
+
+class CachingBackend:
+    """Caches the reads, counts and checks of another backend.
+
+    Entries are keyed by the kind of query and its normalised filters, and
+    kept in a bounded LRU that also expires them after a time to live.
+    Creating or deleting triples invalidates just the entries whose filters
+    could match them, found through indexes of the entries by subject and
+    object. Reads that were in flight during a write are not cached.
+
+    Writes made by other processes are only seen once entries expire,
+    so the time to live bounds how stale a multi-worker deployment can be.
+    """
+
+    def __init__(self, backend: PerObjectPermissionBackend, settings=None,
+                 max_entries: int = None, ttl: float = None,
+                 clock: Callable[[], float] = time.monotonic):
+        if settings is not None:
+            max_entries = max_entries or settings.cache_max_entries
+            ttl = ttl if ttl is not None else settings.cache_ttl
+        self._backend = backend
+        self._max_entries = max_entries or DEFAULT_MAX_ENTRIES
+        self._ttl = DEFAULT_TTL if ttl is None else ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._by_subject = defaultdict(set)
+        self._by_object = defaultdict(set)
+        self._any_subject = set()
+        self._any_object = set()
+        self._writes = 0
+        self._stats = {"hits": 0, "misses": 0, "invalidations": 0, "evictions": 0}
+
+    def __getattr__(self, name: str):
+        if name == "_backend":
+            raise AttributeError(name)
+        return getattr(self._backend, name)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        """Counts of cache hits, misses, invalidated and evicted entries, and its size."""
+        return {**self._stats, "entries": len(self._entries)}
+
+    def _get(self, key: tuple):
+        """Returns the cached value, or None on a miss."""
+        try:
+            expires, value = self._entries[key]
+        except KeyError:
+            self._stats["misses"] += 1
+            return None
+        if expires <= self._clock():
+            self._drop(key)
+            self._stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self._stats["hits"] += 1
+        return value
+
+    def _put(self, key: tuple, value, writes: int):
+        """Caches the value, unless there have been writes since it was read."""
+        if writes != self._writes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (self._clock() + self._ttl, value)
+        _, subject_uuids, _, object_uuids = key
+        for index, any_index, uuids in ((self._by_subject, self._any_subject, subject_uuids),
+                                        (self._by_object, self._any_object, object_uuids)):
+            if uuids is None:
+                any_index.add(key)
+            else:
+                for uuid in uuids:
+                    index[uuid].add(key)
+        while len(self._entries) > self._max_entries:
+            self._drop(next(iter(self._entries)))
+            self._stats["evictions"] += 1
+
+    def _drop(self, key: tuple):
+        del self._entries[key]
+        _, subject_uuids, _, object_uuids = key
+        for index, any_index, uuids in ((self._by_subject, self._any_subject, subject_uuids),
+                                        (self._by_object, self._any_object, object_uuids)):
+            if uuids is None:
+                any_index.discard(key)
+                continue
+            for uuid in uuids:
+                keys = index[uuid]
+                keys.discard(key)
+                if not keys:
+                    del index[uuid]
+
+    def _candidates(self,
+                    subject_uuids: Optional[frozenset],
+                    object_uuids: Optional[frozenset]) -> set[tuple]:
+        """Returns the entries that could overlap the subjects and objects."""
+        if subject_uuids is not None:
+            index, any_index, uuids = self._by_subject, self._any_subject, subject_uuids
+        elif object_uuids is not None:
+            index, any_index, uuids = self._by_object, self._any_object, object_uuids
+        else:
+            return set(self._entries)
+        candidates = set(any_index)
+        for uuid in uuids:
+            candidates.update(index.get(uuid, ()))
+        return candidates
+
+    def _invalidate(self, keys: Iterable[tuple]):
+        for key in list(keys):
+            self._drop(key)
+            self._stats["invalidations"] += 1
+
+    def _invalidate_triples(self, triples: list[PermTriple]):
+        candidates = self._candidates(frozenset(triple.subject_uuid for triple in triples), None)
+        if len(candidates) * len(triples) > MAX_INVALIDATION_COMPARISONS:
+            self._invalidate(candidates)
+            return
+        self._invalidate(key for key in candidates
+                         if any(_matches(key, triple) for triple in triples))
+
+    def _invalidate_query(self,
+                          subject_uuids: Optional[frozenset],
+                          predicates: Optional[frozenset],
+                          object_uuids: Optional[frozenset]):
+        self._invalidate(
+            key for key in self._candidates(subject_uuids, object_uuids)
+            if _overlaps(key[1], subject_uuids)
+            and _overlaps(key[2], predicates)
+            and _overlaps(key[3], object_uuids)
+        )
+
+    def _query_key(self, kind: str,
+                   subject_uuids: Iterable[UUID] = None,
+                   predicates: Iterable[str] = None,
+                   object_uuids: Iterable[UUID] = None) -> tuple[Hashable, ...]:
+        return kind, _filter(subject_uuids), _filter(predicates), _filter(object_uuids)
+
+    def _exists_key(self, perm: PermTriple) -> tuple[Hashable, ...]:
+        return (EXISTS, frozenset((perm.subject_uuid,)), frozenset((perm.predicate,)),
+                frozenset((perm.object_uuid,)))
+
+    async def create(self, perms: Iterable[PermTriple],
+                     returning: bool = True) -> Iterable[PermTriple] | int:
+        perms = list(perms)
+        self._writes += 1
+        try:
+            return await self._backend.create(perms, returning=returning)
+        finally:
+            # Reads that began during the write may have missed it
+            self._writes += 1
+            self._invalidate_triples(perms)
+
+    async def read(self,
+                   subject_uuids: Iterable[UUID] = None,
+                   predicates: Iterable[str] = None,
+                   object_uuids: Iterable[UUID] = None) -> list[PermTriple]:
+
+        key = self._query_key(READ, subject_uuids, predicates, object_uuids)
+        cached = self._get(key)
+        if cached is not None:
+            return list(cached)
+        writes = self._writes
+        results = tuple(await self._backend.read(subject_uuids, predicates, object_uuids))
+        self._put(key, results, writes)
+        return list(results)
+
+    async def count(self,
+                    subject_uuids: Iterable[UUID] = None,
+                    predicates: Iterable[str] = None,
+                    object_uuids: Iterable[UUID] = None) -> int:
+
+        key = self._query_key(COUNT, subject_uuids, predicates, object_uuids)
+        cached = self._get(key)
+        if cached is not None:
+            return cached
+        writes = self._writes
+        count = await self._backend.count(subject_uuids, predicates, object_uuids)
+        self._put(key, count, writes)
+        return count
+
+    def stream(self,
+               subject_uuids: Iterable[UUID] = None,
+               predicates: Iterable[str] = None,
+               object_uuids: Iterable[UUID] = None) -> AsyncIterator[PermTriple]:
+
+        return self._backend.stream(subject_uuids, predicates, object_uuids)
+
+    async def read_page(self,
+                        subject_uuids: Iterable[UUID] = None,
+                        predicates: Iterable[str] = None,
+                        object_uuids: Iterable[UUID] = None,
+                        limit: int = 1000,
+                        cursor: Optional[str] = None) -> tuple[list[PermTriple], Optional[str]]:
+
+        return await self._backend.read_page(subject_uuids, predicates, object_uuids,
+                                             limit=limit, cursor=cursor)
+
+    async def exists(self, subject_uuid: UUID, predicate: str, object_uuid: UUID) -> bool:
+        return (await self.check([Triple(subject_uuid, predicate, object_uuid)]))[0]
+
+    async def check(self, perms: Iterable[PermTriple]) -> list[bool]:
+        perms = list(perms)
+        keys = [self._exists_key(perm) for perm in perms]
+        results = [self._get(key) for key in keys]
+        missing = [position for position, result in enumerate(results) if result is None]
+        if not missing:
+            return results
+
+        writes = self._writes
+        if len(missing) == 1:
+            perm = perms[missing[0]]
+            found = [await self._backend.exists(perm.subject_uuid, perm.predicate,
+                                                perm.object_uuid)]
+        else:
+            found = await self._backend.check([perms[position] for position in missing])
+        for position, exists in zip(missing, found):
+            results[position] = exists
+            self._put(keys[position], exists, writes)
+        return results
+
+    async def delete(self,
+                     subject_uuids: Iterable[UUID] = None,
+                     predicates: Iterable[str] = None,
+                     object_uuids: Iterable[UUID] = None,
+                     returning: bool = True) -> Iterable[PermTriple] | int:
+
+        self._writes += 1
+        try:
+            return await self._backend.delete(subject_uuids, predicates, object_uuids,
+                                              returning=returning)
+        finally:
+            # Reads that began during the write may have missed it
+            self._writes += 1
+            self._invalidate_query(_filter(subject_uuids), _filter(predicates),
+                                   _filter(object_uuids))
+
@@ -0,0 +1,271 @@
+from collections import namedtuple
+from typing import AsyncIterator, Iterable, Optional, Set
+from uuid import UUID
+
+import numpy as np
+
+from per_object_permissions import cursors
+from per_object_permissions.protocols import PermTriple
+
+Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
+
+SUBJECT, PREDICATE, OBJECT = range(3)
+
+# Each stored row viewed as a single value, for sorting and matching whole rows
+ROW = np.dtype((np.void, 3 * np.dtype(np.int32).itemsize))
+
+# Number of rows decoded into triples at a time when streaming
+STREAM_CHUNK_SIZE = 10000
+
+# Number of sorted rows first filtered when seeking a page's matches, doubling
+# until the page is full
+PAGE_SCAN_CHUNK_SIZE = 4096
+
+# Number of new rows kept unsorted before they are merged into the sorted rows
+UNSORTED_TAIL_LIMIT = 4096
+
+
+def _contains(rows: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Returns a boolean array of which values are among the sorted rows."""
+    positions = np.searchsorted(rows, values)
+    found = positions < len(rows)
+    found[found] = rows[positions[found]] == values[found]
+    return found
+
+
+def _cursor_id(value) -> int:
+    """Parses an interned id from a cursor, which must fit the int32 columns."""
+    id_ = int(value)
+    if not 0 <= id_ <= np.iinfo(np.int32).max:
+        raise ValueError(f"Id out of range: {id_}")
+    return id_
+
+
+class ColumnarBackend:
+    """Stores per-object permission triples in memory as packed integer columns.
+
+    UUIDs and predicates are interned to int32 ids, so each triple costs
+    12 bytes in the columns plus one dictionary entry per distinct UUID
+    or predicate. Filtering is vectorized over the columns with NumPy.
+
+    Interned ids are never released, so the dictionaries only grow.
+
+    The rows are also kept in order in a separate array. New rows wait in
+    a short unsorted tail, which is merged into the sorted rows once it is
+    full, or before a paged read. Creates and checks look triples up with
+    a binary search of the sorted rows plus a scan of the tail, and each
+    page seeks to its cursor in the sorted rows, then filters them from
+    there until the page is full.
+    """
+
+    def __init__(self, initial_data: Iterable[PermTriple] = None,
+                 initial_capacity: int = 1024, **kwargs):
+        self._uuid_ids = {}
+        self._uuids = []
+        self._predicate_ids = {}
+        self._predicates = []
+        self._columns = np.empty((3, initial_capacity), dtype=np.int32)
+        self._size = 0
+        self._sorted_rows = np.empty(0, dtype=ROW)
+        self._tail = np.empty(0, dtype=ROW)
+        if initial_data:
+            self._add(self._encode(initial_data))
+
+    def __iter__(self):
+        return iter(self._decode(self._columns[:, :self._size]))
+
+    def _intern(self, value, ids: dict, values: list) -> int:
+        try:
+            return ids[value]
+        except KeyError:
+            ids[value] = len(values)
+            values.append(value)
+            return ids[value]
+
+    def _encode(self, perms: Iterable[PermTriple]) -> np.ndarray:
+        rows = [
+            (self._intern(perm.subject_uuid, self._uuid_ids, self._uuids),
+             self._intern(perm.predicate, self._predicate_ids, self._predicates),
+             self._intern(perm.object_uuid, self._uuid_ids, self._uuids))
+            for perm in perms
+        ]
+        return np.array(rows, dtype=np.int32).reshape(-1, 3).T
+
+    def _decode(self, columns: np.ndarray) -> Set[Triple]:
+        return set(self._decode_ordered(columns))
+
+    def _decode_ordered(self, columns: np.ndarray) -> list[Triple]:
+        uuids, predicates = self._uuids, self._predicates
+        return [Triple(uuids[subject_id], predicates[predicate_id], uuids[object_id])
+                for subject_id, predicate_id, object_id in zip(*columns.tolist())]
+
+    def _reserve(self, extra: int):
+        capacity = self._columns.shape[1]
+        if self._size + extra <= capacity:
+            return
+        while capacity < self._size + extra:
+            capacity *= 2
+        columns = np.empty((3, capacity), dtype=np.int32)
+        columns[:, :self._size] = self._columns[:, :self._size]
+        self._columns = columns
+
+    def _add(self, batch: np.ndarray):
+        """Appends the rows of the batch that are not already stored."""
+        if not batch.shape[1]:
+            return
+
+        rows = np.unique(np.ascontiguousarray(batch.T).view(ROW).ravel())
+        new_rows = rows[~self._contains(rows)]
+        if not len(new_rows):
+            return
+
+        self._reserve(len(new_rows))
+        self._columns[:, self._size:self._size + len(new_rows)] = (
+            new_rows.view(np.int32).reshape(-1, 3).T
+        )
+        self._size += len(new_rows)
+        self._tail = np.concatenate([self._tail, new_rows])
+        if len(self._tail) > UNSORTED_TAIL_LIMIT:
+            self._sorted()
+
+    def _contains(self, rows: np.ndarray) -> np.ndarray:
+        """Returns a boolean array of which rows, each viewed as one value, are stored."""
+        return _contains(self._sorted_rows, rows) | np.isin(rows, self._tail)
+
+    def _sorted(self) -> np.ndarray:
+        """Returns every row as one value in order, merging in the unsorted tail."""
+        if len(self._tail):
+            tail = np.sort(self._tail)
+            self._sorted_rows = np.insert(self._sorted_rows,
+                                          np.searchsorted(self._sorted_rows, tail), tail)
+            self._tail = self._tail[:0]
+        return self._sorted_rows
+
+    def _mask(self,
+              subject_uuids: Iterable[UUID] = None,
+              predicates: Iterable[str] = None,
+              object_uuids: Iterable[UUID] = None,
+              columns: np.ndarray = None) -> np.ndarray:
+        """Returns a boolean mask over the stored rows, or the given columns, matching
+        the filters."""
+        if columns is None:
+            columns = self._columns[:, :self._size]
+        mask = np.ones(columns.shape[1], dtype=bool)
+        filters = (
+            (SUBJECT, subject_uuids, self._uuid_ids),
+            (PREDICATE, predicates, self._predicate_ids),
+            (OBJECT, object_uuids, self._uuid_ids),
+        )
+        for position, values, ids in filters:
+            if not values:
+                continue
+            value_ids = [ids[value] for value in values if value in ids]
+            if not value_ids:
+                return np.zeros(columns.shape[1], dtype=bool)
+            mask &= np.isin(columns[position], value_ids)
+        return mask
+
+    async def create(self, perms: Iterable[PermTriple],
+                     returning: bool = True) -> list[Triple] | int:
+        if not returning:
+            batch = self._encode(perms)
+            self._add(batch)
+            return batch.shape[1]
+
+        triples = [
+            Triple(perm.subject_uuid, perm.predicate, perm.object_uuid)
+            for perm in perms
+        ]
+        self._add(self._encode(triples))
+        return triples
+
+    async def read(self,
+                   subject_uuids: Iterable[UUID] = None,
+                   predicates: Iterable[str] = None,
+                   object_uuids: Iterable[UUID] = None) -> Set[Triple]:
+
+        mask = self._mask(subject_uuids, predicates, object_uuids)
+        return self._decode(self._columns[:, :self._size][:, mask])
+
+    async def stream(self,
+                     subject_uuids: Iterable[UUID] = None,
+                     predicates: Iterable[str] = None,
+                     object_uuids: Iterable[UUID] = None) -> AsyncIterator[Triple]:
+
+        mask = self._mask(subject_uuids, predicates, object_uuids)
+        matches = self._columns[:, :self._size][:, mask]
+        for start in range(0, matches.shape[1], STREAM_CHUNK_SIZE):
+            for triple in self._decode(matches[:, start:start + STREAM_CHUNK_SIZE]):
+                yield triple
+
+    async def count(self,
+                    subject_uuids: Iterable[UUID] = None,
+                    predicates: Iterable[str] = None,
+                    object_uuids: Iterable[UUID] = None) -> int:
+
+        return int(np.count_nonzero(self._mask(subject_uuids, predicates, object_uuids)))
+
+    async def read_page(self,
+                        subject_uuids: Iterable[UUID] = None,
+                        predicates: Iterable[str] = None,
+                        object_uuids: Iterable[UUID] = None,
+                        limit: int = 1000,
+                        cursor: Optional[str] = None) -> tuple[list[Triple], Optional[str]]:
+        """Pages through the matches ordered by their interned ids.
+
+        Ids are never released, so a cursor stays valid across writes.
+        """
+        rows = self._sorted()
+        start = 0
+        if cursor is not None:
+            after = np.array(cursors.decode_cursor(cursor, *[_cursor_id] * 3), dtype=np.int32)
+            start = np.searchsorted(rows, after.view(ROW)[0], side="right")
+
+        found, found_count = [rows[:0]], 0
+        chunk_size = max(limit + 1, PAGE_SCAN_CHUNK_SIZE)
+        while start < len(rows) and found_count <= limit:
+            chunk = rows[start:start + chunk_size]
+            columns = chunk.view(np.int32).reshape(-1, 3).T
+            found.append(chunk[self._mask(subject_uuids, predicates, object_uuids, columns)])
+            found_count += len(found[-1])
+            start += chunk_size
+            chunk_size *= 2
+
+        matches = np.concatenate(found)
+        page = matches[:limit].view(np.int32).reshape(-1, 3)
+        triples = self._decode_ordered(page.T)
+        if len(matches) > limit:
+            return triples, cursors.encode_cursor(*page[-1].tolist())
+        return triples, None
+
+    async def exists(self, subject_uuid: UUID, predicate: str, object_uuid: UUID) -> bool:
+        (exists,) = await self.check([Triple(subject_uuid, predicate, object_uuid)])
+        return exists
+
+    async def check(self, perms: Iterable[PermTriple]) -> list[bool]:
+        missing = -1
+        checks = np.array([
+            (self._uuid_ids.get(perm.subject_uuid, missing),
+             self._predicate_ids.get(perm.predicate, missing),
+             self._uuid_ids.get(perm.object_uuid, missing))
+            for perm in perms
+        ], dtype=np.int32).reshape(-1, 3)
+        return self._contains(checks.view(ROW).ravel()).tolist()
+
+    async def delete(self,
+                     subject_uuids: Iterable[UUID] = None,
+                     predicates: Iterable[str] = None,
+                     object_uuids: Iterable[UUID] = None,
+                     returning: bool = True) -> Set[Triple] | int:
+
+        mask = self._mask(subject_uuids, predicates, object_uuids)
+        stored = self._columns[:, :self._size]
+        deleted = self._decode(stored[:, mask]) if returning else int(np.count_nonzero(mask))
+
+        kept = stored[:, ~mask]
+        self._columns[:, :kept.shape[1]] = kept
+        self._size = kept.shape[1]
+        rows = self._sorted()
+        columns = rows.view(np.int32).reshape(-1, 3).T
+        self._sorted_rows = rows[~self._mask(subject_uuids, predicates, object_uuids, columns)]
+        return deleted
@@ -1,15 +1,29 @@
-from collections import namedtuple
-from typing import Callable, Iterable, Set
+import asyncio
+import bisect
+import heapq
+from collections import defaultdict, namedtuple
+from itertools import islice
+from typing import AsyncIterator, Callable, Iterable, Iterator, Optional, Set
 from uuid import UUID
 
+from per_object_permissions import cursors
+from per_object_permissions.backends import in_memory_persistence
 from per_object_permissions.protocols import PermTriple
 
 Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
 
+# Writes of up to this many triples are inserted into the sorted triples one by
+# one; larger writes re-sort them, which is near-linear as they are mostly sorted
+SORTED_INSERT_LIMIT = 64
 
-def _filter_pred(subject_uuids: Iterable[UUID] = None,
-                 predicates: Iterable[str] = None,
-                 object_uuids: Iterable[UUID] = None) -> Callable:
+# Paged reads walk the sorted triples when a filter's index holds at least this
+# share of them, rather than picking the smallest matches from the index
+WALK_MATCH_FRACTION = 1 / 8
+
+
+def _filter_pred(subject_uuids: Set[UUID] = None,
+                 predicates: Set[str] = None,
+                 object_uuids: Set[UUID] = None) -> Callable:
     """Returns a predicate function for filtering permission triples."""
 
     def pred(triple):
@@ -27,37 +41,253 @@ def _filter_pred(subject_uuids: Iterable[UUID] = None,
     return pred
 
 
+def _filter_sets(subject_uuids: Iterable[UUID] = None,
+                 predicates: Iterable[str] = None,
+                 object_uuids: Iterable[UUID] = None) -> list[Optional[set]]:
+    return [set(keys) if keys else None for keys in (subject_uuids, predicates, object_uuids)]
+
+
 class InMemoryBackend:
-    """Stores per-object permission triples in memory."""
+    """Stores per-object permission triples in memory.
+
+    Besides the set of triples, a hash index is kept for each position
+    of the triple (subject, predicate and object). Queries are driven from
+    whichever of the supplied filter lists matches the fewest triples,
+    so filtering by a single subject or object costs O(matches) rather
+    than a scan of every stored triple.
+
+    The first paged read sorts every triple into a list, which writes then
+    keep in order. A page of a broad query walks that list from the cursor,
+    while a page of a selective query picks the smallest of its matches
+    after the cursor from the index. So each page costs at most one pass
+    over the matches, however pages and writes are interleaved.
+
+    If the settings name an in-memory data directory, writes are recorded
+    in an append-only log there and periodically compacted into a snapshot,
+    from which the triples are restored when the backend is created.
+    """
 
-    def __init__(self, initial_data: Iterable[PermTriple] = None, **kwargs):
-        self._data = set(initial_data) if initial_data else set()
+    def __init__(self, initial_data: Iterable[PermTriple] = None, settings=None, **kwargs):
+        self._sorted = None
+        self._clear()
+        self._persistence = None
+        self._snapshot_task = None
+        if settings is not None and settings.in_memory_data_dir:
+            self._snapshot_interval = settings.in_memory_snapshot_interval
+            self._persistence = in_memory_persistence.Persistence(settings.in_memory_data_dir)
+            self._restore()
+        if initial_data:
+            self._add(initial_data)
 
     def __iter__(self):
         return iter(self._data)
 
-    async def create(self, perms: Iterable[PermTriple]) -> Set[Triple]:
+    def _indexes(self) -> tuple[dict, dict, dict]:
+        return self._by_subject, self._by_predicate, self._by_object
+
+    def _add(self, triples: Iterable[PermTriple]):
+        data, by_subject, by_predicate, by_object = (self._data, self._by_subject,
+                                                     self._by_predicate, self._by_object)
+        added = []
+        for triple in triples:
+            if triple in data:
+                continue
+            data.add(triple)
+            added.append(triple)
+            subject_uuid, predicate, object_uuid = triple
+            by_subject[subject_uuid].add(triple)
+            by_predicate[predicate].add(triple)
+            by_object[object_uuid].add(triple)
+        if self._sorted is not None:
+            if len(added) <= SORTED_INSERT_LIMIT:
+                for triple in added:
+                    bisect.insort(self._sorted, triple)
+            else:
+                self._sorted.extend(added)
+                self._sorted.sort()
+
+    def _restore(self):
+        snapshot = self._persistence.load_snapshot()
+        if snapshot:
+            self._add(snapshot)
+        for operation, triple in self._persistence.replay_logs():
+            if operation == in_memory_persistence.CREATE:
+                self._add((triple,))
+            elif operation == in_memory_persistence.DELETE:
+                if triple in self._data:
+                    self._remove((triple,))
+            else:
+                self._clear()
+
+    def _schedule_snapshots(self):
+        loop = asyncio.get_running_loop()
+        if self._snapshot_task is None or self._snapshot_task.get_loop() is not loop:
+            self._snapshot_task = loop.create_task(self._snapshot_periodically())
+
+    async def _snapshot_periodically(self):
+        while True:
+            await asyncio.sleep(self._snapshot_interval)
+            if self._persistence.dirty:
+                await self.snapshot()
+
+    async def snapshot(self):
+        """Writes a snapshot of the current triples if persistence is enabled."""
+        if self._persistence is not None:
+            await self._persistence.snapshot(lambda: self._data)
+
+    def _clear(self):
+        if self._sorted is not None:
+            self._sorted = []
+        self._data = set()
+        self._by_subject = defaultdict(set)
+        self._by_predicate = defaultdict(set)
+        self._by_object = defaultdict(set)
+
+    def _remove(self, triples: Iterable[Triple]):
+        """Removes triples from the data and indexes in place."""
+        removed = set(triples)
+        for triple in removed:
+            self._data.discard(triple)
+            for index, key in zip(self._indexes(), triple):
+                bucket = index[key]
+                bucket.discard(triple)
+                if not bucket:
+                    del index[key]
+        if self._sorted is not None:
+            if len(removed) <= SORTED_INSERT_LIMIT:
+                for triple in removed:
+                    position = bisect.bisect_left(self._sorted, triple)
+                    if position < len(self._sorted) and self._sorted[position] == triple:
+                        del self._sorted[position]
+            else:
+                self._sorted = [triple for triple in self._sorted if triple not in removed]
+
+    def _select(self,
+                subject_uuids: Iterable[UUID] = None,
+                predicates: Iterable[str] = None,
+                object_uuids: Iterable[UUID] = None) -> Iterator[Triple]:
+        """Yields the triples matching the filters using the most selective index."""
+
+        filter_sets = _filter_sets(subject_uuids, predicates, object_uuids)
+        plan = self._plan(filter_sets)
+        if plan is None:
+            yield from self._data
+            return
+
+        keys, index, _ = plan
+        pred = _filter_pred(*filter_sets)
+        for key in keys:
+            if key in index:
+                yield from filter(pred, index[key])
+
+    def _plan(self, filter_sets: list[Optional[set]]) -> Optional[tuple[set, dict, int]]:
+        """Returns the keys and index of the filter matching the fewest triples, and how
+        many that filter matches, or None if there are no filters."""
+        plans = [(keys, index, sum(len(index[key]) for key in keys if key in index))
+                 for keys, index in zip(filter_sets, self._indexes())
+                 if keys]
+        if not plans:
+            return None
+        return min(plans, key=lambda plan: plan[2])
+
+    def _sorted_triples(self) -> list[Triple]:
+        """Returns every triple in order, sorting them on the first call."""
+        if self._sorted is None:
+            self._sorted = sorted(self._data)
+        return self._sorted
+
+    async def create(self, perms: Iterable[PermTriple],
+                     returning: bool = True) -> Set[Triple] | int:
         triples = [
             Triple(perm.subject_uuid, perm.predicate, perm.object_uuid)
             for perm in perms
         ]
-        self._data.update(triples)
-        return triples
+        if self._persistence is not None:
+            # Logged first, so that triples the log cannot record are not stored
+            self._persistence.log_create(triples)
+            self._schedule_snapshots()
+        self._add(triples)
+        return triples if returning else len(triples)
 
     async def read(self,
                    subject_uuids: Iterable[UUID] = None,
                    predicates: Iterable[str] = None,
                    object_uuids: Iterable[UUID] = None) -> Set[Triple]:
 
-        pred = _filter_pred(subject_uuids, predicates, object_uuids)
-        return set(filter(pred, self._data))
+        return set(self._select(subject_uuids, predicates, object_uuids))
+
+    async def stream(self,
+                     subject_uuids: Iterable[UUID] = None,
+                     predicates: Iterable[str] = None,
+                     object_uuids: Iterable[UUID] = None) -> AsyncIterator[Triple]:
+
+        # Take references to the matches up front, as the store may change
+        # between the triples being consumed.
+        for triple in list(self._select(subject_uuids, predicates, object_uuids)):
+            yield triple
+
+    async def count(self,
+                    subject_uuids: Iterable[UUID] = None,
+                    predicates: Iterable[str] = None,
+                    object_uuids: Iterable[UUID] = None) -> int:
+
+        if not (subject_uuids or predicates or object_uuids):
+            return len(self._data)
+        return sum(1 for _ in self._select(subject_uuids, predicates, object_uuids))
+
+    async def read_page(self,
+                        subject_uuids: Iterable[UUID] = None,
+                        predicates: Iterable[str] = None,
+                        object_uuids: Iterable[UUID] = None,
+                        limit: int = 1000,
+                        cursor: Optional[str] = None) -> tuple[list[Triple], Optional[str]]:
+
+        after = None
+        if cursor is not None:
+            after = Triple(*cursors.decode_cursor(cursor, UUID, str, UUID))
+        filter_sets = _filter_sets(subject_uuids, predicates, object_uuids)
+        plan = self._plan(filter_sets)
+
+        if plan is None or plan[2] >= WALK_MATCH_FRACTION * len(self._data):
+            ordered = self._sorted_triples()
+            start = 0 if after is None else bisect.bisect_right(ordered, after)
+            following = map(ordered.__getitem__, range(start, len(ordered)))
+            page = list(islice(filter(_filter_pred(*filter_sets), following), limit + 1))
+        else:
+            matches = self._select(subject_uuids, predicates, object_uuids)
+            if after is not None:
+                matches = (triple for triple in matches if triple > after)
+            page = heapq.nsmallest(limit + 1, matches)
+
+        if len(page) > limit:
+            return page[:limit], cursors.encode_cursor(*page[limit - 1])
+        return page, None
+
+    async def exists(self, subject_uuid: UUID, predicate: str, object_uuid: UUID) -> bool:
+        return Triple(subject_uuid, predicate, object_uuid) in self._data
+
+    async def check(self, perms: Iterable[PermTriple]) -> list[bool]:
+        return [Triple(perm.subject_uuid, perm.predicate, perm.object_uuid) in self._data
+                for perm in perms]
 
     async def delete(self,
                      subject_uuids: Iterable[UUID] = None,
                      predicates: Iterable[str] = None,
-                     object_uuids: Iterable[UUID] = None) -> Set[Triple]:
+                     object_uuids: Iterable[UUID] = None,
+                     returning: bool = True) -> Set[Triple] | int:
+
+        if not (subject_uuids or predicates or object_uuids):
+            # Hand the whole store over rather than copying it
+            deleted = self._data
+            self._clear()
+            if self._persistence is not None:
+                self._persistence.log_clear()
+                self._schedule_snapshots()
+            return deleted if returning else len(deleted)
 
-        pred = _filter_pred(subject_uuids, predicates, object_uuids)
-        to_delete = set(filter(pred, self._data))
-        self._data = self._data.difference(to_delete)
-        return to_delete
+        to_delete = set(self._select(subject_uuids, predicates, object_uuids))
+        self._remove(to_delete)
+        if self._persistence is not None:
+            self._persistence.log_delete(to_delete)
+            self._schedule_snapshots()
+        return to_delete if returning else len(to_delete)
@@ -0,0 +1,251 @@
+"""Snapshot and append-only log persistence for the in-memory backend.
+
+The state on disk is one snapshot file plus a series of log files,
+each numbered with a generation. A snapshot of generation N contains
+every operation recorded in the logs below N, so recovery loads the
+snapshot and replays the logs from generation N upwards.
+
+All integers are little-endian.
+
+Snapshot layout:
+    8 bytes  magic (b"POPSNAP1")
+    u64      generation
+    u32      predicate count, followed by each predicate as a u16 length
+             and its UTF-8 bytes
+    u64      triple count, followed by fixed-size 36 byte records:
+             16 byte subject UUID, 16 byte object UUID, u32 predicate index
+
+Log records:
+    1 byte   operation (b"C" create, b"D" delete, b"X" delete everything)
+    16 bytes subject UUID, 16 bytes object UUID, u16 predicate length and
+             the predicate's UTF-8 bytes (omitted for b"X")
+"""
+import asyncio
+import glob
+import mmap
+import os
+import struct
+from collections import namedtuple
+from typing import Callable, Iterable, Iterator, Optional
+from uuid import UUID
+
+from per_object_permissions.protocols import PermTriple, UnsupportedTriple
+
+Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
+
+SNAPSHOT_MAGIC = b"POPSNAP1"
+SNAPSHOT_NAME = "snapshot.bin"
+SNAPSHOT_RECORD = struct.Struct("<16s16sI")
+SNAPSHOT_CHUNK_SIZE = 65536
+LOG_RECORD = struct.Struct("<c16s16sH")
+# Predicates are written with a u16 length
+MAX_PREDICATE_BYTES = 0xFFFF
+
+CREATE, DELETE, CLEAR = b"C", b"D", b"X"
+
+
+def _log_path(data_dir: str, generation: int) -> str:
+    return os.path.join(data_dir, f"log.{generation:010d}")
+
+
+def _log_generations(data_dir: str) -> list[int]:
+    paths = glob.glob(os.path.join(data_dir, "log.*"))
+    return sorted(int(path.rsplit(".", 1)[1]) for path in paths)
+
+
+def _uuid_interner():
+    """Returns a function building UUIDs from bytes, sharing repeated values."""
+    uuids = {}
+
+    def intern(value: bytes) -> UUID:
+        try:
+            return uuids[value]
+        except KeyError:
+            uuid = uuids[value] = UUID(bytes=value)
+            return uuid
+
+    return intern
+
+
+def write_snapshot(path: str, generation: int, triples: tuple[PermTriple]):
+    """Atomically writes a snapshot of the triples to the path."""
+    predicate_indexes = {}
+    for _, predicate, _ in triples:
+        predicate_indexes.setdefault(predicate, len(predicate_indexes))
+
+    header = bytearray(SNAPSHOT_MAGIC)
+    header += struct.pack("<QI", generation, len(predicate_indexes))
+    for predicate in predicate_indexes:
+        encoded = predicate.encode()
+        header += struct.pack("<H", len(encoded)) + encoded
+    header += struct.pack("<Q", len(triples))
+
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as fileobj:
+        fileobj.write(header)
+        for start in range(0, len(triples), SNAPSHOT_CHUNK_SIZE):
+            fileobj.write(b"".join(
+                SNAPSHOT_RECORD.pack(subject_uuid.bytes, object_uuid.bytes,
+                                     predicate_indexes[predicate])
+                for subject_uuid, predicate, object_uuid
+                in triples[start:start + SNAPSHOT_CHUNK_SIZE]
+            ))
+        fileobj.flush()
+        os.fsync(fileobj.fileno())
+    os.replace(temp_path, path)
+
+
+def read_snapshot(path: str) -> tuple[int, list[Triple]]:
+    """Returns the generation and triples of the snapshot at the path."""
+    with open(path, "rb") as fileobj:
+        with mmap.mmap(fileobj.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                return _parse_snapshot(view)
+            finally:
+                view.release()
+
+
+def _parse_snapshot(view: memoryview) -> tuple[int, list[Triple]]:
+    if view[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+        raise ValueError("Not a permission triple snapshot")
+    offset = len(SNAPSHOT_MAGIC)
+    generation, predicate_count = struct.unpack_from("<QI", view, offset)
+    offset += 12
+
+    predicates = []
+    for _ in range(predicate_count):
+        (length,) = struct.unpack_from("<H", view, offset)
+        offset += 2
+        predicates.append(bytes(view[offset:offset + length]).decode())
+        offset += length
+
+    (count,) = struct.unpack_from("<Q", view, offset)
+    offset += 8
+    records = view[offset:offset + count * SNAPSHOT_RECORD.size]
+    intern = _uuid_interner()
+    triples = [
+        Triple(intern(subject_bytes), predicates[index], intern(object_bytes))
+        for subject_bytes, object_bytes, index in SNAPSHOT_RECORD.iter_unpack(records)
+    ]
+    records.release()
+    return generation, triples
+
+
+def read_log(path: str) -> Iterator[tuple[bytes, Optional[Triple]]]:
+    """Yields the operations recorded in a log, ignoring a torn final record."""
+    with open(path, "rb") as fileobj:
+        data = fileobj.read()
+
+    intern = _uuid_interner()
+    offset = 0
+    while offset < len(data):
+        if data[offset:offset + 1] == CLEAR:
+            yield CLEAR, None
+            offset += 1
+            continue
+        if offset + LOG_RECORD.size > len(data):
+            return
+        operation, subject_bytes, object_bytes, length = LOG_RECORD.unpack_from(data, offset)
+        offset += LOG_RECORD.size
+        if offset + length > len(data):
+            return
+        predicate = data[offset:offset + length].decode()
+        offset += length
+        yield operation, Triple(intern(subject_bytes), predicate, intern(object_bytes))
+
+
+class Persistence:
+    """Records in-memory backend writes in a data directory and restores them.
+
+    Log writes are flushed to the operating system after each operation
+    but not fsynced, so they survive a process crash but not a power cut.
+    """
+
+    def __init__(self, data_dir: str):
+        os.makedirs(data_dir, exist_ok=True)
+        self._data_dir = data_dir
+        self._snapshot_path = os.path.join(data_dir, SNAPSHOT_NAME)
+        self._log = None
+        self._generation = 0
+        self._snapshot_generation = 0
+        self._dirty = False
+        self._snapshot_lock = asyncio.Lock()
+
+    @property
+    def dirty(self) -> bool:
+        """Whether anything has been logged since the last snapshot."""
+        return self._dirty
+
+    def load_snapshot(self) -> list[Triple]:
+        """Returns the triples in the latest snapshot, if there is one."""
+        if not os.path.exists(self._snapshot_path):
+            return []
+        self._snapshot_generation, triples = read_snapshot(self._snapshot_path)
+        return triples
+
+    def replay_logs(self) -> Iterator[tuple[bytes, Optional[Triple]]]:
+        """Yields the operations logged since the snapshot was loaded.
+
+        Logging resumes in a fresh log once the replay is complete.
+        """
+        generations = [generation for generation in _log_generations(self._data_dir)
+                       if generation >= self._snapshot_generation]
+        for generation in generations:
+            yield from read_log(_log_path(self._data_dir, generation))
+
+        self._open_log(max(generations + [self._snapshot_generation]) + 1)
+
+    def _open_log(self, generation: int):
+        if self._log is not None:
+            self._log.close()
+        self._generation = generation
+        self._log = open(_log_path(self._data_dir, generation), "ab")
+
+    def _append(self, operation: bytes, triples: Iterable[PermTriple]):
+        """Writes a record of each triple, or none if any cannot be recorded."""
+        records = bytearray()
+        for subject_uuid, predicate, object_uuid in triples:
+            encoded = predicate.encode()
+            if len(encoded) > MAX_PREDICATE_BYTES:
+                raise UnsupportedTriple(f"Predicates are limited to {MAX_PREDICATE_BYTES} bytes")
+            records += LOG_RECORD.pack(operation, subject_uuid.bytes,
+                                       object_uuid.bytes, len(encoded))
+            records += encoded
+        self._log.write(records)
+        self._log.flush()
+        self._dirty = True
+
+    def log_create(self, triples: Iterable[PermTriple]):
+        self._append(CREATE, triples)
+
+    def log_delete(self, triples: Iterable[PermTriple]):
+        self._append(DELETE, triples)
+
+    def log_clear(self):
+        self._log.write(CLEAR)
+        self._log.flush()
+        self._dirty = True
+
+    async def snapshot(self, get_triples: Callable[[], Iterable[PermTriple]]):
+        """Writes a snapshot of the triples and discards the logs it covers.
+
+        The triples are only taken once the lock is held, immediately before
+        logging moves to a new log, so they reflect every operation logged
+        to the old ones. Writes made while the snapshot is written in a
+        thread go to the new log.
+        """
+        async with self._snapshot_lock:
+            triples = tuple(get_triples())
+            self._open_log(self._generation + 1)
+            self._dirty = False
+            await asyncio.to_thread(write_snapshot, self._snapshot_path,
+                                    self._generation, triples)
+            for generation in _log_generations(self._data_dir):
+                if generation < self._generation:
+                    os.remove(_log_path(self._data_dir, generation))
+
+    def close(self):
+        if self._log is not None:
+            self._log.close()
+            self._log = None
@@ -0,0 +1,184 @@
+import logging
+import time
+from typing import AsyncIterator, Iterable, Optional
+from uuid import UUID
+
+from per_object_permissions import metrics
+from per_object_permissions.protocols import PermTriple, PerObjectPermissionBackend
+
+logger = logging.getLogger(__name__)
+
+OPERATIONS = ("create", "read", "stream", "count", "read_page", "exists", "check", "delete")
+
+
+class _Operation:
+    """The metrics recorded for one operation of one backend."""
+
+    __slots__ = ("seconds", "rows", "in_flight")
+
+    def __init__(self, backend_name: str, operation: str):
+        self.seconds = metrics.BACKEND_SECONDS.labels(backend_name, operation)
+        self.rows = metrics.BACKEND_ROWS.labels(backend_name, operation)
+        self.in_flight = metrics.BACKEND_IN_FLIGHT.labels(backend_name, operation)
+
+
+def _materialised(result):
+    return result if isinstance(result, int) or hasattr(result, "__len__") else list(result)
+
+
+def _row_count(result) -> int:
+    return result if isinstance(result, int) else len(result)
+
+
+def _filter_shape(values) -> str:
+    return str(len(values)) if values else "unset"
+
+
+class InstrumentedBackend:
+    """Records the latency, row counts and concurrency of another backend's operations.
+
+    Metrics are labelled with the wrapped backend's class name. Streamed
+    reads are only timed while waiting for the backend, not while the
+    caller handles each triple.
+
+    Operations slower than the slow query threshold are logged as warnings
+    with the shape of their query: the number of values in each filter and
+    of rows returned or affected, and the query text for backends that
+    describe it with a describe_query method.
+    """
+
+    def __init__(self, backend: PerObjectPermissionBackend, name: str = None,
+                 slow_query_seconds: float = 0.0):
+        self._backend = backend
+        self._name = name or type(backend).__name__
+        self._slow_query_seconds = slow_query_seconds
+        self._operations = {operation: _Operation(self._name, operation)
+                            for operation in OPERATIONS}
+
+    def __getattr__(self, name: str):
+        if name == "_backend":
+            raise AttributeError(name)
+        return getattr(self._backend, name)
+
+    async def _call(self, operation: str, call, *args, **kwargs) -> tuple:
+        """Returns the result of the call and the seconds it took."""
+        metric = self._operations[operation]
+        metric.in_flight.inc()
+        started = time.perf_counter()
+        try:
+            result = _materialised(await call(*args, **kwargs))
+        finally:
+            seconds = time.perf_counter() - started
+            metric.seconds.observe(seconds)
+            metric.in_flight.dec()
+        return result, seconds
+
+    def _record(self, operation: str, seconds: float, rows: int,
+                filters: dict = None, returning: bool = True, cursor: Optional[str] = None):
+        self._operations[operation].rows.inc(rows)
+        if not self._slow_query_seconds or seconds < self._slow_query_seconds:
+            return
+
+        shape = "".join(f" {name}={_filter_shape(values)}"
+                        for name, values in (filters or {}).items())
+        query = None
+        describe_query = getattr(self._backend, "describe_query", None)
+        if describe_query is not None and filters is not None:
+            query = describe_query(operation, returning=returning, cursor=cursor, **filters)
+        logger.warning("Slow %s on %s took %.3fs:%s rows=%d%s",
+                       operation, self._name, seconds, shape, rows,
+                       f" query={query!r}" if query else "")
+
+    async def create(self, perms: Iterable[PermTriple],
+                     returning: bool = True) -> Iterable[PermTriple] | int:
+        created, seconds = await self._call("create", self._backend.create, perms,
+                                            returning=returning)
+        self._record("create", seconds, _row_count(created))
+        return created
+
+    async def read(self,
+                   subject_uuids: Iterable[UUID] = None,
+                   predicates: Iterable[str] = None,
+                   object_uuids: Iterable[UUID] = None) -> Iterable[PermTriple]:
+
+        filters = dict(subject_uuids=subject_uuids, predicates=predicates,
+                       object_uuids=object_uuids)
+        results, seconds = await self._call("read", self._backend.read, **filters)
+        self._record("read", seconds, len(results), filters)
+        return results
+
+    async def stream(self,
+                     subject_uuids: Iterable[UUID] = None,
+                     predicates: Iterable[str] = None,
+                     object_uuids: Iterable[UUID] = None) -> AsyncIterator[PermTriple]:
+
+        metric = self._operations["stream"]
+        triples = self._backend.stream(subject_uuids, predicates, object_uuids).__aiter__()
+        metric.in_flight.inc()
+        waited, count = 0.0, 0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    triple = await triples.__anext__()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    waited += time.perf_counter() - started
+                count += 1
+                yield triple
+        finally:
+            metric.seconds.observe(waited)
+            metric.in_flight.dec()
+            self._record("stream", waited, count,
+                         dict(subject_uuids=subject_uuids, predicates=predicates,
+                              object_uuids=object_uuids))
+
+    async def count(self,
+                    subject_uuids: Iterable[UUID] = None,
+                    predicates: Iterable[str] = None,
+                    object_uuids: Iterable[UUID] = None) -> int:
+
+        filters = dict(subject_uuids=subject_uuids, predicates=predicates,
+                       object_uuids=object_uuids)
+        count, seconds = await self._call("count", self._backend.count, **filters)
+        self._record("count", seconds, 0, filters)
+        return count
+
+    async def read_page(self,
+                        subject_uuids: Iterable[UUID] = None,
+                        predicates: Iterable[str] = None,
+                        object_uuids: Iterable[UUID] = None,
+                        limit: int = 1000,
+                        cursor: Optional[str] = None) -> tuple[list[PermTriple], Optional[str]]:
+
+        filters = dict(subject_uuids=subject_uuids, predicates=predicates,
+                       object_uuids=object_uuids)
+        (page, next_cursor), seconds = await self._call("read_page", self._backend.read_page,
+                                                        **filters, limit=limit, cursor=cursor)
+        self._record("read_page", seconds, len(page), filters, cursor=cursor)
+        return page, next_cursor
+
+    async def exists(self, subject_uuid: UUID, predicate: str, object_uuid: UUID) -> bool:
+        exists, seconds = await self._call("exists", self._backend.exists,
+                                           subject_uuid, predicate, object_uuid)
+        self._record("exists", seconds, 1)
+        return exists
+
+    async def check(self, perms: Iterable[PermTriple]) -> list[bool]:
+        results, seconds = await self._call("check", self._backend.check, perms)
+        self._record("check", seconds, len(results))
+        return results
+
+    async def delete(self,
+                     subject_uuids: Iterable[UUID] = None,
+                     predicates: Iterable[str] = None,
+                     object_uuids: Iterable[UUID] = None,
+                     returning: bool = True) -> Iterable[PermTriple] | int:
+
+        filters = dict(subject_uuids=subject_uuids, predicates=predicates,
+                       object_uuids=object_uuids)
+        deleted, seconds = await self._call("delete", self._backend.delete, **filters,
+                                            returning=returning)
+        self._record("delete", seconds, _row_count(deleted), filters, returning)
+        return deleted
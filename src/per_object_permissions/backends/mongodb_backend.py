@@ -1,19 +1,23 @@
 from collections import namedtuple
-from typing import Callable, Iterable, Iterator
+from typing import AsyncIterator, Callable, Iterable, Iterator, Optional
 from urllib.parse import quote_plus
 from uuid import UUID
 
+from bson import ObjectId
 from motor import motor_asyncio
 
+from per_object_permissions import cursors, metrics
 from per_object_permissions.protocols import PermTriple
 
 Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
 
 
-def client_factory(username: str, password: str, host: str) -> Callable:
+def client_factory(username: str, password: str, host: str, **options) -> Callable:
     def get_client():
         db_url = f"mongodb://{quote_plus(username)}:{quote_plus(password)}@{host}"
-        return motor_asyncio.AsyncIOMotorClient(db_url, uuidRepresentation='standard')
+        metrics.BACKEND_CLIENTS.labels("MongoBackend").inc()
+        return motor_asyncio.AsyncIOMotorClient(db_url, uuidRepresentation='standard',
+                                                **options)
     return get_client
 
 
@@ -21,36 +25,70 @@ def query_key_values(subject_uuids: Iterable[UUID] = None,
                      predicates: Iterable[str] = None,
                      object_uuids: Iterable[UUID] = None) -> Iterator[tuple[str, str | UUID]]:
 
+    # Filters may be UUIDArrays or other sequences that BSON cannot encode
     if subject_uuids:
-        yield "subject_uuid", {"$in": subject_uuids}
+        yield "subject_uuid", {"$in": list(subject_uuids)}
 
     if predicates:
-        yield "predicate", {"$in": predicates}
+        yield "predicate", {"$in": list(predicates)}
 
     if object_uuids:
-        yield "object_uuid", {"$in": object_uuids}
+        yield "object_uuid", {"$in": list(object_uuids)}
+
+
+def _object_id(value: str) -> ObjectId:
+    if not ObjectId.is_valid(value):
+        raise ValueError(f"{value!r} is not an ObjectId")
+    return ObjectId(value)
 
 
 class MongoBackend:
-    """Stores per-object permission triples in MongoDB."""
+    """Stores per-object permission triples in MongoDB.
+
+    A client keeps its own pool of connections, so after startup every
+    call shares one client until shutdown.
+    """
 
     def __init__(self, settings, **kwargs):
         self._get_client = client_factory(settings.mongo_user,
                                           settings.mongo_password,
-                                          settings.mongo_host)
-        self._indexes_created = False
-
-    async def _ensure_indexes(self):
-        if not self._indexes_created:
-            client = self._get_client()
-            await client.db.perms.create_index("subject_uuid")
-            await client.db.perms.create_index("object_uuid")
-            self._indexes_created = True
-
-    async def create(self, perms: Iterable[PermTriple]) -> list[Triple]:
-
-        await self._ensure_indexes()
-        client = self._get_client()
+                                          settings.mongo_host,
+                                          maxPoolSize=settings.mongo_pool_size)
+        self._shared_client = None
+
+    async def startup(self):
+        self._shared_client = self._get_client()
+        await self._create_indexes()
+
+    async def shutdown(self):
+        if self._shared_client is not None:
+            client, self._shared_client = self._shared_client, None
+            client.close()
+
+    def _client(self) -> motor_asyncio.AsyncIOMotorClient:
+        """Returns the client shared after startup, or a new one before it."""
+        if self._shared_client is not None:
+            return self._shared_client
+        return self._get_client()
+
+    async def _create_indexes(self):
+        client = self._client()
+        await client.db.perms.create_index("subject_uuid")
+        await client.db.perms.create_index("object_uuid")
+
+    async def create(self, perms: Iterable[PermTriple],
+                     returning: bool = True) -> list[Triple] | int:
+
+        client = self._client()
+
+        if not returning:
+            perm_docs = [{"subject_uuid": perm.subject_uuid,
+                          "predicate": perm.predicate,
+                          "object_uuid": perm.object_uuid}
+                         for perm in perms]
+            if perm_docs:
+                await client.db.perms.insert_many(perm_docs)
+            return len(perm_docs)
 
         new_perms = [Triple(subject_uuid=perm.subject_uuid,
                             predicate=perm.predicate,
@@ -64,8 +102,7 @@ class MongoBackend:
                    predicates: Iterable[str] = None,
                    object_uuids: Iterable[UUID] = None) -> Iterator[Triple]:
 
-        await self._ensure_indexes()
-        client = self._get_client()
+        client = self._client()
 
         query = dict(query_key_values(subject_uuids, predicates, object_uuids))
         results = list()
@@ -74,15 +111,87 @@ class MongoBackend:
             results.append(Triple(**perm_doc))
         return results
 
+    async def stream(self,
+                     subject_uuids: Iterable[UUID] = None,
+                     predicates: Iterable[str] = None,
+                     object_uuids: Iterable[UUID] = None) -> AsyncIterator[Triple]:
+
+        client = self._client()
+
+        query = dict(query_key_values(subject_uuids, predicates, object_uuids))
+        async for perm_doc in client.db.perms.find(query, projection={"_id": False}):
+            yield Triple(**perm_doc)
+
+    async def count(self,
+                    subject_uuids: Iterable[UUID] = None,
+                    predicates: Iterable[str] = None,
+                    object_uuids: Iterable[UUID] = None) -> int:
+
+        client = self._client()
+
+        query = dict(query_key_values(subject_uuids, predicates, object_uuids))
+        return await client.db.perms.count_documents(query)
+
+    async def read_page(self,
+                        subject_uuids: Iterable[UUID] = None,
+                        predicates: Iterable[str] = None,
+                        object_uuids: Iterable[UUID] = None,
+                        limit: int = 1000,
+                        cursor: Optional[str] = None) -> tuple[list[Triple], Optional[str]]:
+        """Pages through the matches in _id order, seeking past the last _id of a page."""
+
+        client = self._client()
+
+        query = dict(query_key_values(subject_uuids, predicates, object_uuids))
+        if cursor is not None:
+            (after,) = cursors.decode_cursor(cursor, _object_id)
+            query["_id"] = {"$gt": after}
+        page, last_id = list(), None
+        async for perm_doc in client.db.perms.find(query).sort("_id", 1).limit(limit + 1):
+            if len(page) == limit:
+                return page, cursors.encode_cursor(last_id)
+            last_id = perm_doc.pop("_id")
+            page.append(Triple(**perm_doc))
+        return page, None
+
+    async def exists(self, subject_uuid: UUID, predicate: str, object_uuid: UUID) -> bool:
+        client = self._client()
+
+        perm_doc = await client.db.perms.find_one({"subject_uuid": subject_uuid,
+                                                   "predicate": predicate,
+                                                   "object_uuid": object_uuid},
+                                                  projection={"_id": True})
+        return perm_doc is not None
+
+    async def check(self, perms: Iterable[PermTriple]) -> list[bool]:
+        checks = [Triple(subject_uuid=perm.subject_uuid,
+                         predicate=perm.predicate,
+                         object_uuid=perm.object_uuid)
+                  for perm in perms]
+        if not checks:
+            return []
+
+        client = self._client()
+
+        query = {"$or": [check._asdict() for check in checks]}
+        found = set()
+        async for perm_doc in client.db.perms.find(query, projection={"_id": False}):
+            found.add(Triple(**perm_doc))
+        return [check in found for check in checks]
+
     async def delete(self,
                      subject_uuids: Iterable[UUID] = None,
                      predicates: Iterable[str] = None,
-                     object_uuids: Iterable[UUID] = None) -> list[PermTriple]:
+                     object_uuids: Iterable[UUID] = None,
+                     returning: bool = True) -> list[PermTriple] | int:
 
-        await self._ensure_indexes()
-        client = self._get_client()
+        client = self._client()
 
         query = dict(query_key_values(subject_uuids, predicates, object_uuids))
+        if not returning:
+            result = await client.db.perms.delete_many(query)
+            return result.deleted_count
+
         results, ids_to_delete = list(), list()
         async for perm_doc in client.db.perms.find(query):
             ids_to_delete.append(perm_doc.pop("_id"))
@@ -1,21 +1,25 @@
 from collections import namedtuple
-from typing import Callable, Iterable, Iterator
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Iterable, Iterator, Optional
 from uuid import UUID
 
 from more_itertools import chunked
-from neo4j import AsyncGraphDatabase
+from neo4j import AsyncDriver, AsyncGraphDatabase
 
+from per_object_permissions import cursors, metrics
 from per_object_permissions.protocols import PermTriple
+from per_object_permissions.uuid_arrays import uuid_strings
 
 DB_NAME = "perms"
 
 Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
 
 
-def driver_factory(username: str, password: str, host: str) -> Callable:
+def driver_factory(username: str, password: str, host: str, **options) -> Callable:
     def get_driver():
         db_url = f"neo4j://{host}:7687"
-        return AsyncGraphDatabase.driver(db_url, auth=(username, password))
+        metrics.BACKEND_CLIENTS.labels("Neo4jBackend").inc()
+        return AsyncGraphDatabase.driver(db_url, auth=(username, password), **options)
     return get_driver
 
 
@@ -42,13 +46,13 @@ def _where_clause_parts(subject_uuids: Iterable[UUID] = None,
                         object_uuids: Iterable[UUID] = None) -> Iterator[tuple[str, list]]:
     if subject_uuids:
         sub_key = "subject_uuids"
-        yield f"subject.uuid IN ${sub_key}", sub_key, list(map(str, subject_uuids))
+        yield f"subject.uuid IN ${sub_key}", sub_key, uuid_strings(subject_uuids)
     if predicates:
         pred_key = "predicates"
         yield f"edge.predicate IN ${pred_key}", pred_key, list(predicates)
     if object_uuids:
         obj_key = "object_uuids"
-        yield f"object.uuid IN ${obj_key}", obj_key, list(map(str, object_uuids))
+        yield f"object.uuid IN ${obj_key}", obj_key, uuid_strings(object_uuids)
 
 
 def build_where_clause(
@@ -64,10 +68,9 @@ def build_where_clause(
     return conditions, dict(zip(data_keys, data_values))
 
 
-async def read_triples(tx,
-                       subject_uuids: Iterable[UUID] = None,
-                       predicates: Iterable[str] = None,
-                       object_uuids: Iterable[UUID] = None) -> Iterator[Triple]:
+def build_read_query(subject_uuids: Iterable[UUID] = None,
+                     predicates: Iterable[str] = None,
+                     object_uuids: Iterable[UUID] = None) -> tuple[str, dict[str, list[str]]]:
 
     path = "(subject:NODE)-[edge:PREDICATE]->(object:NODE)"
     where_conditions, where_data = build_where_clause(subject_uuids,
@@ -79,61 +82,219 @@ async def read_triples(tx,
               "edge.predicate AS predicate, "
               "object.uuid AS object_uuid ")
 
-    result = await tx.run(f"MATCH {path} {where_clause} RETURN {output}", where_data)
+    return f"MATCH {path} {where_clause} RETURN {output}", where_data
 
-    return [record.data() async for record in result]
 
+def build_count_query(subject_uuids: Iterable[UUID] = None,
+                      predicates: Iterable[str] = None,
+                      object_uuids: Iterable[UUID] = None) -> tuple[str, dict[str, list[str]]]:
 
-async def delete_triples(tx,
-                         subject_uuids: Iterable[UUID] = None,
-                         predicates: Iterable[str] = None,
-                         object_uuids: Iterable[UUID] = None) -> Iterator[Triple]:
+    path = "(subject:NODE)-[edge:PREDICATE]->(object:NODE)"
+    where_conditions, where_data = build_where_clause(subject_uuids,
+                                                      predicates,
+                                                      object_uuids)
+    conditions = " AND ".join(where_conditions)
+    where_clause = f"WHERE {conditions}" if conditions else ""
 
+    return f"MATCH {path} {where_clause} RETURN count(edge) AS count", where_data
+
+
+def build_delete_query(subject_uuids: Iterable[UUID] = None,
+                       predicates: Iterable[str] = None,
+                       object_uuids: Iterable[UUID] = None,
+                       returning: bool = True) -> tuple[str, dict[str, list[str]]]:
+    """Builds a query deleting the matching edges, returning them or just their count."""
     path = "(subject:NODE)-[edge:PREDICATE]->(object:NODE)"
     where_conditions, where_data = build_where_clause(subject_uuids,
                                                       predicates,
                                                       object_uuids)
     conditions = " AND ".join(where_conditions)
     where_clause = f"WHERE {conditions}" if conditions else ""
+    if not returning:
+        return f"MATCH {path} {where_clause} DELETE edge RETURN count(edge) AS count", where_data
+
     with_clause = "WITH subject, object, edge, properties(edge) as deleted_edge"
     delete_clause = "DELETE edge"
     output = ("subject.uuid AS subject_uuid, "
               "deleted_edge.predicate AS predicate, "
               "object.uuid AS object_uuid ")
 
-    result = await tx.run(f"MATCH {path} {where_clause} "
-                          f"{with_clause} {delete_clause} RETURN {output}",
-                          where_data)
+    return (f"MATCH {path} {where_clause} {with_clause} {delete_clause} RETURN {output}",
+            where_data)
+
+
+def build_page_query(subject_uuids: Iterable[UUID] = None,
+                     predicates: Iterable[str] = None,
+                     object_uuids: Iterable[UUID] = None,
+                     limit: int = 1000,
+                     after: tuple[str, str, str] = None) -> tuple[str, dict]:
+    """Builds a query for one page of triples in subject, predicate, object order.
+
+    Rather than skipping earlier rows, the page starts after the triple
+    given as its key, compared element by element.
+    """
+    path = "(subject:NODE)-[edge:PREDICATE]->(object:NODE)"
+    where_conditions, data = build_where_clause(subject_uuids, predicates, object_uuids)
+    where_conditions = list(where_conditions)
+    if after is not None:
+        where_conditions.append(
+            "(subject.uuid > $after_subject_uuid OR (subject.uuid = $after_subject_uuid "
+            "AND (edge.predicate > $after_predicate OR (edge.predicate = $after_predicate "
+            "AND object.uuid > $after_object_uuid))))"
+        )
+        data["after_subject_uuid"], data["after_predicate"], data["after_object_uuid"] = after
+    conditions = " AND ".join(where_conditions)
+    where_clause = f"WHERE {conditions}" if conditions else ""
+    output = ("subject.uuid AS subject_uuid, "
+              "edge.predicate AS predicate, "
+              "object.uuid AS object_uuid ")
+    order_clause = "ORDER BY subject_uuid, predicate, object_uuid LIMIT $limit"
+    data["limit"] = limit
+
+    return f"MATCH {path} {where_clause} RETURN {output}{order_clause}", data
+
+
+async def read_triples(tx,
+                       subject_uuids: Iterable[UUID] = None,
+                       predicates: Iterable[str] = None,
+                       object_uuids: Iterable[UUID] = None) -> Iterator[Triple]:
+
+    query, where_data = build_read_query(subject_uuids, predicates, object_uuids)
+    result = await tx.run(query, where_data)
 
     return [record.data() async for record in result]
 
 
+async def count_triples(tx,
+                        subject_uuids: Iterable[UUID] = None,
+                        predicates: Iterable[str] = None,
+                        object_uuids: Iterable[UUID] = None) -> int:
+
+    query, where_data = build_count_query(subject_uuids, predicates, object_uuids)
+    result = await tx.run(query, where_data)
+    record = await result.single()
+    return record["count"]
+
+
+async def read_page_triples(tx,
+                            subject_uuids: Iterable[UUID] = None,
+                            predicates: Iterable[str] = None,
+                            object_uuids: Iterable[UUID] = None,
+                            limit: int = 1000,
+                            after: tuple[str, str, str] = None) -> list[dict]:
+
+    query, data = build_page_query(subject_uuids, predicates, object_uuids, limit, after)
+    result = await tx.run(query, data)
+
+    return [record.data() async for record in result]
+
+
+async def triple_exists(tx, subject_uuid: UUID, predicate: str, object_uuid: UUID) -> bool:
+    query = (
+        "MATCH (:NODE {uuid: $subject_uuid})"
+        "-[edge:PREDICATE {predicate: $predicate}]->"
+        "(:NODE {uuid: $object_uuid}) "
+        "RETURN count(edge) > 0 AS exists"
+    )
+    result = await tx.run(query, subject_uuid=str(subject_uuid),
+                          predicate=predicate, object_uuid=str(object_uuid))
+    record = await result.single()
+    return record["exists"]
+
+
+async def check_triples(tx, perms: Iterable[PermTriple]) -> list[bool]:
+    perms_data = [
+        {"position": position,
+         "subject_uuid": str(perm.subject_uuid),
+         "predicate": perm.predicate,
+         "object_uuid": str(perm.object_uuid)}
+        for position, perm in enumerate(perms)
+    ]
+    query = (
+        "UNWIND $perms AS perm "
+        "OPTIONAL MATCH (:NODE {uuid: perm.subject_uuid})"
+        "-[edge:PREDICATE {predicate: perm.predicate}]->"
+        "(:NODE {uuid: perm.object_uuid}) "
+        "RETURN perm.position AS position, count(edge) > 0 AS exists "
+        "ORDER BY position"
+    )
+    result = await tx.run(query, perms=perms_data)
+    return [record["exists"] async for record in result]
+
+
+async def delete_triples(tx,
+                         subject_uuids: Iterable[UUID] = None,
+                         predicates: Iterable[str] = None,
+                         object_uuids: Iterable[UUID] = None) -> Iterator[Triple]:
+
+    query, where_data = build_delete_query(subject_uuids, predicates, object_uuids)
+    result = await tx.run(query, where_data)
+
+    return [record.data() async for record in result]
+
+
+async def delete_and_count_triples(tx,
+                                  subject_uuids: Iterable[UUID] = None,
+                                  predicates: Iterable[str] = None,
+                                  object_uuids: Iterable[UUID] = None) -> int:
+
+    query, where_data = build_delete_query(subject_uuids, predicates, object_uuids,
+                                           returning=False)
+    result = await tx.run(query, where_data)
+    record = await result.single()
+    return record["count"]
+
+
 class Neo4jBackend:
-    """Stores per-object permission triples in Neo4j."""
+    """Stores per-object permission triples in Neo4j.
+
+    A driver keeps its own pool of connections, so after startup every
+    call shares one driver until shutdown.
+    """
 
     def __init__(self, settings, **kwargs):
         self._get_driver = driver_factory(settings.neo4j_user,
                                           settings.neo4j_password,
-                                          settings.neo4j_host)
-        self._indexes_created = False
-
-    async def _ensure_indexes(self):
-        if not self._indexes_created:
+                                          settings.neo4j_host,
+                                          max_connection_pool_size=settings.neo4j_pool_size)
+        self._shared_driver = None
+
+    async def startup(self):
+        self._shared_driver = self._get_driver()
+        await self._create_indexes()
+
+    async def shutdown(self):
+        if self._shared_driver is not None:
+            driver, self._shared_driver = self._shared_driver, None
+            await driver.close()
+
+    @asynccontextmanager
+    async def _driver(self) -> AsyncIterator[AsyncDriver]:
+        """Yields the driver shared after startup, or a new one for the call before it."""
+        if self._shared_driver is not None:
+            yield self._shared_driver
+        else:
             async with self._get_driver() as driver:
-                async with driver.session() as session:
-                    await session.run("CREATE INDEX node_index FOR (n:NODE) ON (n.uuid)")
-                    await session.run("CREATE INDEX pred_index FOR ()-[r:PREDICATE]-() "
-                                      "ON (r.predicate)")
-            self._indexes_created = True
+                yield driver
 
-    async def create(self, perms: Iterable[PermTriple]) -> list[Triple]:
+    async def _create_indexes(self):
+        async with self._driver() as driver:
+            async with driver.session() as session:
+                await session.run("CREATE INDEX node_index IF NOT EXISTS "
+                                  "FOR (n:NODE) ON (n.uuid)")
+                await session.run("CREATE INDEX pred_index IF NOT EXISTS "
+                                  "FOR ()-[r:PREDICATE]-() ON (r.predicate)")
 
-        await self._ensure_indexes()
+    async def create(self, perms: Iterable[PermTriple],
+                     returning: bool = True) -> list[Triple] | int:
 
-        async with self._get_driver() as driver:
+        async with self._driver() as driver:
             async with driver.session() as session:
                 await session.execute_write(create_triples, perms=perms)
 
+        if not returning:
+            return len(perms)
+
         return [Triple(subject_uuid=perm.subject_uuid,
                        predicate=perm.predicate,
                        object_uuid=perm.object_uuid)
@@ -144,9 +305,7 @@ class Neo4jBackend:
                    predicates: Iterable[str] = None,
                    object_uuids: Iterable[UUID] = None) -> Iterator[Triple]:
 
-        await self._ensure_indexes()
-
-        async with self._get_driver() as driver:
+        async with self._driver() as driver:
             async with driver.session() as session: # noqa
                 results = await session.execute_read(read_triples,
                                                      subject_uuids=subject_uuids,
@@ -154,17 +313,107 @@ class Neo4jBackend:
                                                      object_uuids=object_uuids)
                 return [Triple(**result) for result in results]
 
-    async def delete(self,
+    async def stream(self,
                      subject_uuids: Iterable[UUID] = None,
                      predicates: Iterable[str] = None,
-                     object_uuids: Iterable[UUID] = None) -> list[PermTriple]:
+                     object_uuids: Iterable[UUID] = None) -> AsyncIterator[Triple]:
 
-        await self._ensure_indexes()
+        query, where_data = build_read_query(subject_uuids, predicates, object_uuids)
+        async with self._driver() as driver:
+            async with driver.session() as session: # noqa
+                # Records are pulled from the server as they are consumed
+                result = await session.run(query, where_data)
+                async for record in result:
+                    yield Triple(**record.data())
 
-        async with self._get_driver() as driver:
+    async def count(self,
+                    subject_uuids: Iterable[UUID] = None,
+                    predicates: Iterable[str] = None,
+                    object_uuids: Iterable[UUID] = None) -> int:
+
+        async with self._driver() as driver:
+            async with driver.session() as session: # noqa
+                return await session.execute_read(count_triples,
+                                                  subject_uuids=subject_uuids,
+                                                  predicates=predicates,
+                                                  object_uuids=object_uuids)
+
+    async def read_page(self,
+                        subject_uuids: Iterable[UUID] = None,
+                        predicates: Iterable[str] = None,
+                        object_uuids: Iterable[UUID] = None,
+                        limit: int = 1000,
+                        cursor: Optional[str] = None) -> tuple[list[Triple], Optional[str]]:
+
+        after = None
+        if cursor is not None:
+            after = cursors.decode_cursor(cursor, str, str, str)
+
+        async with self._driver() as driver:
+            async with driver.session() as session: # noqa
+                results = await session.execute_read(read_page_triples,
+                                                     subject_uuids=subject_uuids,
+                                                     predicates=predicates,
+                                                     object_uuids=object_uuids,
+                                                     limit=limit + 1,
+                                                     after=after)
+
+        page = [Triple(**result) for result in results[:limit]]
+        if len(results) > limit:
+            return page, cursors.encode_cursor(*page[-1])
+        return page, None
+
+    async def exists(self, subject_uuid: UUID, predicate: str, object_uuid: UUID) -> bool:
+
+        async with self._driver() as driver:
             async with driver.session() as session: # noqa
+                return await session.execute_read(triple_exists,
+                                                  subject_uuid=subject_uuid,
+                                                  predicate=predicate,
+                                                  object_uuid=object_uuid)
+
+    async def check(self, perms: Iterable[PermTriple]) -> list[bool]:
+
+        async with self._driver() as driver:
+            async with driver.session() as session: # noqa
+                return await session.execute_read(check_triples, perms=perms)
+
+    async def delete(self,
+                     subject_uuids: Iterable[UUID] = None,
+                     predicates: Iterable[str] = None,
+                     object_uuids: Iterable[UUID] = None,
+                     returning: bool = True) -> list[PermTriple] | int:
+
+        async with self._driver() as driver:
+            async with driver.session() as session: # noqa
+                if not returning:
+                    return await session.execute_write(delete_and_count_triples,
+                                                       subject_uuids=subject_uuids,
+                                                       predicates=predicates,
+                                                       object_uuids=object_uuids)
                 results = await session.execute_write(delete_triples,
                                                       subject_uuids=subject_uuids,
                                                       predicates=predicates,
                                                       object_uuids=object_uuids)
                 return [Triple(**result) for result in results]
+
+    def describe_query(self, operation: str,
+                       subject_uuids: Iterable[UUID] = None,
+                       predicates: Iterable[str] = None,
+                       object_uuids: Iterable[UUID] = None,
+                       returning: bool = True,
+                       cursor: Optional[str] = None) -> Optional[str]:
+        """Returns the Cypher an operation runs for the filters, and for read_page the
+        cursor, without its parameters."""
+        if operation in ("read", "stream"):
+            query, _ = build_read_query(subject_uuids, predicates, object_uuids)
+        elif operation == "read_page":
+            after = None if cursor is None else cursors.decode_cursor(cursor, str, str, str)
+            query, _ = build_page_query(subject_uuids, predicates, object_uuids, after=after)
+        elif operation == "count":
+            query, _ = build_count_query(subject_uuids, predicates, object_uuids)
+        elif operation == "delete":
+            query, _ = build_delete_query(subject_uuids, predicates, object_uuids, returning)
+        else:
+            return None
+        return query
@@ -1,17 +1,30 @@
 import asyncio
+import logging
 from collections import namedtuple
+from contextlib import asynccontextmanager
 from os import path
-from typing import Iterable, Iterator, Set
+from typing import AsyncIterator, Iterable, Iterator, Optional, Set
 from uuid import UUID
 
 import psycopg
 
+from per_object_permissions import cursors, metrics
+from per_object_permissions.backends.postgres.pool import ConnectionPool
 from per_object_permissions.protocols import PermTriple
+from per_object_permissions.uuid_arrays import uuid_strings
+
+logger = logging.getLogger(__name__)
 
 Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
 
 QUERIES_PATH = path.join(path.dirname(path.abspath(__file__)), "queries")
 
+# Number of rows fetched from the server at a time when streaming
+STREAM_BATCH_SIZE = 2000
+
+CONNECT_ATTEMPTS = 5
+CONNECT_RETRY_SECONDS = 1.0
+
 
 def _load_query(name: str) -> str:
     with open(path.join(QUERIES_PATH, name), "r") as fileobj:
@@ -21,12 +34,13 @@ def _load_query(name: str) -> str:
 def _where_clause_parts(subject_uuids: Iterable[UUID] = None,
                         predicates: Iterable[str] = None,
                         object_uuids: Iterable[UUID] = None) -> Iterator[tuple[str, list]]:
+    # UUIDs are sent as text and cast by the server, saving converting them here
     if subject_uuids:
-        yield "subject_uuid = ANY(%s)", list(subject_uuids)
+        yield "subject_uuid = ANY(%s::uuid[])", uuid_strings(subject_uuids)
     if predicates:
         yield "predicate = ANY(%s)", list(predicates)
     if object_uuids:
-        yield "object_uuid = ANY(%s)", list(object_uuids)
+        yield "object_uuid = ANY(%s::uuid[])", uuid_strings(object_uuids)
 
 
 def build_where_clause(
@@ -41,6 +55,35 @@ def build_where_clause(
     return tuple(zip(*parts))
 
 
+SELECT_TRIPLES = "SELECT subject_uuid, predicate, object_uuid FROM perms"
+COUNT_TRIPLES = "SELECT count(*) FROM perms"
+DELETE_TRIPLES = "DELETE FROM perms"
+RETURNING_TRIPLES = "RETURNING subject_uuid, predicate, object_uuid"
+PAGE_ORDER = "ORDER BY subject_uuid, predicate, object_uuid LIMIT %s"
+PAGE_AFTER = "(subject_uuid, predicate, object_uuid) > (%s, %s, %s)"
+
+
+def build_query(statement: str,
+                subject_uuids: Iterable[UUID] = None,
+                predicates: Iterable[str] = None,
+                object_uuids: Iterable[UUID] = None,
+                suffix: str = "",
+                after: tuple[UUID, str, UUID] = None) -> tuple[str, tuple]:
+    """Builds the statement with a where clause for the filters, returning it and its values.
+
+    With after, only rows following that triple in page order are matched.
+    """
+    where_conditions, where_values = build_where_clause(subject_uuids, predicates, object_uuids)
+    if after is not None:
+        where_conditions, where_values = (*where_conditions, PAGE_AFTER), (*where_values, *after)
+    clauses = [statement]
+    if where_conditions:
+        clauses.append(f"WHERE {' AND '.join(where_conditions)}")
+    if suffix:
+        clauses.append(suffix)
+    return f"{' '.join(clauses)};", where_values
+
+
 class PostgresBackend:
     """Stores per-object permission triples in PostgreSQL.
 
@@ -53,29 +96,76 @@ class PostgresBackend:
         self._db_user = settings.postgres_user
         self._db_password = settings.postgres_password
         self._create_perms_query = _load_query("create_perms.sql")
-        self._table_initialized = False
+        self._perm_exists_query = _load_query("perm_exists.sql")
+        self._check_perms_query = _load_query("check_perms.sql")
+        self._pool_min_size = settings.postgres_pool_min_size
+        self._pool_max_size = settings.postgres_pool_max_size
+        self._pool = None
+
+    async def startup(self):
+        """Opens the pool and creates the table, waiting for as long as the server takes
+        to accept connections."""
+        pool = ConnectionPool(self._make_connection,
+                              min_size=self._pool_min_size,
+                              max_size=self._pool_max_size,
+                              disconnect=self._close_connection)
+        while True:
+            try:
+                await pool.open()
+            except psycopg.OperationalError as error:
+                logger.warning("Waiting for PostgreSQL to accept connections: %s", error)
+                await asyncio.sleep(CONNECT_RETRY_SECONDS)
+            else:
+                break
+        self._pool = pool
+        await self._create_table()
+
+    async def shutdown(self):
+        if self._pool is not None:
+            pool, self._pool = self._pool, None
+            await pool.close()
+
+    @asynccontextmanager
+    async def _connection(self) -> AsyncIterator[psycopg.AsyncConnection]:
+        """Borrows a connection from the pool after startup, or opens one before it."""
+        if self._pool is not None:
+            async with self._pool.connection() as connection:
+                yield connection
+        else:
+            connection = await self._make_connection()
+            try:
+                async with connection:
+                    yield connection
+            finally:
+                await self._close_connection(connection)
 
-    async def _make_connection(self):
-        for _ in range(5):
+    async def _make_connection(self) -> psycopg.AsyncConnection:
+        for attempt in range(1, CONNECT_ATTEMPTS + 1):
             try:
-                return await psycopg.AsyncConnection.connect(host=self._db_host,
-                                                             dbname=self._db_name,
-                                                             user=self._db_user,
-                                                             password=self._db_password)
+                connection = await psycopg.AsyncConnection.connect(host=self._db_host,
+                                                                   dbname=self._db_name,
+                                                                   user=self._db_user,
+                                                                   password=self._db_password)
             except psycopg.OperationalError:
-                await asyncio.sleep(1)
-
-    async def _ensure_table(self):
-        if not self._table_initialized:
-            ensure_table_query = _load_query("ensure_table_exists.sql")
-            async with await self._make_connection() as connection:
-                async with connection.cursor() as cursor:
-                    await cursor.execute(ensure_table_query)
-                    self._table_initialized = True
-
-    async def create(self, perms: Iterable[PermTriple]) -> Set[Triple]:
-        await self._ensure_table()
-        async with await self._make_connection() as connection:
+                if attempt == CONNECT_ATTEMPTS:
+                    raise
+                await asyncio.sleep(CONNECT_RETRY_SECONDS)
+            else:
+                metrics.BACKEND_CONNECTIONS.labels("PostgresBackend").inc()
+                return connection
+
+    async def _close_connection(self, connection: psycopg.AsyncConnection):
+        await connection.close()
+        metrics.BACKEND_CONNECTIONS.labels("PostgresBackend").dec()
+
+    async def _create_table(self):
+        async with self._connection() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(_load_query("ensure_table_exists.sql"))
+
+    async def create(self, perms: Iterable[PermTriple],
+                     returning: bool = True) -> Set[Triple] | int:
+        async with self._connection() as connection:
             async with connection.cursor() as cursor:
                 perm_data = [(str(perm.subject_uuid),
                               perm.predicate,
@@ -83,6 +173,8 @@ class PostgresBackend:
                              for perm in perms]
                 await cursor.executemany(self._create_perms_query, perm_data)
 
+        if not returning:
+            return len(perm_data)
         return set(Triple(*perm) for perm in perm_data)
 
     async def read(self,
@@ -90,45 +182,120 @@ class PostgresBackend:
                    predicates: Iterable[str] = None,
                    object_uuids: Iterable[UUID] = None) -> Set[Triple]:
 
-        await self._ensure_table()
-        async with await self._make_connection() as connection:
-            select_clause = "SELECT subject_uuid, predicate, object_uuid FROM perms"
-            where_conditions, where_values = build_where_clause(subject_uuids,
-                                                                predicates,
-                                                                object_uuids)
-            if where_conditions:
-                where_clause = f"WHERE {' AND '.join(where_conditions)}"
-                async with connection.cursor() as cursor:
-                    await cursor.execute(f"{select_clause} {where_clause};", where_values)
-                    results = await cursor.fetchall()
-                    return set(Triple(*row) for row in results)
-            else:
-                async with connection.cursor() as cursor:
-                    await cursor.execute(f"{select_clause};")
-                    results = await cursor.fetchall()
-                    return set(Triple(*row) for row in results)
+        query, values = build_query(SELECT_TRIPLES, subject_uuids, predicates, object_uuids)
+        async with self._connection() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(query, values)
+                results = await cursor.fetchall()
+                return set(Triple(*row) for row in results)
+
+    async def stream(self,
+                     subject_uuids: Iterable[UUID] = None,
+                     predicates: Iterable[str] = None,
+                     object_uuids: Iterable[UUID] = None) -> AsyncIterator[Triple]:
+
+        query, values = build_query(SELECT_TRIPLES, subject_uuids, predicates, object_uuids)
+        async with self._connection() as connection:
+            # A named cursor lives on the server, so rows arrive in batches
+            async with connection.cursor(name="stream_perms") as cursor:
+                cursor.itersize = STREAM_BATCH_SIZE
+                await cursor.execute(query, values)
+                async for row in cursor:
+                    yield Triple(*row)
+
+    async def count(self,
+                    subject_uuids: Iterable[UUID] = None,
+                    predicates: Iterable[str] = None,
+                    object_uuids: Iterable[UUID] = None) -> int:
+
+        query, values = build_query(COUNT_TRIPLES, subject_uuids, predicates, object_uuids)
+        async with self._connection() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(query, values)
+                (count,) = await cursor.fetchone()
+                return count
+
+    async def read_page(self,
+                        subject_uuids: Iterable[UUID] = None,
+                        predicates: Iterable[str] = None,
+                        object_uuids: Iterable[UUID] = None,
+                        limit: int = 1000,
+                        cursor: Optional[str] = None) -> tuple[list[Triple], Optional[str]]:
+        """Pages through the matches in the order of the subject, predicate, object index.
+
+        Each page seeks past the last row of the previous one with a row
+        comparison, which the index can answer without scanning earlier rows.
+        """
+        after = None if cursor is None else cursors.decode_cursor(cursor, UUID, str, UUID)
+        query, values = build_query(SELECT_TRIPLES, subject_uuids, predicates, object_uuids,
+                                    suffix=PAGE_ORDER, after=after)
+        async with self._connection() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(query, (*values, limit + 1))
+                rows = await cursor.fetchall()
+
+        page = [Triple(*row) for row in rows[:limit]]
+        if len(rows) > limit:
+            return page, cursors.encode_cursor(*page[-1])
+        return page, None
+
+    async def exists(self, subject_uuid: UUID, predicate: str, object_uuid: UUID) -> bool:
+        async with self._connection() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(self._perm_exists_query,
+                                     (subject_uuid, predicate, object_uuid))
+                (exists,) = await cursor.fetchone()
+                return exists
+
+    async def check(self, perms: Iterable[PermTriple]) -> list[bool]:
+        perms = list(perms)
+        if not perms:
+            return []
+
+        async with self._connection() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(self._check_perms_query,
+                                     ([perm.subject_uuid for perm in perms],
+                                      [perm.predicate for perm in perms],
+                                      [perm.object_uuid for perm in perms]))
+                return [exists for (exists,) in await cursor.fetchall()]
 
     async def delete(self,
                      subject_uuids: Iterable[UUID] = None,
                      predicates: Iterable[str] = None,
-                     object_uuids: Iterable[UUID] = None) -> Set[Triple]:
-
-        await self._ensure_table()
-        async with await self._make_connection() as connection:
-            delete_clause = "DELETE FROM perms"
-            returning_clause = "RETURNING subject_uuid, predicate, object_uuid"
-
-            where_conditions, where_values = build_where_clause(subject_uuids,
-                                                                predicates,
-                                                                object_uuids)
-            if where_conditions:
-                where_clause = f"WHERE {' AND '.join(where_conditions)}"
-                async with connection.cursor() as cursor:
-                    await cursor.execute(f"{delete_clause} {where_clause} {returning_clause};", where_values)
-                    results = await cursor.fetchall()
-                    return set(Triple(*row) for row in results)
-            else:
-                async with connection.cursor() as cursor:
-                    await cursor.execute(f"{delete_clause} {returning_clause};")
-                    results = await cursor.fetchall()
-                    return set(Triple(*row) for row in results)
+                     object_uuids: Iterable[UUID] = None,
+                     returning: bool = True) -> Set[Triple] | int:
+
+        query, values = build_query(DELETE_TRIPLES, subject_uuids, predicates, object_uuids,
+                                    suffix=RETURNING_TRIPLES if returning else "")
+        async with self._connection() as connection:
+            async with connection.cursor() as cursor:
+                await cursor.execute(query, values)
+                if not returning:
+                    # Without RETURNING, only the row count comes back from the server
+                    return cursor.rowcount
+                results = await cursor.fetchall()
+                return set(Triple(*row) for row in results)
+
+    def describe_query(self, operation: str,
+                       subject_uuids: Iterable[UUID] = None,
+                       predicates: Iterable[str] = None,
+                       object_uuids: Iterable[UUID] = None,
+                       returning: bool = True,
+                       cursor: Optional[str] = None) -> Optional[str]:
+        """Returns the SQL an operation runs for the filters, and for read_page the cursor,
+        without its values."""
+        statement, suffix = {
+            "read": (SELECT_TRIPLES, ""),
+            "stream": (SELECT_TRIPLES, ""),
+            "read_page": (SELECT_TRIPLES, PAGE_ORDER),
+            "count": (COUNT_TRIPLES, ""),
+            "delete": (DELETE_TRIPLES, RETURNING_TRIPLES if returning else ""),
+        }.get(operation, (None, None))
+        if statement is None:
+            return None
+        after = None
+        if operation == "read_page" and cursor is not None:
+            after = cursors.decode_cursor(cursor, UUID, str, UUID)
+        query, _ = build_query(statement, subject_uuids, predicates, object_uuids, suffix, after)
+        return query
@@ -0,0 +1,63 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+
+class ConnectionPool:
+    """Lends out long-lived connections, opening up to max_size of them as needed.
+
+    A connection's transaction is committed when it is returned, or rolled
+    back if the borrower raised. Connections that were closed or broken
+    while borrowed, or could not be rolled back, are dropped rather than
+    returned to the pool. Callers wait for a connection once max_size are
+    borrowed. Every connection that connect opened is passed to disconnect
+    once when it is dropped or the pool closes.
+    """
+
+    def __init__(self, connect: Callable[[], Awaitable], min_size: int = 1, max_size: int = 10,
+                 disconnect: Callable[[Any], Awaitable] = None):
+        self._connect = connect
+        self._disconnect = disconnect or _close
+        self._min_size = min_size
+        self._slots = asyncio.Semaphore(max_size)
+        self._idle = []
+        self._closed = False
+
+    async def open(self):
+        """Opens min_size connections ahead of the first borrower."""
+        while len(self._idle) < self._min_size:
+            self._idle.append(await self._connect())
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator:
+        if self._closed:
+            raise RuntimeError("The connection pool is closed")
+        async with self._slots:
+            # The most recently returned connection is the least likely to have timed out
+            connection = self._idle.pop() if self._idle else await self._connect()
+            reusable = True
+            try:
+                yield connection
+                await connection.commit()
+            except BaseException:
+                try:
+                    await connection.rollback()
+                except Exception:
+                    reusable = False
+                raise
+            finally:
+                if reusable and not (self._closed or connection.closed or connection.broken):
+                    self._idle.append(connection)
+                else:
+                    await self._disconnect(connection)
+
+    async def close(self):
+        """Closes idle connections, and borrowed ones as they are returned."""
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for connection in idle:
+            await self._disconnect(connection)
+
+
+async def _close(connection):
+    await connection.close()
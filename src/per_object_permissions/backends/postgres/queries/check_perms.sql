@@ -0,0 +1,9 @@
+SELECT EXISTS (
+	SELECT 1 FROM perms
+	WHERE perms.subject_uuid = checks.subject_uuid
+		AND perms.predicate = checks.predicate
+		AND perms.object_uuid = checks.object_uuid
+)
+FROM unnest(%s::uuid[], %s::text[], %s::uuid[]) WITH ORDINALITY
+	AS checks(subject_uuid, predicate, object_uuid, position)
+ORDER BY checks.position;
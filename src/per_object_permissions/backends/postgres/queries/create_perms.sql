@@ -1,2 +1,3 @@
 INSERT INTO perms (subject_uuid, predicate, object_uuid)
-	VALUES (%s, %s, %s);
+	VALUES (%s, %s, %s)
+	ON CONFLICT DO NOTHING;
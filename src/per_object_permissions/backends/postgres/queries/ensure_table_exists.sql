@@ -4,6 +4,16 @@ CREATE TABLE IF NOT EXISTS perms (
 	object_uuid uuid
 );
 CREATE INDEX IF NOT EXISTS perms_subject_object_idx ON perms(subject_uuid, object_uuid);
-CREATE INDEX IF NOT EXISTS perms_subject_predicate_object_idx ON perms(
-	subject_uuid, predicate, object_uuid
-);
+DO $$
+BEGIN
+	IF to_regclass('perms_triple_key') IS NULL THEN
+		-- Tables from before triples were unique may hold duplicates
+		DELETE FROM perms duplicate USING perms kept
+			WHERE duplicate.ctid > kept.ctid
+			AND (duplicate.subject_uuid, duplicate.predicate, duplicate.object_uuid)
+				= (kept.subject_uuid, kept.predicate, kept.object_uuid);
+		CREATE UNIQUE INDEX perms_triple_key ON perms(subject_uuid, predicate, object_uuid);
+		DROP INDEX IF EXISTS perms_subject_predicate_object_idx;
+	END IF;
+END
+$$;
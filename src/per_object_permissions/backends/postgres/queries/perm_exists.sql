@@ -0,0 +1,4 @@
+SELECT EXISTS (
+	SELECT 1 FROM perms
+	WHERE subject_uuid = %s AND predicate = %s AND object_uuid = %s
+);
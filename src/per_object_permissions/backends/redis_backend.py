@@ -1,25 +1,79 @@
 from collections import namedtuple
 from contextlib import asynccontextmanager
-from typing import Callable, Iterable
+from typing import AsyncIterator, Callable, Iterable, Optional
 from uuid import UUID
 
 import redis.asyncio as redis
 
+from per_object_permissions import cursors, metrics
 from per_object_permissions.protocols import PermTriple
+from per_object_permissions.uuid_arrays import uuid_strings
 
 Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
 
 
+def client_factory(client_class, settings, **options) -> Callable:
+    def get_client():
+        metrics.BACKEND_CLIENTS.labels("RedisBackend").inc()
+        return client_class(host=settings.redis_host, **options)
+    return get_client
+
+
 def connection_factory(client_class, settings) -> Callable:
+    get_client = client_factory(client_class, settings)
+
     @asynccontextmanager
     async def connection_manager():
-        connection = client_class(host=settings.redis_host)
+        connection = get_client()
         yield connection
         if hasattr(connection, "close"):
             await connection.close()
     return connection_manager
 
 
+def _requested(uuids: Iterable[UUID] = None) -> set[str]:
+    return set(uuid_strings(uuids)) if uuids else set()
+
+
+def _matching_key_uuids(key: bytes,
+                        requested_subject_uuids: set[str],
+                        requested_object_uuids: set[str]) -> Optional[tuple[str, str]]:
+    """Returns the subject and object UUIDs of a key, or None if they are filtered out."""
+    _, subject_uuid, object_uuid = key.decode().split(":")
+
+    if requested_subject_uuids and subject_uuid not in requested_subject_uuids:
+        return None
+    if requested_object_uuids and object_uuid not in requested_object_uuids:
+        return None
+    return subject_uuid, object_uuid
+
+
+async def _key_triples(connection,
+                       key: bytes,
+                       requested_subject_uuids: set[str],
+                       predicates: Iterable[str],
+                       requested_object_uuids: set[str]) -> AsyncIterator[Triple]:
+    """Yields the triples stored under a key that match the filters."""
+    key_uuids = _matching_key_uuids(key, requested_subject_uuids, requested_object_uuids)
+    if key_uuids is None:
+        return
+    subject_uuid, object_uuid = key_uuids
+
+    if predicates:
+        for predicate in predicates:
+            is_member = await connection.sismember(key, predicate)
+            if is_member:
+                yield Triple(subject_uuid=subject_uuid,
+                             predicate=predicate,
+                             object_uuid=object_uuid)
+    else:
+        members = await connection.smembers(key)
+        for pred in members:
+            yield Triple(subject_uuid=subject_uuid,
+                         predicate=pred.decode(),
+                         object_uuid=object_uuid)
+
+
 class RedisBackend:
     """Stores per-object permission triples in Redis.
 
@@ -27,120 +81,186 @@ class RedisBackend:
 
     Searching by any of the three elements is around O(N)
     as no hash tables are used.
+
+    A client keeps its own pool of connections, so after startup every
+    call shares one client until shutdown.
     """
 
     def __init__(self, settings, client_class=redis.Redis, **kwargs):
         self._get_connection = connection_factory(client_class, settings)
+        self._get_client = client_factory(client_class, settings,
+                                          max_connections=settings.redis_pool_size)
+        self._shared_client = None
+
+    async def startup(self):
+        self._shared_client = self._get_client()
+
+    async def shutdown(self):
+        if self._shared_client is not None:
+            client, self._shared_client = self._shared_client, None
+            await client.close()
+
+    @asynccontextmanager
+    async def _connection(self) -> AsyncIterator[redis.Redis]:
+        """Yields the client shared after startup, or a new one for the call before it."""
+        if self._shared_client is not None:
+            yield self._shared_client
+        else:
+            async with self._get_connection() as connection:
+                yield connection
 
     def __iter__(self):
         return self.read()
 
-    async def create(self, perms: Iterable[PermTriple]) -> list[Triple]:
-        new = list()
-        async with self._get_connection() as connection:
+    async def create(self, perms: Iterable[PermTriple],
+                     returning: bool = True) -> list[Triple] | int:
+        new, count = list(), 0
+        async with self._connection() as connection:
             for perm in perms:
                 await connection.sadd(f"perms:{perm.subject_uuid}:{perm.object_uuid}", perm.predicate)
-                new.append(Triple(subject_uuid=perm.subject_uuid,
-                                  predicate=perm.predicate,
-                                  object_uuid=perm.object_uuid))
-        return new
+                count += 1
+                if returning:
+                    new.append(Triple(subject_uuid=perm.subject_uuid,
+                                      predicate=perm.predicate,
+                                      object_uuid=perm.object_uuid))
+        return new if returning else count
 
     async def read(self,
                    subject_uuids: Iterable[UUID] = None,
                    predicates: Iterable[str] = None,
                    object_uuids: Iterable[UUID] = None) -> list[Triple]:
 
-        if subject_uuids:
-            requested_subject_uuids = {str(subject_uuid)
-                                       for subject_uuid in subject_uuids}
-        else:
-            requested_subject_uuids = set()
-        if object_uuids:
-            requested_object_uuids = {str(object_uuid)
-                                      for object_uuid in object_uuids}
-        else:
-            requested_object_uuids = set()
+        return [triple async for triple in self.stream(subject_uuids,
+                                                       predicates,
+                                                       object_uuids)]
+
+    async def stream(self,
+                     subject_uuids: Iterable[UUID] = None,
+                     predicates: Iterable[str] = None,
+                     object_uuids: Iterable[UUID] = None) -> AsyncIterator[Triple]:
 
-        results = list()
+        requested_subject_uuids = _requested(subject_uuids)
+        requested_object_uuids = _requested(object_uuids)
 
-        async with self._get_connection() as connection:
+        async with self._connection() as connection:
             async for key in connection.scan_iter(match="perms:*"):
-                _, subject_uuid, object_uuid = key.decode().split(":")
+                async for triple in _key_triples(connection, key,
+                                                 requested_subject_uuids,
+                                                 predicates,
+                                                 requested_object_uuids):
+                    yield triple
 
-                if (
-                    requested_subject_uuids
-                    and subject_uuid not in requested_subject_uuids
-                ):
-                    continue
+    async def count(self,
+                    subject_uuids: Iterable[UUID] = None,
+                    predicates: Iterable[str] = None,
+                    object_uuids: Iterable[UUID] = None) -> int:
 
-                if (
-                    requested_object_uuids
-                    and object_uuid not in requested_object_uuids
-                ):
-                    continue
+        requested_subject_uuids = _requested(subject_uuids)
+        requested_object_uuids = _requested(object_uuids)
 
+        count = 0
+        async with self._connection() as connection:
+            async for key in connection.scan_iter(match="perms:*"):
+                if not _matching_key_uuids(key, requested_subject_uuids,
+                                           requested_object_uuids):
+                    continue
                 if predicates:
                     for predicate in predicates:
-                        is_member = await connection.sismember(key, predicate)
-                        if is_member:
-                            results.append(Triple(subject_uuid=subject_uuid,
-                                                  predicate=predicate,
-                                                  object_uuid=object_uuid))
+                        count += await connection.sismember(key, predicate)
                 else:
-                    members = await connection.smembers(key)
-                    for pred in members:
-                        results.append(Triple(subject_uuid=subject_uuid,
-                                              predicate=pred.decode(),
-                                              object_uuid=object_uuid))
-            return results
+                    count += await connection.scard(key)
+        return count
+
+    async def read_page(self,
+                        subject_uuids: Iterable[UUID] = None,
+                        predicates: Iterable[str] = None,
+                        object_uuids: Iterable[UUID] = None,
+                        limit: int = 1000,
+                        cursor: Optional[str] = None) -> tuple[list[Triple], Optional[str]]:
+        """Pages through the keys with Redis' SCAN cursor.
+
+        A batch of keys returned by SCAN cannot be split, so a page holds
+        whole batches and may contain more than limit triples. As with SCAN,
+        a triple may appear on more than one page if Redis rehashes its keys
+        during the walk.
+        """
+        requested_subject_uuids = _requested(subject_uuids)
+        requested_object_uuids = _requested(object_uuids)
+        scan_cursor = 0
+        if cursor is not None:
+            (scan_cursor,) = cursors.decode_cursor(cursor, int)
+
+        page = list()
+        async with self._connection() as connection:
+            while True:
+                scan_cursor, keys = await connection.scan(scan_cursor,
+                                                          match="perms:*",
+                                                          count=limit)
+                for key in keys:
+                    async for triple in _key_triples(connection, key,
+                                                     requested_subject_uuids,
+                                                     predicates,
+                                                     requested_object_uuids):
+                        page.append(triple)
+                if not scan_cursor or len(page) >= limit:
+                    break
+
+        return page, cursors.encode_cursor(scan_cursor) if scan_cursor else None
+
+    async def exists(self, subject_uuid: UUID, predicate: str, object_uuid: UUID) -> bool:
+        async with self._connection() as connection:
+            return bool(await connection.sismember(f"perms:{subject_uuid}:{object_uuid}",
+                                                   predicate))
+
+    async def check(self, perms: Iterable[PermTriple]) -> list[bool]:
+        async with self._connection() as connection:
+            pipeline = connection.pipeline(transaction=False)
+            for perm in perms:
+                pipeline.sismember(f"perms:{perm.subject_uuid}:{perm.object_uuid}",
+                                   perm.predicate)
+            return [bool(is_member) for is_member in await pipeline.execute()]
 
     async def delete(self,
                      subject_uuids: Iterable[UUID] = None,
                      predicates: Iterable[str] = None,
-                     object_uuids: Iterable[UUID] = None) -> list[PermTriple]:
+                     object_uuids: Iterable[UUID] = None,
+                     returning: bool = True) -> list[PermTriple] | int:
 
-        if subject_uuids:
-            requested_subject_uuids = {str(subject_uuid)
-                                       for subject_uuid in subject_uuids}
-        else:
-            requested_subject_uuids = set()
-        if object_uuids:
-            requested_object_uuids = {str(object_uuid)
-                                      for object_uuid in object_uuids}
-        else:
-            requested_object_uuids = set()
+        requested_subject_uuids = _requested(subject_uuids)
+        requested_object_uuids = _requested(object_uuids)
 
-        deleted = list()
+        deleted, deleted_count = list(), 0
 
-        async with self._get_connection() as connection:
+        async with self._connection() as connection:
             async for key in connection.scan_iter(match="perms:*"):
-                _, subject_uuid, object_uuid = key.decode().split(":")
-
-                if (
-                    requested_subject_uuids
-                    and subject_uuid not in requested_subject_uuids
-                ):
-                    continue
-
-                if (
-                    requested_object_uuids
-                    and object_uuid not in requested_object_uuids
-                ):
+                key_uuids = _matching_key_uuids(key, requested_subject_uuids,
+                                                requested_object_uuids)
+                if key_uuids is None:
                     continue
+                subject_uuid, object_uuid = key_uuids
 
                 if predicates:
                     for predicate in predicates:
                         removed_count = await connection.srem(key, predicate)
                         if removed_count == 1:
-                            deleted.append(Triple(subject_uuid=subject_uuid,
-                                                  predicate=predicate,
-                                                  object_uuid=object_uuid))
-                else:
+                            deleted_count += 1
+                            if returning:
+                                deleted.append(Triple(subject_uuid=subject_uuid,
+                                                      predicate=predicate,
+                                                      object_uuid=object_uuid))
+                elif returning:
                     preds = await connection.smembers(key)
                     await connection.delete(key)
                     for pred in preds:
                         deleted.append(Triple(subject_uuid=subject_uuid,
                                               predicate=pred.decode(),
                                               object_uuid=object_uuid))
+                else:
+                    # Count the members and delete the key in one round trip
+                    pipeline = connection.pipeline(transaction=True)
+                    pipeline.scard(key)
+                    pipeline.delete(key)
+                    member_count, _ = await pipeline.execute()
+                    deleted_count += member_count
 
-        return deleted
+        return deleted if returning else deleted_count
@@ -0,0 +1,422 @@
+import asyncio
+import fcntl
+import mmap
+import os
+import struct
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, Iterable, Optional, Set, TypeVar
+from uuid import UUID
+
+import numpy as np
+
+from per_object_permissions import cursors
+from per_object_permissions.protocols import PermTriple, UnsupportedTriple
+from per_object_permissions.uuid_arrays import uuid_bytes
+
+Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
+
+T = TypeVar("T")
+
+MAGIC = b"POPSHM01"
+# Magic, generation, row count, merged row count, capacity, predicate count
+HEADER = struct.Struct("<8sQQQQI")
+GENERATION_OFFSET, COUNT_OFFSET, CAPACITY_OFFSET, PREDICATE_COUNT_OFFSET = 8, 16, 32, 40
+DEFAULT_INITIAL_CAPACITY = 65536
+MAX_PREDICATES = 1024
+PREDICATE_SLOT_SIZE = 64
+PREDICATES_OFFSET = 64
+ROWS_OFFSET = PREDICATES_OFFSET + MAX_PREDICATES * PREDICATE_SLOT_SIZE
+
+# Number of rows decoded into triples at a time when streaming
+STREAM_CHUNK_SIZE = 10000
+
+# Times a read is tried without the lock before it waits for the lock instead
+OPTIMISTIC_READ_ATTEMPTS = 100
+
+# Number of rows kept in the tail after the merged rows before they are merged
+# in, which rewrites the stored rows
+TAIL_LIMIT = 4096
+
+# Number of sorted rows first filtered when seeking a page's matches, doubling
+# until the page is full
+PAGE_SCAN_CHUNK_SIZE = 4096
+
+ROW = np.dtype([("subject", "V16"), ("object", "V16"), ("predicate", "<u4")])
+RECORD = np.dtype((np.void, ROW.itemsize))  # A whole row as one value
+
+
+def _uuid_column(uuids: Iterable[UUID]) -> np.ndarray:
+    return np.frombuffer(uuid_bytes(uuids), dtype="V16")
+
+
+def _contains(records: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Returns a boolean array of which values are among the sorted records."""
+    positions = np.searchsorted(records, values)
+    found = positions < len(records)
+    found[found] = records[positions[found]] == values[found]
+    return found
+
+
+def _stored(rows: np.ndarray, merged_count: int, values: np.ndarray) -> np.ndarray:
+    """Returns a boolean array of which values are among the merged rows or the tail."""
+    records = rows.view(RECORD)
+    return _contains(records[:merged_count], values) | _contains(records[merged_count:], values)
+
+
+def _merge(records: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Returns the sorted records with the sorted values inserted in order."""
+    return np.insert(records, np.searchsorted(records, values), values)
+
+
+class SharedMemoryBackend:
+    """Stores per-object permission triples in a memory-mapped file shared by processes.
+
+    Every worker process maps the same file (under /dev/shm by default),
+    so the triples are held once and writes from one worker are visible
+    to the others. Rows are packed 36 byte records of raw UUID bytes and
+    a predicate index, filtered with NumPy directly over the mapping.
+    Rows are sorted by their bytes, so existence checks and paged reads
+    seek to rows with a binary search rather than scanning them. Creates
+    insert rows into a short, separately sorted tail after the merged rows,
+    which is only merged into them once it outgrows TAIL_LIMIT, so that
+    most writes do not rewrite the whole store.
+
+    Writers take an exclusive lock on the file and make the header's
+    generation counter odd while they mutate it. Readers do not lock:
+    they retry a query if the generation was odd or changed while they
+    were reading.
+
+    """
+
+    def __init__(self, settings=None, path: str = None, initial_capacity: int = None,
+                 **kwargs):
+        if settings is not None:
+            path = path or settings.shared_memory_path
+            initial_capacity = initial_capacity or settings.shared_memory_initial_capacity
+        self._path = path
+        self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._mmap = None
+        self._rows = None
+        self._predicates = []
+        self._predicate_ids = {}
+        self._sync_lock = threading.Lock()
+        with self._write_lock():
+            if os.fstat(self._fd).st_size == 0:
+                capacity = initial_capacity or DEFAULT_INITIAL_CAPACITY
+                os.ftruncate(self._fd, ROWS_OFFSET + capacity * ROW.itemsize)
+                self._map()
+                HEADER.pack_into(self._mmap, 0, MAGIC, 0, 0, 0, capacity, 0)
+            else:
+                self._map()
+                if self._mmap[:len(MAGIC)] != MAGIC:
+                    raise ValueError(f"{self._path} is not a shared permission store")
+
+    def __iter__(self):
+        return iter(self._decode(self._locked_scan(lambda rows, _: rows.copy())))
+
+    def _map(self):
+        """(Re)maps the whole file, which only ever grows."""
+        size = os.fstat(self._fd).st_size
+        self._mmap = mmap.mmap(self._fd, size)
+        self._rows = np.frombuffer(self._mmap, dtype=ROW, offset=ROWS_OFFSET,
+                                   count=(size - ROWS_OFFSET) // ROW.itemsize)
+
+    def _header(self) -> tuple[int, int, int, int, int]:
+        _, generation, count, merged_count, capacity, predicate_count = HEADER.unpack_from(
+            self._mmap, 0
+        )
+        return generation, count, merged_count, capacity, predicate_count
+
+    def _set_generation(self, generation: int):
+        struct.pack_into("<Q", self._mmap, GENERATION_OFFSET, generation)
+
+    def _sync_predicates(self, predicate_count: int):
+        for index in range(len(self._predicates), predicate_count):
+            offset = PREDICATES_OFFSET + index * PREDICATE_SLOT_SIZE
+            slot = self._mmap[offset:offset + PREDICATE_SLOT_SIZE]
+            predicate = slot.rstrip(b"\0").decode()
+            self._predicates.append(predicate)
+            self._predicate_ids[predicate] = index
+
+    def _sync(self) -> tuple[int, int, int]:
+        """Catches up with the shared header, returning the generation and row counts."""
+        with self._sync_lock:  # Locked reads sync from another thread
+            generation, count, merged_count, capacity, predicate_count = self._header()
+            if capacity > len(self._rows):
+                self._map()
+            self._sync_predicates(predicate_count)
+        return generation, count, merged_count
+
+    @contextmanager
+    def _write_lock(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _writing(self):
+        """Holds the write lock with an odd generation, returning the row counts."""
+        with self._write_lock():
+            generation, count, merged_count = self._sync()
+            # A writer that died mid-write leaves the generation odd
+            generation += generation & 1
+            self._set_generation(generation + 1)
+            try:
+                yield count, merged_count
+            finally:
+                self._set_generation(generation + 2)
+
+    def _set_counts(self, count: int, merged_count: int):
+        struct.pack_into("<QQ", self._mmap, COUNT_OFFSET, count, merged_count)
+
+    def _intern_predicate(self, predicate: str) -> int:
+        try:
+            return self._predicate_ids[predicate]
+        except KeyError:
+            pass
+        encoded = predicate.encode()
+        index = len(self._predicates)
+        if index >= MAX_PREDICATES:
+            raise UnsupportedTriple(f"No more than {MAX_PREDICATES} predicates can be stored")
+        if len(encoded) > PREDICATE_SLOT_SIZE:
+            raise UnsupportedTriple(f"Predicates are limited to {PREDICATE_SLOT_SIZE} bytes")
+        offset = PREDICATES_OFFSET + index * PREDICATE_SLOT_SIZE
+        self._mmap[offset:offset + len(encoded)] = encoded
+        struct.pack_into("<I", self._mmap, PREDICATE_COUNT_OFFSET, index + 1)
+        self._predicates.append(predicate)
+        self._predicate_ids[predicate] = index
+        return index
+
+    def _reserve(self, count: int, extra: int):
+        capacity = len(self._rows)
+        if count + extra <= capacity:
+            return
+        while capacity < count + extra:
+            capacity *= 2
+        os.ftruncate(self._fd, ROWS_OFFSET + capacity * ROW.itemsize)
+        self._map()
+        struct.pack_into("<Q", self._mmap, CAPACITY_OFFSET, capacity)
+
+    def _mask(self, rows: np.ndarray,
+              subject_uuids: Iterable[UUID] = None,
+              predicates: Iterable[str] = None,
+              object_uuids: Iterable[UUID] = None) -> np.ndarray:
+        mask = np.ones(len(rows), dtype=bool)
+        if subject_uuids:
+            mask &= np.isin(rows["subject"], _uuid_column(subject_uuids))
+        if predicates:
+            predicate_ids = [self._predicate_ids[predicate] for predicate in predicates
+                             if predicate in self._predicate_ids]
+            mask &= np.isin(rows["predicate"], predicate_ids)
+        if object_uuids:
+            mask &= np.isin(rows["object"], _uuid_column(object_uuids))
+        return mask
+
+    def _decode(self, rows: np.ndarray) -> Set[Triple]:
+        return set(self._decode_ordered(rows))
+
+    def _decode_ordered(self, rows: np.ndarray) -> list[Triple]:
+        predicates = self._predicates
+        uuids = {}
+
+        def to_uuid(value: bytes) -> UUID:
+            try:
+                return uuids[value]
+            except KeyError:
+                uuid = uuids[value] = UUID(bytes=value)
+                return uuid
+
+        subjects = rows["subject"].tobytes()
+        objects = rows["object"].tobytes()
+        return [
+            Triple(to_uuid(subjects[offset:offset + 16]),
+                   predicates[predicate_id],
+                   to_uuid(objects[offset:offset + 16]))
+            for offset, predicate_id in zip(range(0, len(subjects), 16),
+                                            rows["predicate"].tolist())
+        ]
+
+    async def _consistent(self, scan: Callable[[np.ndarray, int], T]) -> T:
+        """Applies the scan to the stored rows and merged row count without locking.
+
+        The scan is retried while a writer changes the rows, so it must copy
+        anything it returns out of the mapping. If it keeps being interrupted,
+        or a writer died leaving the generation odd, it runs under the write
+        lock in another thread instead, so that waiting for the lock does not
+        block the event loop.
+        """
+        for _ in range(OPTIMISTIC_READ_ATTEMPTS):
+            generation, count, merged_count = self._sync()
+            if generation % 2:
+                await asyncio.sleep(0)
+                continue
+            result = scan(self._rows[:count], merged_count)
+            if self._header()[0] == generation:
+                return result
+
+        return await asyncio.to_thread(self._locked_scan, scan)
+
+    def _locked_scan(self, scan: Callable[[np.ndarray, int], T]) -> T:
+        """Applies the scan under the write lock, also making a dead writer's odd generation even.
+
+        The lock is taken through a descriptor of its own, as flock locks held
+        through the same descriptor would not exclude this process's writers.
+        """
+        fd = os.open(self._path, os.O_RDWR)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            generation, count, merged_count = self._sync()
+            if generation % 2:
+                self._set_generation(generation + 1)
+            return scan(self._rows[:count], merged_count)
+        finally:
+            os.close(fd)
+
+    async def _matches(self,
+                       subject_uuids: Iterable[UUID] = None,
+                       predicates: Iterable[str] = None,
+                       object_uuids: Iterable[UUID] = None) -> np.ndarray:
+        """Returns a copy of the rows matching the filters."""
+        return await self._consistent(
+            lambda rows, _: rows[self._mask(rows, subject_uuids, predicates, object_uuids)]
+        )
+
+    async def create(self, perms: Iterable[PermTriple],
+                     returning: bool = True) -> list[Triple] | int:
+        triples = [
+            Triple(perm.subject_uuid, perm.predicate, perm.object_uuid)
+            for perm in perms
+        ]
+        if not triples:
+            return triples if returning else 0
+
+        with self._writing() as (count, merged_count):
+            batch = np.empty(len(triples), dtype=ROW)
+            batch["subject"] = _uuid_column(triple.subject_uuid for triple in triples)
+            batch["object"] = _uuid_column(triple.object_uuid for triple in triples)
+            batch["predicate"] = [self._intern_predicate(triple.predicate)
+                                  for triple in triples]
+
+            records = np.unique(batch.view(RECORD))
+            new_records = records[~_stored(self._rows[:count], merged_count, records)]
+
+            if len(new_records):
+                self._reserve(count, len(new_records))
+                stored = self._rows[:count].view(RECORD)
+                tail = _merge(stored[merged_count:], new_records)
+                count += len(new_records)
+                if len(tail) > TAIL_LIMIT:
+                    self._rows[:count] = _merge(stored[:merged_count], tail).view(ROW)
+                    merged_count = count
+                else:
+                    self._rows[merged_count:count] = tail.view(ROW)
+                self._set_counts(count, merged_count)
+
+        return triples if returning else len(triples)
+
+    async def read(self,
+                   subject_uuids: Iterable[UUID] = None,
+                   predicates: Iterable[str] = None,
+                   object_uuids: Iterable[UUID] = None) -> Set[Triple]:
+
+        return self._decode(await self._matches(subject_uuids, predicates, object_uuids))
+
+    async def stream(self,
+                     subject_uuids: Iterable[UUID] = None,
+                     predicates: Iterable[str] = None,
+                     object_uuids: Iterable[UUID] = None) -> AsyncIterator[Triple]:
+
+        matches = await self._matches(subject_uuids, predicates, object_uuids)
+        for start in range(0, len(matches), STREAM_CHUNK_SIZE):
+            for triple in self._decode(matches[start:start + STREAM_CHUNK_SIZE]):
+                yield triple
+
+    async def count(self,
+                    subject_uuids: Iterable[UUID] = None,
+                    predicates: Iterable[str] = None,
+                    object_uuids: Iterable[UUID] = None) -> int:
+
+        return await self._consistent(lambda rows, _: int(np.count_nonzero(
+            self._mask(rows, subject_uuids, predicates, object_uuids)
+        )))
+
+    async def read_page(self,
+                        subject_uuids: Iterable[UUID] = None,
+                        predicates: Iterable[str] = None,
+                        object_uuids: Iterable[UUID] = None,
+                        limit: int = 1000,
+                        cursor: Optional[str] = None) -> tuple[list[Triple], Optional[str]]:
+        """Pages through the matches ordered by their raw record bytes.
+
+        Predicate indexes are never reused, so a cursor stays valid across
+        writes from any process.
+        """
+        after = None
+        if cursor is not None:
+            (after,) = cursors.decode_cursor(cursor, bytes.fromhex)
+            if len(after) != ROW.itemsize:
+                raise cursors.InvalidCursor(f"Invalid cursor: {cursor!r}")
+
+        def seek(records: np.ndarray) -> int:
+            return 0 if after is None else np.searchsorted(records, np.void(after), side="right")
+
+        def scan(rows: np.ndarray, merged_count: int) -> np.ndarray:
+            records = rows.view(RECORD)
+            merged_records, tail = records[:merged_count], records[merged_count:]
+            tail = tail[seek(tail):]
+            found = [tail[self._mask(tail.view(ROW), subject_uuids, predicates, object_uuids)]]
+            start, found_count = seek(merged_records), 0
+            chunk_size = max(limit + 1, PAGE_SCAN_CHUNK_SIZE)
+            while start < len(merged_records) and found_count <= limit:
+                chunk = merged_records[start:start + chunk_size]
+                found.append(chunk[self._mask(chunk.view(ROW), subject_uuids, predicates,
+                                              object_uuids)])
+                found_count += len(found[-1])
+                start += chunk_size
+                chunk_size *= 2
+            return np.sort(np.concatenate(found))[:limit + 1]
+
+        matches = await self._consistent(scan)
+        page = matches[:limit]
+        triples = self._decode_ordered(page.view(ROW))
+        if len(matches) > limit:
+            return triples, cursors.encode_cursor(page[-1].tobytes().hex())
+        return triples, None
+
+    async def exists(self, subject_uuid: UUID, predicate: str, object_uuid: UUID) -> bool:
+        (exists,) = await self.check([Triple(subject_uuid, predicate, object_uuid)])
+        return exists
+
+    async def check(self, perms: Iterable[PermTriple]) -> list[bool]:
+        perms = list(perms)
+        self._sync()
+        missing = MAX_PREDICATES
+        checks = np.empty(len(perms), dtype=ROW)
+        checks["subject"] = _uuid_column(perm.subject_uuid for perm in perms)
+        checks["object"] = _uuid_column(perm.object_uuid for perm in perms)
+        checks["predicate"] = [self._predicate_ids.get(perm.predicate, missing)
+                               for perm in perms]
+        return await self._consistent(
+            lambda rows, merged_count: _stored(rows, merged_count, checks.view(RECORD)).tolist()
+        )
+
+    async def delete(self,
+                     subject_uuids: Iterable[UUID] = None,
+                     predicates: Iterable[str] = None,
+                     object_uuids: Iterable[UUID] = None,
+                     returning: bool = True) -> Set[Triple] | int:
+
+        with self._writing() as (count, merged_count):
+            stored = self._rows[:count]
+            mask = self._mask(stored, subject_uuids, predicates, object_uuids)
+            deleted = self._decode(stored[mask]) if returning else int(np.count_nonzero(mask))
+            kept = stored[~mask]
+            self._rows[:len(kept)] = kept
+            # Keeping the rows in order keeps the merged rows and the tail sorted
+            self._set_counts(len(kept), merged_count - int(np.count_nonzero(mask[:merged_count])))
+
+        return deleted
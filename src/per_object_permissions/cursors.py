@@ -0,0 +1,30 @@
+"""Opaque cursors for keyset pagination.
+
+A cursor records the sort key of the last triple on a page, so that
+the next page can be found by seeking past that key rather than by
+skipping rows. Each backend chooses the key that suits its storage.
+"""
+import base64
+import json
+from typing import Any, Callable
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor was not issued by the backend reading it."""
+
+
+def encode_cursor(*key: Any) -> str:
+    """Encodes the key values as a URL-safe string, converting non-JSON values with str."""
+    data = json.dumps(key, default=str, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def decode_cursor(cursor: str, *parsers: Callable[[Any], Any]) -> tuple:
+    """Decodes a cursor, parsing each key value with the parser in the same position."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if not isinstance(key, list) or len(key) != len(parsers):
+            raise ValueError("Unexpected cursor key")
+        return tuple(parse(value) for parse, value in zip(parsers, key))
+    except (TypeError, ValueError) as error:
+        raise InvalidCursor(f"Invalid cursor: {cursor!r}") from error
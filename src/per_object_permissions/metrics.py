@@ -0,0 +1,214 @@
+"""Counters, gauges and histograms rendered in the Prometheus text format.
+
+Recording a sample is a dictionary lookup and an addition, so metrics
+are cheap enough to stay on in production. Each process keeps its own
+samples, so a multi-worker deployment is scraped per worker.
+"""
+import bisect
+from typing import Callable, Iterator, Mapping, Sequence
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# 64 bytes up to 64 MiB
+SIZE_BUCKETS = tuple(float(4 ** power) for power in range(3, 14))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _sample(name: str, labels: str, value: float) -> str:
+    return f"{name}{{{labels}}} {_number(value)}" if labels else f"{name} {_number(value)}"
+
+
+class Registry:
+    """The metrics rendered together for a scrape."""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric: "Metric"):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def samples(self, name: str, labels: str) -> Iterator[str]:
+        yield _sample(name, labels, self.value)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def samples(self, name: str, labels: str) -> Iterator[str]:
+        separator = "," if labels else ""
+        cumulative = 0
+        for bound, count in zip((*self.bounds, float("inf")), self.counts):
+            cumulative += count
+            yield _sample(f"{name}_bucket", f'{labels}{separator}le="{_number(bound)}"',
+                          cumulative)
+        yield _sample(f"{name}_sum", labels, self.sum)
+        yield _sample(f"{name}_count", labels, cumulative)
+
+
+class Metric:
+    """A named metric with a child value for each combination of label values."""
+
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        registry.register(self)
+
+    def _child(self):
+        return _Value()
+
+    def labels(self, *values: str):
+        try:
+            return self._children[values]
+        except KeyError:
+            child = self._children[values] = self._child()
+            return child
+
+    def _label_text(self, values: Sequence) -> str:
+        return ",".join(f'{name}="{_escape(value)}"'
+                        for name, value in zip(self.labelnames, values))
+
+    def _samples(self) -> Iterator[str]:
+        for values, child in self._children.items():
+            yield from child.samples(self.name, self._label_text(values))
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.type}"
+        yield from self._samples()
+
+
+class Counter(Metric):
+    type = "counter"
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+
+    def _child(self):
+        return _HistogramValue(self.buckets)
+
+
+class Collected(Metric):
+    """A metric whose values are read from a function at each scrape.
+
+    The function returns a mapping of label value tuples to values.
+    """
+
+    def __init__(self, name: str, documentation: str, type: str,
+                 collect: Callable[[], Mapping[tuple, float]], **kwargs):
+        super().__init__(name, documentation, **kwargs)
+        self.type = type
+        self._collect = collect
+
+    def _samples(self) -> Iterator[str]:
+        for values, value in self._collect().items():
+            yield _sample(self.name, self._label_text(values), value)
+
+
+BACKEND_SECONDS = Histogram(
+    "perms_backend_operation_seconds",
+    "Time spent in backend operations.",
+    ["backend", "operation"],
+)
+BACKEND_ROWS = Counter(
+    "perms_backend_rows_total",
+    "Triples returned, created, deleted or checked by backend operations.",
+    ["backend", "operation"],
+)
+BACKEND_IN_FLIGHT = Gauge(
+    "perms_backend_operations_in_flight",
+    "Backend operations currently running.",
+    ["backend", "operation"],
+)
+BACKEND_CLIENTS = Counter(
+    "perms_backend_clients_total",
+    "Database clients created by backends, each of which pools its own connections.",
+    ["backend"],
+)
+BACKEND_CONNECTIONS = Gauge(
+    "perms_backend_connections_open",
+    "Connections open to the backend's database, for backends that pool them in the app.",
+    ["backend"],
+)
+HTTP_SECONDS = Histogram(
+    "perms_http_request_seconds",
+    "Time spent handling requests, including sending the response.",
+    ["endpoint"],
+)
+HTTP_REQUESTS = Counter(
+    "perms_http_requests_total",
+    "Requests handled.",
+    ["endpoint", "status"],
+)
+HTTP_IN_FLIGHT = Gauge(
+    "perms_http_requests_in_flight",
+    "Requests currently being handled.",
+    ["endpoint"],
+)
+HTTP_REQUEST_BYTES = Histogram(
+    "perms_http_request_bytes",
+    "Size of request bodies.",
+    ["endpoint"],
+    buckets=SIZE_BUCKETS,
+)
+HTTP_RESPONSE_BYTES = Histogram(
+    "perms_http_response_bytes",
+    "Size of response bodies.",
+    ["endpoint"],
+    buckets=SIZE_BUCKETS,
+)
@@ -1,4 +1,4 @@
-from typing import Iterable, Protocol
+from typing import AsyncIterator, Iterable, Optional, Protocol
 from uuid import UUID
 
 
@@ -8,12 +8,21 @@ class PermTriple(Protocol):
     object_uuid: UUID
 
 
+class UnsupportedTriple(ValueError):
+    """Raised when a backend cannot store a triple, e.g. because its predicate is too long."""
+
+
 class PerObjectPermissionBackend(Protocol):
-    async def create(self, perms: Iterable[PermTriple]) -> Iterable[PermTriple]:
+    async def create(self, perms: Iterable[PermTriple],
+                     returning: bool = True) -> Iterable[PermTriple] | int:
         """Create a permission triple linking a subject and object via a predicate.
 
         This method persists the fact that some entity can perform some action
         on some other entity.
+
+        If returning is false, only the number of triples is returned,
+        and the created triples should not be built. Triples that the
+        backend cannot store raise UnsupportedTriple.
         """
 
     async def read(self,
@@ -25,11 +34,75 @@ class PerObjectPermissionBackend(Protocol):
         If no arguments are passed in, all permission triples will be returned.
         """
 
+    def stream(self,
+               subject_uuids: Iterable[UUID] = None,
+               predicates: Iterable[str] = None,
+               object_uuids: Iterable[UUID] = None) -> AsyncIterator[PermTriple]:
+        """Iterate over permission triples matching the same filters as read.
+
+        Triples should be yielded as they are fetched so that large results
+        can be sent on without holding all of them in memory.
+        """
+
+    async def count(self,
+                    subject_uuids: Iterable[UUID] = None,
+                    predicates: Iterable[str] = None,
+                    object_uuids: Iterable[UUID] = None) -> int:
+        """Count the triples matching the same filters as read without fetching them."""
+
+    async def read_page(self,
+                        subject_uuids: Iterable[UUID] = None,
+                        predicates: Iterable[str] = None,
+                        object_uuids: Iterable[UUID] = None,
+                        limit: int = 1000,
+                        cursor: Optional[str] = None,
+                        ) -> tuple[list[PermTriple], Optional[str]]:
+        """Read one page of the triples matching the same filters as read.
+
+        Returns up to limit triples in a stable order, and a cursor from which
+        the next page is read, or None after the last page. Pages should be
+        found by seeking past the key in the cursor rather than skipping rows,
+        so that every page costs about the same. Cursors that the backend did
+        not issue raise cursors.InvalidCursor.
+        """
+
+    async def exists(self, subject_uuid: UUID, predicate: str, object_uuid: UUID) -> bool:
+        """Check whether a single permission triple exists.
+
+        This should be answered without materialising any triples.
+        """
+
+    async def check(self, perms: Iterable[PermTriple]) -> list[bool]:
+        """Check whether each of a batch of permission triples exists.
+
+        The results are in the same order as the triples passed in.
+        The whole batch should be resolved in a single round trip.
+        """
+
     async def delete(self,
                      subject_uuids: Iterable[UUID] = None,
                      predicates: Iterable[str] = None,
-                     object_uuids: Iterable[UUID] = None) -> Iterable[PermTriple]:
+                     object_uuids: Iterable[UUID] = None,
+                     returning: bool = True) -> Iterable[PermTriple] | int:
         """Delete permission triples for any combination or subjects, objects and predicates.
 
         If no arguments are passed in, all permission triples will be deleted.
+        If returning is false, only the number of triples deleted is returned,
+        and the deleted triples should not be fetched.
         """
+
+
+class LifespanBackend(Protocol):
+    """The optional hooks of backends that hold long-lived resources, e.g. connection pools."""
+
+    async def startup(self):
+        """Open resources that later calls share, and create any tables and indexes.
+
+        This runs once, before requests are served, so that calls need no
+        bootstrap checks of their own. Backends must still work without it,
+        opening connections per call, once it has created their tables and
+        indexes in the database.
+        """
+
+    async def shutdown(self):
+        """Release the resources opened by startup."""
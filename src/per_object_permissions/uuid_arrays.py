@@ -0,0 +1,146 @@
+"""Bulk parsing of UUID arrays from request bodies.
+
+Filters may list many thousands of UUIDs. Validating each one as a
+UUID object costs more than most queries, and backends that talk to
+their database in text or raw bytes would only convert them back again.
+A UUIDArray validates a whole list of canonical UUID strings at once,
+and keeps the strings and their raw bytes for backends to use directly.
+UUID objects are only built if the array is iterated.
+"""
+import struct
+from typing import Any, Iterable, Iterator, Sequence
+from uuid import UUID
+
+CANONICAL_LENGTH = 36
+DASH_POSITIONS = (8, 13, 18, 23)
+
+
+def _canonical(value: Any) -> str:
+    """Returns the canonical string of one UUID in any form that UUID() accepts."""
+    if isinstance(value, UUID):
+        return str(value)
+    if not isinstance(value, str):
+        raise TypeError("value is not a valid uuid")
+    return str(UUID(value))
+
+
+def _parse_canonical(values: list) -> tuple[list[str], bytes] | None:
+    """Validates canonical UUID strings all at once, returning them in lower case and
+    their raw bytes, or None if any of them is not canonical."""
+    count = len(values)
+    if not all(type(value) is str and len(value) == CANONICAL_LENGTH for value in values):
+        return None
+    joined = "".join(values)
+    for position in DASH_POSITIONS:
+        if joined[position::CANONICAL_LENGTH] != "-" * count:
+            return None
+    try:
+        # fromhex skips whitespace, which the length check catches
+        raw = bytes.fromhex(joined.replace("-", ""))
+    except ValueError:
+        return None
+    if len(raw) != 16 * count:
+        return None
+    lowered = joined.lower()
+    if lowered != joined:
+        values = [value.lower() for value in values]
+    return values, raw
+
+
+class UUIDArray(Sequence[UUID]):
+    """A list of UUIDs parsed in bulk, with their canonical strings and raw bytes."""
+
+    __slots__ = ("strings", "_raw", "_uuids")
+
+    def __init__(self, strings: list[str], raw: bytes = None):
+        self.strings = strings
+        self._raw = raw
+        self._uuids = None
+
+    @classmethod
+    def parse(cls, values: Iterable[Any]) -> "UUIDArray":
+        """Parses UUIDs from strings or UUID objects, raising ValueError naming the first
+        invalid item."""
+        values = list(values)
+        parsed = _parse_canonical(values)
+        if parsed is not None:
+            return cls(*parsed)
+
+        strings = []
+        for index, value in enumerate(values):
+            try:
+                strings.append(_canonical(value))
+            except (TypeError, ValueError):
+                raise ValueError(f"item {index} is not a valid uuid")
+        return cls(strings)
+
+    @property
+    def raw(self) -> bytes:
+        """The UUIDs' 16 byte big-endian values, concatenated."""
+        if self._raw is None:
+            self._raw = bytes.fromhex("".join(self.strings).replace("-", ""))
+        return self._raw
+
+    @property
+    def uuids(self) -> list[UUID]:
+        if self._uuids is None:
+            # Building from integers skips UUID's string parsing
+            halves = struct.unpack(f">{2 * len(self.strings)}Q", self.raw)
+            interned = {}
+            uuids = []
+            for high, low in zip(halves[::2], halves[1::2]):
+                value = high << 64 | low
+                try:
+                    uuids.append(interned[value])
+                except KeyError:
+                    uuid = interned[value] = UUID(int=value)
+                    uuids.append(uuid)
+            self._uuids = uuids
+        return self._uuids
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def __getitem__(self, index):
+        return self.uuids[index]
+
+    def __iter__(self) -> Iterator[UUID]:
+        return iter(self.uuids)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, UUIDArray):
+            return self.strings == other.strings
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"UUIDArray({self.strings!r})"
+
+    @classmethod
+    def __get_validators__(cls):
+        yield cls.validate
+
+    @classmethod
+    def validate(cls, value: Any) -> "UUIDArray":
+        if isinstance(value, cls):
+            return value
+        if not isinstance(value, (list, tuple)):
+            raise TypeError("value is not a valid list")
+        return cls.parse(value)
+
+    @classmethod
+    def __modify_schema__(cls, field_schema: dict):
+        field_schema.update(type="array", items={"type": "string", "format": "uuid"})
+
+
+def uuid_strings(uuids: Iterable[UUID | str]) -> list[str]:
+    """Returns the canonical strings of UUIDs, without converting a UUIDArray again."""
+    if isinstance(uuids, UUIDArray):
+        return uuids.strings
+    return [str(uuid) for uuid in uuids]
+
+
+def uuid_bytes(uuids: Iterable[UUID]) -> bytes:
+    """Returns the concatenated raw bytes of UUIDs, without converting a UUIDArray again."""
+    if isinstance(uuids, UUIDArray):
+        return uuids.raw
+    return b"".join(uuid.bytes for uuid in uuids)
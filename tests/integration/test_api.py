@@ -5,6 +5,8 @@ These tests serve two purposes:
 - Giving some idea idea of comparative performance of the backends
   as some tests work with a moderately large number of records.
 """
+import json
+import struct
 import uuid
 from http import HTTPStatus
 
@@ -15,6 +17,9 @@ API_BASE_URL = "http://api:8008"
 READ_URL = f"{API_BASE_URL}/read-perms"
 CREATE_URL = f"{API_BASE_URL}/create-perms"
 DELETE_URL = f"{API_BASE_URL}/delete-perms"
+CHECK_URL = f"{API_BASE_URL}/check-perm"
+BATCH_CHECK_URL = f"{API_BASE_URL}/check-perms"
+INGEST_URL = f"{API_BASE_URL}/ingest-perms"
 
 
 def setup_module():
@@ -116,6 +121,20 @@ def test_create_and_delete_one(subject_one_read_object_A_data):
     assert read_response.json() == {"results": []}
 
 
+def test_create_and_check_one(subject_one_read_object_A_data):
+    data = [subject_one_read_object_A_data]
+
+    requests.post(CREATE_URL, json=data)
+    granted_response = requests.post(CHECK_URL, json=subject_one_read_object_A_data)
+    denied_response = requests.post(CHECK_URL, json={**subject_one_read_object_A_data,
+                                                     "predicate": "write"})
+
+    assert granted_response.status_code == HTTPStatus.OK
+    assert granted_response.json() == {"exists": True}
+    assert denied_response.status_code == HTTPStatus.OK
+    assert denied_response.json() == {"exists": False}
+
+
 def test_create_many(triples_data):
     data = triples_data
 
@@ -159,6 +178,100 @@ def test_create_and_delete_many(triples_data):
     assert actual_triples == expected_triples
 
 
+def test_ingest_and_read_many(triples_data):
+    """Test streaming a large body of newline delimited JSON into the backend."""
+    body = "".join(json.dumps(triple) + "\n" for triple in triples_data)
+
+    ingest_response = requests.post(INGEST_URL, data=body,
+                                    headers={"Content-Type": "application/x-ndjson"})
+
+    assert ingest_response.status_code == HTTPStatus.OK
+    assert ingest_response.json()["ingested"] == len(triples_data)
+
+    read_response = requests.post(READ_URL, json={})
+
+    expected_triples = set(make_hashable(triple) for triple in triples_data)
+    actual_triples = set(make_hashable(triple)
+                         for triple in read_response.json()["results"])
+    assert actual_triples == expected_triples
+
+
+def test_create_and_delete_many_returning_count(triples_data):
+    create_response = requests.post(f"{CREATE_URL}?return=count", json=triples_data)
+    count_response = requests.post(f"{READ_URL}?return=count", json={})
+    delete_response = requests.post(f"{DELETE_URL}?return=count", json={})
+
+    assert create_response.status_code == HTTPStatus.OK
+    assert create_response.json() == {"count": len(triples_data)}
+    assert count_response.json() == {"count": len(triples_data)}
+    assert delete_response.status_code == HTTPStatus.OK
+    assert delete_response.json() == {"count": len(triples_data)}
+
+
+def test_create_and_read_many_packed(triples_data):
+    """Test sending and receiving triples in the packed binary format."""
+    triples = [(uuid.UUID(triple["subject_uuid"]).bytes,
+                uuid.UUID(triple["object_uuid"]).bytes,
+                triple["predicate"])
+               for triple in triples_data]
+    predicates = sorted({predicate for _, _, predicate in triples})
+    body = b"POPT" + struct.pack("<H", len(predicates))
+    for predicate in predicates:
+        body += struct.pack("<H", len(predicate.encode())) + predicate.encode()
+    body += struct.pack("<I", len(triples))
+    body += b"".join(subject + object_ + struct.pack("<H", predicates.index(predicate))
+                     for subject, object_, predicate in triples)
+
+    create_response = requests.post(f"{CREATE_URL}?return=count", data=body,
+                                    headers={"Content-Type": "application/x-perm-triples"})
+    read_response = requests.post(READ_URL, json={},
+                                  headers={"Accept": "application/x-perm-triples"})
+
+    assert create_response.json() == {"count": len(triples_data)}
+    assert read_response.status_code == HTTPStatus.OK
+    assert read_response.headers["content-type"] == "application/x-perm-triples"
+    assert len(read_response.content) == len(body)
+
+
+def test_check_many(triples_data, triples_created):
+    """Test checking a batch of existing and nonexistent triples."""
+    nonexistent = [{**triple, "predicate": "own"} for triple in triples_data[:2500]]
+    check_payload = triples_data[:2500] + nonexistent
+
+    check_response = requests.post(BATCH_CHECK_URL, json=check_payload)
+
+    assert check_response.status_code == HTTPStatus.OK
+    assert check_response.json() == {"results": [True] * 2500 + [False] * 2500}
+
+
+def test_read_many_as_ndjson(triples_data, triples_created):
+    """Test streaming every triple as newline delimited JSON."""
+    read_response = requests.post(READ_URL, json={},
+                                  headers={"Accept": "application/x-ndjson"})
+
+    assert read_response.status_code == HTTPStatus.OK
+    expected_triples = set(make_hashable(triple) for triple in triples_data)
+    actual_triples = set(make_hashable(json.loads(line))
+                         for line in read_response.text.splitlines())
+    assert actual_triples == expected_triples
+
+
+def test_read_many_in_pages(triples_data, triples_created):
+    """Test walking every triple a page at a time with the returned cursor."""
+    actual_triples, cursor = [], None
+    while True:
+        read_response = requests.post(READ_URL, json={"limit": 1000, "cursor": cursor})
+        assert read_response.status_code == HTTPStatus.OK
+        actual_triples.extend(make_hashable(triple)
+                              for triple in read_response.json()["results"])
+        cursor = read_response.json()["next_cursor"]
+        if cursor is None:
+            break
+
+    expected_triples = set(make_hashable(triple) for triple in triples_data)
+    assert set(actual_triples) == expected_triples
+
+
 @pytest.mark.parametrize("subject_uuid_index", [0, 24, 49, 99])
 def test_read_filter_by_subject_uuid(subject_uuids,
                                      triples_created,
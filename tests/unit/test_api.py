@@ -1,14 +1,19 @@
+import asyncio
+import json
+import time
+import uuid
 from http import HTTPStatus
 
 import pytest
 from fastapi import testclient
 
-from per_object_permissions.api import main
+from per_object_permissions.api import main, packed, serialization
+from per_object_permissions.backends import in_memory_backend, shared_memory_backend
 
 
-async def teardown_function(function):
+def teardown_function(function):
     """Clear data from the cached in-memory backend."""
-    await main.get_backend().delete()
+    asyncio.run(main.get_backend().delete())
 
 
 @pytest.fixture(scope="module")
@@ -236,3 +241,349 @@ def test_delete_perms(client, all_data, request,
 
     read_response = client.post("/read-perms", json=payload)
     assert len(read_response.json()["results"]) == 0
+
+
+def test_check_perm(client, subject_one_read_object_A_data, subject_one_write_object_A_data):
+    client.post("create-perms", json=[subject_one_read_object_A_data])
+
+    granted_response = client.post("check-perm", json=subject_one_read_object_A_data)
+    denied_response = client.post("check-perm", json=subject_one_write_object_A_data)
+
+    assert granted_response.status_code == HTTPStatus.OK
+    assert granted_response.json() == {"exists": True}
+    assert denied_response.status_code == HTTPStatus.OK
+    assert denied_response.json() == {"exists": False}
+
+
+def test_check_perms(
+    client,
+    subject_one_read_object_A_data,
+    subject_one_write_object_A_data,
+    subject_two_write_object_A_data,
+):
+    client.post("create-perms", json=[subject_one_read_object_A_data,
+                                      subject_two_write_object_A_data])
+    payload = [subject_one_read_object_A_data,
+               subject_one_write_object_A_data,
+               subject_two_write_object_A_data]
+
+    response = client.post("check-perms", json=payload)
+    packed_response = client.post("check-perms", params={"packed": True}, json=payload)
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {"results": [True, False, True]}
+    assert packed_response.status_code == HTTPStatus.OK
+    assert packed_response.json() == {"bitmask": "BQ=="}
+
+
+def test_read_perms_as_ndjson(client, all_data, subject_two_uuid):
+    client.post("create-perms", json=all_data)
+
+    response = client.post("read-perms",
+                           json={"subject_uuids": [str(subject_two_uuid)]},
+                           headers={"Accept": "application/x-ndjson"})
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["content-type"] == "application/x-ndjson"
+    results = [json.loads(line) for line in response.text.splitlines()]
+    expected_results = [data for data in all_data
+                        if data["subject_uuid"] == str(subject_two_uuid)]
+    assert len(results) == len(expected_results)
+    for result in expected_results:
+        assert result in results
+
+
+def test_delete_perms_as_ndjson(client, all_data, object_C_uuid,
+                                subject_three_read_object_C_data,
+                                subject_three_write_object_C_data):
+    client.post("create-perms", json=all_data)
+
+    response = client.post("delete-perms",
+                           json={"object_uuids": [str(object_C_uuid)]},
+                           headers={"Accept": "application/x-ndjson"})
+
+    assert response.status_code == HTTPStatus.OK
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert len(results) == 2
+    assert subject_three_read_object_C_data in results
+    assert subject_three_write_object_C_data in results
+
+
+def test_ingest_perms(client, monkeypatch, all_data):
+    monkeypatch.setattr(main.get_settings(), "ingest_chunk_size", 4)
+    body = "".join(json.dumps(data) + "\n" for data in all_data)
+
+    response = client.post("ingest-perms", data=body,
+                           headers={"Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["ingested"] == len(all_data)
+    assert response.json()["chunks"] == -(-len(all_data) // 4)
+    read_response = client.post("read-perms", json={})
+    results = read_response.json()["results"]
+    assert len(results) == len(all_data)
+    for data in all_data:
+        assert data in results
+
+
+def test_ingest_perms_reports_invalid_line(client, monkeypatch, all_data):
+    monkeypatch.setattr(main.get_settings(), "ingest_chunk_size", 2)
+    lines = [json.dumps(data) for data in all_data[:3]] + ['{"predicate": "read"}']
+
+    response = client.post("ingest-perms", data="\n".join(lines),
+                           headers={"Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    detail = response.json()["detail"]
+    assert detail["message"].startswith("Line 4:")
+    assert detail["ingested"] == 2
+    assert detail["chunks"] == 1
+
+
+def test_ingest_perms_rejects_overlong_line(client, all_data):
+    body = json.dumps(all_data[0]) + "\n" + " " * (serialization.MAX_NDJSON_LINE_BYTES + 1)
+
+    response = client.post("ingest-perms", data=body,
+                           headers={"Content-Type": "application/x-ndjson"})
+
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert response.json()["detail"]["message"].startswith("Line 2: Longer than")
+
+
+def test_read_perms_in_pages(client, all_data):
+    client.post("create-perms", json=all_data)
+
+    results, cursor = [], None
+    while True:
+        response = client.post("read-perms", json={"limit": 3, "cursor": cursor})
+        assert response.status_code == HTTPStatus.OK
+        results.extend(response.json()["results"])
+        cursor = response.json()["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(results) == len(all_data)
+    for data in all_data:
+        assert data in results
+
+
+def test_read_perms_with_invalid_cursor(client):
+    response = client.post("read-perms", json={"limit": 3, "cursor": "not a cursor"})
+
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def test_create_perms_rejects_unsupported_triples(client, monkeypatch, tmp_path,
+                                                  subject_one_read_object_A_data):
+    backend = shared_memory_backend.SharedMemoryBackend(path=str(tmp_path / "perms"))
+    monkeypatch.setattr(main, "get_backend", lambda: backend)
+    data = {**subject_one_read_object_A_data,
+            "predicate": "x" * (shared_memory_backend.PREDICATE_SLOT_SIZE + 1)}
+
+    response = client.post("create-perms", json=[data])
+
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+
+
+def test_create_perms_returning_count(client, all_data):
+    response = client.post("create-perms?return=count", json=all_data)
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {"count": len(all_data)}
+
+
+def test_read_perms_returning_count(client, all_data, subject_two_uuid):
+    client.post("create-perms?return=none", json=all_data)
+
+    response = client.post("read-perms?return=count",
+                           json={"subject_uuids": [str(subject_two_uuid)]})
+
+    assert response.status_code == HTTPStatus.OK
+    expected_count = len([data for data in all_data
+                          if data["subject_uuid"] == str(subject_two_uuid)])
+    assert response.json() == {"count": expected_count}
+
+
+def test_delete_perms_returning_nothing(client, all_data):
+    client.post("create-perms", json=all_data)
+
+    response = client.post("delete-perms?return=none", json={})
+    read_response = client.post("read-perms?return=count", json={})
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {}
+    assert read_response.json() == {"count": 0}
+
+
+def test_read_perms_escapes_predicates(client, subject_one_read_object_A_data):
+    data = {**subject_one_read_object_A_data, "predicate": 'share "é"\n'}
+    client.post("create-perms", json=[data])
+
+    response = client.post("read-perms", json={})
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {"results": [data]}
+
+
+def test_create_and_read_perms_packed(client, all_data, subject_two_uuid):
+    triples = [packed.Triple(uuid.UUID(data["subject_uuid"]), data["predicate"],
+                             uuid.UUID(data["object_uuid"]))
+               for data in all_data]
+
+    create_response = client.post("create-perms", data=packed.encode(triples),
+                                  headers={"Content-Type": packed.MEDIA_TYPE,
+                                           "Accept": packed.MEDIA_TYPE})
+    read_response = client.post("read-perms",
+                                json={"subject_uuids": [str(subject_two_uuid)]},
+                                headers={"Accept": packed.MEDIA_TYPE})
+
+    assert create_response.status_code == HTTPStatus.OK
+    assert create_response.headers["content-type"] == packed.MEDIA_TYPE
+    assert packed.decode(create_response.content) == triples
+    assert read_response.status_code == HTTPStatus.OK
+    assert set(packed.decode(read_response.content)) == {
+        triple for triple in triples if triple.subject_uuid == subject_two_uuid
+    }
+
+
+def test_read_perms_packed_in_pages(client, all_data):
+    client.post("create-perms", json=all_data)
+
+    response = client.post("read-perms", json={"limit": 2},
+                           headers={"Accept": packed.MEDIA_TYPE})
+
+    assert response.status_code == HTTPStatus.OK
+    assert len(packed.decode(response.content)) == 2
+    assert response.headers["next-cursor"]
+
+
+def test_ingest_perms_packed(client, all_data):
+    triples = [packed.Triple(**data) for data in all_data]
+
+    response = client.post("ingest-perms", data=packed.encode(triples),
+                           headers={"Content-Type": packed.MEDIA_TYPE})
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json()["ingested"] == len(all_data)
+
+
+def test_delete_perms_with_invalid_uuid(client, subject_one_uuid):
+    response = client.post("delete-perms",
+                           json={"object_uuids": [str(subject_one_uuid), "not a uuid"]})
+
+    assert response.status_code == HTTPStatus.UNPROCESSABLE_ENTITY
+    assert response.json()["detail"][0]["loc"] == ["body", "object_uuids"]
+    assert "item 1" in response.json()["detail"][0]["msg"]
+
+
+def test_metrics(client, all_data):
+    client.post("create-perms", json=all_data)
+    client.post("read-perms", json={})
+
+    response = client.get("metrics")
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'perms_http_requests_total{endpoint="/read-perms",status="200"}' in response.text
+    assert ('perms_backend_rows_total{backend="InMemoryBackend",operation="create"}'
+            in response.text)
+
+
+def test_server_timing_is_sent_when_requested(client, all_data):
+    client.post("create-perms", json=all_data)
+
+    response = client.post("read-perms", json={}, headers={"X-Server-Timing": "1"})
+
+    phases = [phase.split(";")[0] for phase in response.headers["server-timing"].split(", ")]
+    assert {"parse", "backend", "serialize", "total"} <= set(phases)
+
+
+def test_server_timing_is_not_sent_by_default(client):
+    response = client.post("read-perms", json={})
+
+    assert "server-timing" not in response.headers
+
+
+@pytest.mark.asyncio
+async def test_reads_are_not_coalesced_across_writes():
+    released, calls = asyncio.Event(), []
+
+    async def read(**filters):
+        calls.append(filters)
+        await released.wait()
+        return []
+
+    before = asyncio.ensure_future(main.coalesced("read", read, subject_uuids=None))
+    await asyncio.sleep(0)
+    with main.writing():
+        pass
+    after = asyncio.ensure_future(main.coalesced("read", read, subject_uuids=None))
+    await asyncio.sleep(0)
+    released.set()
+    await asyncio.gather(before, after)
+
+    assert len(calls) == 2
+
+
+class LifespanBackend(in_memory_backend.InMemoryBackend):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.events = []
+
+    async def startup(self):
+        self.events.append("startup")
+
+    async def shutdown(self):
+        self.events.append("shutdown")
+
+
+def wait_until_ready(client, attempts=100):
+    for _ in range(attempts):
+        response = client.get("ready")
+        if response.status_code == HTTPStatus.OK:
+            return response
+        time.sleep(0.01)
+    return response
+
+
+def test_backend_is_started_and_stopped_with_the_app(monkeypatch):
+    backend = LifespanBackend()
+    monkeypatch.setattr(main, "get_backend", lambda: backend)
+
+    with testclient.TestClient(main.app) as started_client:
+        wait_until_ready(started_client)
+        assert backend.events == ["startup"]
+
+    assert backend.events == ["startup", "shutdown"]
+
+
+def test_ready_once_started():
+    with testclient.TestClient(main.app) as started_client:
+        response = wait_until_ready(started_client)
+
+    assert response.status_code == HTTPStatus.OK
+    assert response.json() == {"ready": True}
+
+
+class SlowStartingBackend(LifespanBackend):
+
+    async def startup(self):
+        await asyncio.sleep(3600)
+
+
+def test_not_ready_while_the_backend_starts(monkeypatch):
+    backend = SlowStartingBackend()
+    monkeypatch.setattr(main, "get_backend", lambda: backend)
+
+    with testclient.TestClient(main.app) as started_client:
+        response = started_client.get("ready")
+
+    assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
+    assert backend.events == ["shutdown"]
+
+
+def test_not_ready_before_startup(client):
+    response = client.get("ready")
+
+    assert response.status_code == HTTPStatus.SERVICE_UNAVAILABLE
@@ -0,0 +1,227 @@
+import asyncio
+from collections import namedtuple
+
+import pytest
+
+from per_object_permissions.backends import caching_backend, in_memory_backend
+
+Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
+
+
+class CountingBackend(in_memory_backend.InMemoryBackend):
+    """Records the queries that reach the wrapped backend."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queries = []
+
+    async def read(self, *args, **kwargs):
+        self.queries.append("read")
+        return await super().read(*args, **kwargs)
+
+    async def count(self, *args, **kwargs):
+        self.queries.append("count")
+        return await super().count(*args, **kwargs)
+
+    async def exists(self, *args, **kwargs):
+        self.queries.append("exists")
+        return await super().exists(*args, **kwargs)
+
+    async def check(self, perms):
+        self.queries.append("check")
+        return await super().check(perms)
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def wrapped():
+    return CountingBackend()
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def backend(wrapped, clock):
+    return caching_backend.CachingBackend(wrapped, max_entries=3, ttl=10, clock=clock)
+
+
+@pytest.mark.asyncio
+async def test_repeated_read_is_served_from_cache(
+    backend, wrapped, subject_one_uuid, read, object_A_uuid
+):
+    perm = Triple(subject_one_uuid, read, object_A_uuid)
+    await backend.create([perm])
+
+    first = await backend.read(subject_uuids=[subject_one_uuid])
+    second = await backend.read(subject_uuids=[subject_one_uuid])
+
+    assert set(first) == set(second) == {perm}
+    assert wrapped.queries == ["read"]
+    assert backend.stats == {"hits": 1, "misses": 1, "invalidations": 0, "evictions": 0,
+                             "entries": 1}
+
+
+@pytest.mark.asyncio
+async def test_filters_are_normalised(backend, wrapped, subject_one_uuid, subject_two_uuid):
+    await backend.read(subject_uuids=[subject_one_uuid, subject_two_uuid], predicates=[])
+    await backend.read(subject_uuids=[subject_two_uuid, subject_one_uuid, subject_one_uuid])
+
+    assert wrapped.queries == ["read"]
+
+
+@pytest.mark.asyncio
+async def test_create_invalidates_only_overlapping_entries(
+    backend, wrapped, subject_one_uuid, subject_two_uuid, read, write, object_A_uuid
+):
+    await backend.read(subject_uuids=[subject_one_uuid])
+    await backend.read(subject_uuids=[subject_two_uuid])
+    await backend.read(predicates=[write])
+
+    perm = Triple(subject_one_uuid, read, object_A_uuid)
+    await backend.create([perm])
+
+    assert set(await backend.read(subject_uuids=[subject_one_uuid])) == {perm}
+    assert await backend.read(subject_uuids=[subject_two_uuid]) == []
+    assert await backend.read(predicates=[write]) == []
+    assert wrapped.queries == ["read"] * 4
+    assert backend.stats["invalidations"] == 1
+
+
+@pytest.mark.asyncio
+async def test_delete_invalidates_overlapping_entries(
+    backend, wrapped, subject_one_uuid, subject_two_uuid, read, object_A_uuid, object_B_uuid
+):
+    perm = Triple(subject_one_uuid, read, object_A_uuid)
+    await backend.create([perm, Triple(subject_two_uuid, read, object_B_uuid)])
+    assert await backend.count(object_uuids=[object_A_uuid]) == 1
+    assert await backend.count(subject_uuids=[subject_two_uuid]) == 1
+    assert await backend.exists(subject_one_uuid, read, object_A_uuid)
+
+    await backend.delete(subject_uuids=[subject_one_uuid])
+
+    assert await backend.count(object_uuids=[object_A_uuid]) == 0
+    assert await backend.count(subject_uuids=[subject_two_uuid]) == 1
+    assert not await backend.exists(subject_one_uuid, read, object_A_uuid)
+    assert wrapped.queries == ["count", "count", "exists", "count", "exists"]
+
+
+@pytest.mark.asyncio
+async def test_delete_without_filters_clears_cache(backend, subject_one_uuid, read):
+    await backend.read(subject_uuids=[subject_one_uuid])
+    await backend.read(predicates=[read])
+
+    await backend.delete(returning=False)
+
+    assert backend.stats["entries"] == 0
+
+
+@pytest.mark.asyncio
+async def test_check_only_queries_uncached_triples(
+    backend, wrapped, subject_one_uuid, read, write, object_A_uuid
+):
+    perms = [Triple(subject_one_uuid, read, object_A_uuid),
+             Triple(subject_one_uuid, write, object_A_uuid)]
+    await backend.create(perms[:1])
+    assert await backend.exists(subject_one_uuid, read, object_A_uuid)
+
+    assert await backend.check(perms) == [True, False]
+    assert await backend.check(perms) == [True, False]
+    assert wrapped.queries == ["exists", "exists"]
+
+
+@pytest.mark.asyncio
+async def test_entries_expire(backend, wrapped, clock, subject_one_uuid):
+    await backend.read(subject_uuids=[subject_one_uuid])
+    clock.now = 10
+
+    await backend.read(subject_uuids=[subject_one_uuid])
+
+    assert wrapped.queries == ["read", "read"]
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_entry_is_evicted(
+    backend, wrapped, subject_one_uuid, subject_two_uuid, subject_three_uuid, read
+):
+    await backend.read(subject_uuids=[subject_one_uuid])
+    await backend.read(subject_uuids=[subject_two_uuid])
+    await backend.read(subject_uuids=[subject_three_uuid])
+    await backend.read(subject_uuids=[subject_one_uuid])
+
+    await backend.read(predicates=[read])
+    await backend.read(subject_uuids=[subject_one_uuid])
+    await backend.read(subject_uuids=[subject_two_uuid])
+
+    assert wrapped.queries == ["read"] * 5
+    assert backend.stats["evictions"] == 2
+
+
+@pytest.mark.asyncio
+async def test_reads_overlapping_writes_are_not_cached(
+    backend, wrapped, subject_one_uuid, read, object_A_uuid
+):
+    read_started, create_finished = asyncio.Event(), asyncio.Event()
+    original_read = wrapped.read
+
+    async def slow_read(*args, **kwargs):
+        results = await original_read(*args, **kwargs)
+        read_started.set()
+        await create_finished.wait()
+        return results
+
+    async def create():
+        await read_started.wait()
+        await backend.create([Triple(subject_one_uuid, read, object_A_uuid)])
+        create_finished.set()
+
+    wrapped.read = slow_read
+    stale, _ = await asyncio.gather(backend.read(subject_uuids=[subject_one_uuid]), create())
+    wrapped.read = original_read
+
+    assert stale == []
+    assert len(await backend.read(subject_uuids=[subject_one_uuid])) == 1
+
+
+@pytest.mark.asyncio
+async def test_reads_starting_during_a_write_are_not_cached(
+    backend, wrapped, subject_one_uuid, read, object_A_uuid
+):
+    create_started, read_done, create_done = asyncio.Event(), asyncio.Event(), asyncio.Event()
+    original_create, original_read = wrapped.create, wrapped.read
+
+    async def slow_create(*args, **kwargs):
+        create_started.set()
+        await read_done.wait()
+        return await original_create(*args, **kwargs)
+
+    async def slow_read(*args, **kwargs):
+        results = await original_read(*args, **kwargs)
+        read_done.set()
+        await create_done.wait()
+        return results
+
+    async def create():
+        await backend.create([Triple(subject_one_uuid, read, object_A_uuid)])
+        create_done.set()
+
+    async def read_during_create():
+        await create_started.wait()
+        return await backend.read(subject_uuids=[subject_one_uuid])
+
+    wrapped.create, wrapped.read = slow_create, slow_read
+    _, stale = await asyncio.gather(create(), read_during_create())
+    wrapped.create, wrapped.read = original_create, original_read
+
+    assert stale == []
+    assert len(await backend.read(subject_uuids=[subject_one_uuid])) == 1
@@ -0,0 +1,283 @@
+import uuid
+from collections import namedtuple
+
+import pytest
+
+from per_object_permissions import cursors
+from per_object_permissions.backends import columnar_backend
+
+Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
+
+
+@pytest.fixture(scope="module")
+def subject_one_read_object_A(subject_one_uuid, read, object_A_uuid):
+    return Triple(subject_one_uuid, read, object_A_uuid)
+
+
+@pytest.fixture(scope="module")
+def subject_one_write_object_A(subject_one_uuid, write, object_A_uuid):
+    return Triple(subject_one_uuid, write, object_A_uuid)
+
+
+@pytest.fixture(scope="module")
+def subject_one_read_object_B(subject_one_uuid, read, object_B_uuid):
+    return Triple(subject_one_uuid, read, object_B_uuid)
+
+
+@pytest.fixture(scope="module")
+def subject_two_write_object_B(subject_two_uuid, write, object_B_uuid):
+    return Triple(subject_two_uuid, write, object_B_uuid)
+
+
+@pytest.fixture(scope="module")
+def subject_two_delete_object_C(subject_two_uuid, delete, object_C_uuid):
+    return Triple(subject_two_uuid, delete, object_C_uuid)
+
+
+@pytest.fixture(scope="module")
+def subject_three_read_object_A(subject_three_uuid, read, object_A_uuid):
+    return Triple(subject_three_uuid, read, object_A_uuid)
+
+
+@pytest.fixture
+def backend(
+    subject_one_read_object_A,
+    subject_one_write_object_A,
+    subject_one_read_object_B,
+    subject_two_write_object_B,
+    subject_two_delete_object_C,
+    subject_three_read_object_A,
+):
+    return columnar_backend.ColumnarBackend(
+        initial_data=(
+            subject_one_read_object_A,
+            subject_one_write_object_A,
+            subject_one_read_object_B,
+            subject_two_write_object_B,
+            subject_two_delete_object_C,
+            subject_three_read_object_A,
+        )
+    )
+
+
+@pytest.mark.asyncio
+async def test_create_one_triple_should_be_persisted(subject_one_read_object_A):
+    backend = columnar_backend.ColumnarBackend()
+
+    await backend.create([subject_one_read_object_A])
+
+    assert set(backend) == {subject_one_read_object_A}
+
+
+@pytest.mark.asyncio
+async def test_create_one_triple_should_be_returned(subject_one_read_object_B):
+    backend = columnar_backend.ColumnarBackend()
+
+    resulting_triples = await backend.create([subject_one_read_object_B])
+
+    assert resulting_triples == [subject_one_read_object_B]
+
+
+@pytest.mark.asyncio
+async def test_create_same_triple_twice(subject_one_read_object_A):
+    backend = columnar_backend.ColumnarBackend()
+
+    await backend.create([subject_one_read_object_A, subject_one_read_object_A])
+    await backend.create([subject_one_read_object_A])
+
+    assert set(backend) == {subject_one_read_object_A}
+
+
+@pytest.mark.asyncio
+async def test_create_beyond_initial_capacity(subject_one_uuid, object_A_uuid):
+    backend = columnar_backend.ColumnarBackend(initial_capacity=2)
+    triples = [Triple(subject_one_uuid, f"predicate-{i}", object_A_uuid) for i in range(5)]
+
+    await backend.create(triples)
+
+    assert set(backend) == set(triples)
+
+
+@pytest.mark.asyncio
+async def test_read_specifying_nothing(backend):
+    results = await backend.read()
+
+    assert results == set(backend)
+    assert len(results) == 6
+
+
+@pytest.mark.asyncio
+async def test_read_specifying_one_subject_uuid(
+    backend,
+    subject_one_read_object_A,
+    subject_one_write_object_A,
+    subject_one_read_object_B,
+    subject_one_uuid,
+):
+    results = await backend.read(subject_uuids=[subject_one_uuid])
+
+    assert results == {subject_one_read_object_A, subject_one_write_object_A,
+                       subject_one_read_object_B}
+
+
+@pytest.mark.asyncio
+async def test_read_specifying_multiple_predicates(
+    backend,
+    subject_one_write_object_A,
+    subject_two_write_object_B,
+    subject_two_delete_object_C,
+    write,
+    delete,
+):
+    results = await backend.read(predicates=[write, delete])
+
+    assert results == {subject_one_write_object_A, subject_two_write_object_B,
+                       subject_two_delete_object_C}
+
+
+@pytest.mark.asyncio
+async def test_read_specifying_object_uuids_subject_uuids_and_predicates(
+    backend,
+    subject_one_read_object_A,
+    subject_three_read_object_A,
+    subject_one_uuid,
+    subject_three_uuid,
+    object_A_uuid,
+    object_C_uuid,
+    read,
+):
+    results = await backend.read(subject_uuids=[subject_one_uuid, subject_three_uuid],
+                                 predicates=[read],
+                                 object_uuids=[object_A_uuid, object_C_uuid])
+
+    assert results == {subject_one_read_object_A, subject_three_read_object_A}
+
+
+@pytest.mark.asyncio
+async def test_read_specifying_unknown_predicate(backend, subject_one_uuid):
+    results = await backend.read(subject_uuids=[subject_one_uuid], predicates=["share"])
+
+    assert results == set()
+
+
+@pytest.mark.asyncio
+async def test_delete_object(
+    backend,
+    subject_one_read_object_B,
+    subject_two_write_object_B,
+    object_B_uuid,
+):
+    deleted = await backend.delete(object_uuids=[object_B_uuid])
+
+    assert deleted == {subject_one_read_object_B, subject_two_write_object_B}
+    assert len(set(backend)) == 4
+    assert await backend.read(object_uuids=[object_B_uuid]) == set()
+
+
+@pytest.mark.asyncio
+async def test_delete_specifying_nothing(backend):
+    expected_deleted = set(backend)
+
+    deleted = await backend.delete()
+
+    assert deleted == expected_deleted
+    assert set(backend) == set()
+
+
+@pytest.mark.asyncio
+async def test_exists(backend, subject_one_uuid, subject_two_uuid, object_A_uuid, read):
+    assert await backend.exists(subject_one_uuid, read, object_A_uuid)
+    assert not await backend.exists(subject_two_uuid, read, object_A_uuid)
+    assert not await backend.exists(subject_one_uuid, "share", object_A_uuid)
+
+
+@pytest.mark.asyncio
+async def test_check(
+    backend,
+    subject_one_read_object_A,
+    subject_two_write_object_B,
+    subject_one_uuid,
+    object_C_uuid,
+    read,
+):
+    results = await backend.check([subject_two_write_object_B,
+                                   Triple(subject_one_uuid, read, object_C_uuid),
+                                   Triple(subject_one_uuid, "share", object_C_uuid),
+                                   subject_one_read_object_A])
+
+    assert results == [True, False, False, True]
+
+
+@pytest.mark.asyncio
+async def test_stream_specifying_nothing(backend):
+    results = [triple async for triple in backend.stream()]
+
+    assert len(results) == 6
+    assert set(results) == set(backend)
+
+
+@pytest.mark.asyncio
+async def test_read_page_walks_every_triple_once(backend):
+    results, cursor = await backend.read_page(limit=4)
+    while cursor is not None:
+        page, cursor = await backend.read_page(limit=4, cursor=cursor)
+        results.extend(page)
+
+    assert len(results) == 6
+    assert set(results) == set(backend)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("key", [(2 ** 40, 0, 0), (0, -1, 0), (0, 0, "x")])
+async def test_read_page_rejects_cursors_it_did_not_issue(backend, key):
+    with pytest.raises(cursors.InvalidCursor):
+        await backend.read_page(limit=4, cursor=cursors.encode_cursor(*key))
+
+
+@pytest.mark.asyncio
+async def test_read_page_keeps_order_through_writes(monkeypatch, read, write):
+    monkeypatch.setattr(columnar_backend, "PAGE_SCAN_CHUNK_SIZE", 4)
+    subjects = [uuid.uuid4() for _ in range(20)]
+    triples = [Triple(subject, predicate, uuid.uuid4())
+               for subject in subjects for predicate in (read, write) for _ in range(5)]
+    backend = columnar_backend.ColumnarBackend(initial_data=triples[:100])
+    await backend.read_page(limit=1)
+
+    await backend.create(triples[100:])
+    await backend.delete(subject_uuids=subjects[:1])
+
+    for filters in ({}, {"predicates": [read]}, {"subject_uuids": subjects[1:3]}):
+        results, cursor = await backend.read_page(limit=3, **filters)
+        while cursor is not None:
+            page, cursor = await backend.read_page(limit=3, cursor=cursor, **filters)
+            results.extend(page)
+
+        assert len(results) == len(set(results))
+        assert set(results) == await backend.read(**filters)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("tail_limit", [3, columnar_backend.UNSORTED_TAIL_LIMIT])
+async def test_check_after_writes(monkeypatch, tail_limit, read, write):
+    monkeypatch.setattr(columnar_backend, "UNSORTED_TAIL_LIMIT", tail_limit)
+    triples = [Triple(uuid.uuid4(), predicate, uuid.uuid4())
+               for _ in range(50) for predicate in (read, write)]
+    backend = columnar_backend.ColumnarBackend(initial_data=triples[:10])
+    assert await backend.check(triples[:1]) == [True]
+
+    for start in range(10, len(triples), 7):
+        await backend.create(triples[start:start + 7] + triples[start - 2:start])
+    assert await backend.count() == len(triples)
+    await backend.delete(predicates=[write], subject_uuids=[triples[1].subject_uuid])
+
+    assert await backend.check(triples) == [index != 1 for index in range(len(triples))]
+    assert await backend.exists(*triples[-1])
+    assert not await backend.exists(*triples[1])
+
+
+@pytest.mark.asyncio
+async def test_count_and_delete_without_returning(backend, subject_one_uuid, read):
+    assert await backend.count(subject_uuids=[subject_one_uuid]) == 3
+    assert await backend.count(predicates=[read]) == 3
+    assert await backend.delete(subject_uuids=[subject_one_uuid], returning=False) == 3
+    assert await backend.count() == 3
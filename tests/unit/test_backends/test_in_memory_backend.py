@@ -1,7 +1,9 @@
+import uuid
 from collections import namedtuple
 
 import pytest
 
+from per_object_permissions import cursors
 from per_object_permissions.backends import in_memory_backend
 
 Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
@@ -443,3 +445,220 @@ async def test_delete_based_on_subject_predicate_and_object(
         subject_three_read_object_A,
         subject_three_write_object_A,
     }
+
+
+@pytest.mark.asyncio
+async def test_read_after_delete_does_not_return_deleted_triples(
+    subject_one_read_object_A,
+    subject_one_read_object_B,
+    subject_two_write_object_B,
+    subject_one_uuid,
+    object_B_uuid,
+):
+    backend = in_memory_backend.InMemoryBackend(
+        initial_data=(
+            subject_one_read_object_A,
+            subject_one_read_object_B,
+            subject_two_write_object_B,
+        )
+    )
+
+    await backend.delete(subject_uuids=[subject_one_uuid], object_uuids=[object_B_uuid])
+
+    assert await backend.read(subject_uuids=[subject_one_uuid]) == {subject_one_read_object_A}
+    assert await backend.read(object_uuids=[object_B_uuid]) == {subject_two_write_object_B}
+
+
+@pytest.mark.asyncio
+async def test_read_specifying_subject_uuid_and_unknown_object_uuid(
+    subject_one_read_object_A,
+    subject_one_read_object_B,
+    subject_one_uuid,
+    object_C_uuid,
+):
+    backend = in_memory_backend.InMemoryBackend(
+        initial_data=(
+            subject_one_read_object_A,
+            subject_one_read_object_B,
+        )
+    )
+
+    results = await backend.read(subject_uuids=[subject_one_uuid],
+                                 object_uuids=[object_C_uuid])
+
+    assert results == set()
+
+
+@pytest.mark.asyncio
+async def test_delete_specifying_nothing(
+    subject_one_read_object_A,
+    subject_two_write_object_B,
+    subject_one_uuid,
+):
+    backend = in_memory_backend.InMemoryBackend(
+        initial_data=(
+            subject_one_read_object_A,
+            subject_two_write_object_B,
+        )
+    )
+
+    deleted = await backend.delete()
+
+    assert deleted == {subject_one_read_object_A, subject_two_write_object_B}
+    assert set(backend) == set()
+    assert await backend.read(subject_uuids=[subject_one_uuid]) == set()
+
+
+@pytest.mark.asyncio
+async def test_exists(
+    subject_one_read_object_A,
+    subject_one_uuid,
+    object_A_uuid,
+    read,
+    write,
+):
+    backend = in_memory_backend.InMemoryBackend(initial_data=(subject_one_read_object_A,))
+
+    assert await backend.exists(subject_one_uuid, read, object_A_uuid)
+    assert not await backend.exists(subject_one_uuid, write, object_A_uuid)
+
+
+@pytest.mark.asyncio
+async def test_check(
+    subject_one_read_object_A,
+    subject_one_write_object_A,
+    subject_two_read_object_A,
+):
+    backend = in_memory_backend.InMemoryBackend(
+        initial_data=(subject_one_read_object_A, subject_two_read_object_A)
+    )
+
+    results = await backend.check([subject_two_read_object_A,
+                                   subject_one_write_object_A,
+                                   subject_one_read_object_A])
+
+    assert results == [True, False, True]
+
+
+@pytest.mark.asyncio
+async def test_stream_specifying_one_predicate(
+    subject_one_read_object_A,
+    subject_one_write_object_A,
+    subject_two_read_object_A,
+    read,
+):
+    backend = in_memory_backend.InMemoryBackend(
+        initial_data=(
+            subject_one_read_object_A,
+            subject_one_write_object_A,
+            subject_two_read_object_A,
+        )
+    )
+
+    results = [triple async for triple in backend.stream(predicates=[read])]
+
+    assert sorted(results) == sorted([subject_one_read_object_A, subject_two_read_object_A])
+
+
+@pytest.mark.asyncio
+async def test_read_page_walks_matches_in_order(
+    subject_one_read_object_A,
+    subject_one_write_object_A,
+    subject_two_read_object_A,
+    subject_two_write_object_B,
+    subject_three_read_object_A,
+    read,
+):
+    backend = in_memory_backend.InMemoryBackend(
+        initial_data=(
+            subject_one_read_object_A,
+            subject_one_write_object_A,
+            subject_two_read_object_A,
+            subject_two_write_object_B,
+            subject_three_read_object_A,
+        )
+    )
+
+    first_page, cursor = await backend.read_page(predicates=[read], limit=2)
+    second_page, last_cursor = await backend.read_page(predicates=[read], limit=2,
+                                                       cursor=cursor)
+
+    assert first_page + second_page == sorted([subject_one_read_object_A,
+                                               subject_two_read_object_A,
+                                               subject_three_read_object_A])
+    assert last_cursor is None
+
+
+@pytest.mark.asyncio
+async def test_read_page_resumes_after_writes(
+    subject_one_read_object_A,
+    subject_one_write_object_A,
+    subject_two_read_object_A,
+    subject_three_read_object_A,
+):
+    initial_data = sorted([subject_one_read_object_A,
+                           subject_two_read_object_A,
+                           subject_three_read_object_A])
+    backend = in_memory_backend.InMemoryBackend(initial_data=initial_data)
+
+    first_page, cursor = await backend.read_page(limit=1)
+    await backend.delete(subject_uuids=[initial_data[1].subject_uuid])
+    second_page, _ = await backend.read_page(limit=1, cursor=cursor)
+
+    assert first_page == initial_data[:1]
+    assert second_page == initial_data[2:]
+
+
+async def read_all_pages(backend, limit, **filters):
+    triples, cursor = await backend.read_page(limit=limit, **filters)
+    while cursor is not None:
+        page, cursor = await backend.read_page(limit=limit, cursor=cursor, **filters)
+        triples.extend(page)
+    return triples
+
+
+@pytest.mark.asyncio
+async def test_read_page_keeps_order_through_writes(read, write):
+    subjects = [uuid.uuid4() for _ in range(20)]
+    triples = [Triple(subject, predicate, uuid.uuid4())
+               for subject in subjects for predicate in (read, write) for _ in range(5)]
+    backend = in_memory_backend.InMemoryBackend(initial_data=triples[:100])
+    await backend.read_page(limit=1)
+
+    await backend.create(triples[100:])
+    await backend.create(triples[:1])
+    await backend.delete(subject_uuids=subjects[:1])
+    await backend.delete(predicates=[write], object_uuids=[triples[15].object_uuid])
+
+    for filters in ({}, {"predicates": [read]}, {"subject_uuids": subjects[1:3]}):
+        expected = sorted(await backend.read(**filters))
+        assert await read_all_pages(backend, 7, **filters) == expected
+
+
+@pytest.mark.asyncio
+async def test_read_page_rejects_invalid_cursor():
+    backend = in_memory_backend.InMemoryBackend()
+
+    with pytest.raises(cursors.InvalidCursor):
+        await backend.read_page(limit=1, cursor="not a cursor")
+
+
+@pytest.mark.asyncio
+async def test_count_and_delete_without_returning(
+    subject_one_read_object_A,
+    subject_one_write_object_A,
+    subject_two_read_object_A,
+    read,
+):
+    backend = in_memory_backend.InMemoryBackend()
+
+    created_count = await backend.create([subject_one_read_object_A,
+                                          subject_one_write_object_A,
+                                          subject_two_read_object_A], returning=False)
+    read_count = await backend.count(predicates=[read])
+    deleted_count = await backend.delete(predicates=[read], returning=False)
+
+    assert created_count == 3
+    assert read_count == 2
+    assert deleted_count == 2
+    assert set(backend) == {subject_one_write_object_A}
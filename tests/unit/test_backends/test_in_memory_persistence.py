@@ -0,0 +1,152 @@
+import asyncio
+import os
+from collections import namedtuple
+
+import pytest
+
+from per_object_permissions.api import config
+from per_object_permissions.backends import in_memory_backend, in_memory_persistence
+from per_object_permissions.protocols import UnsupportedTriple
+
+Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
+
+
+@pytest.fixture
+def settings(tmp_path):
+    return config.Settings(in_memory_data_dir=str(tmp_path))
+
+
+@pytest.fixture(scope="module")
+def subject_one_read_object_A(subject_one_uuid, read, object_A_uuid):
+    return Triple(subject_one_uuid, read, object_A_uuid)
+
+
+@pytest.fixture(scope="module")
+def subject_one_write_object_B(subject_one_uuid, write, object_B_uuid):
+    return Triple(subject_one_uuid, write, object_B_uuid)
+
+
+@pytest.fixture(scope="module")
+def subject_two_delete_object_C(subject_two_uuid, delete, object_C_uuid):
+    return Triple(subject_two_uuid, delete, object_C_uuid)
+
+
+@pytest.mark.asyncio
+async def test_logged_writes_are_restored(
+    settings,
+    subject_one_read_object_A,
+    subject_one_write_object_B,
+    subject_two_delete_object_C,
+    object_B_uuid,
+):
+    backend = in_memory_backend.InMemoryBackend(settings=settings)
+    await backend.create([subject_one_read_object_A, subject_one_write_object_B,
+                          subject_two_delete_object_C])
+    await backend.delete(object_uuids=[object_B_uuid])
+
+    restored = in_memory_backend.InMemoryBackend(settings=settings)
+
+    assert set(restored) == {subject_one_read_object_A, subject_two_delete_object_C}
+
+
+@pytest.mark.asyncio
+async def test_snapshot_and_later_writes_are_restored(
+    settings,
+    subject_one_read_object_A,
+    subject_one_write_object_B,
+    subject_two_delete_object_C,
+    subject_one_uuid,
+):
+    backend = in_memory_backend.InMemoryBackend(settings=settings)
+    await backend.create([subject_one_read_object_A, subject_one_write_object_B])
+    await backend.snapshot()
+    await backend.delete(subject_uuids=[subject_one_uuid])
+    await backend.create([subject_two_delete_object_C])
+
+    restored = in_memory_backend.InMemoryBackend(settings=settings)
+
+    assert set(restored) == {subject_two_delete_object_C}
+    assert await restored.read(subject_uuids=[subject_one_uuid]) == set()
+
+
+@pytest.mark.asyncio
+async def test_writes_while_a_snapshot_waits_are_kept(
+    settings,
+    subject_one_read_object_A,
+    subject_one_write_object_B,
+):
+    backend = in_memory_backend.InMemoryBackend(settings=settings)
+    await backend.create([subject_one_read_object_A])
+    first = asyncio.ensure_future(backend.snapshot())
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(backend.snapshot())
+    await asyncio.sleep(0)
+
+    await backend.create([subject_one_write_object_B])
+    await asyncio.gather(first, second)
+
+    restored = in_memory_backend.InMemoryBackend(settings=settings)
+    assert set(restored) == {subject_one_read_object_A, subject_one_write_object_B}
+
+
+@pytest.mark.asyncio
+async def test_snapshot_discards_covered_logs(settings, subject_one_read_object_A):
+    backend = in_memory_backend.InMemoryBackend(settings=settings)
+    await backend.create([subject_one_read_object_A])
+
+    await backend.snapshot()
+
+    assert sorted(os.listdir(settings.in_memory_data_dir)) == ["log.0000000002",
+                                                              "snapshot.bin"]
+
+
+@pytest.mark.asyncio
+async def test_delete_everything_is_restored(
+    settings,
+    subject_one_read_object_A,
+    subject_one_write_object_B,
+):
+    backend = in_memory_backend.InMemoryBackend(settings=settings)
+    await backend.create([subject_one_read_object_A])
+    await backend.delete()
+    await backend.create([subject_one_write_object_B])
+
+    restored = in_memory_backend.InMemoryBackend(settings=settings)
+
+    assert set(restored) == {subject_one_write_object_B}
+
+
+@pytest.mark.asyncio
+async def test_triples_the_log_cannot_record_are_rejected(
+    settings,
+    subject_one_read_object_A,
+    subject_one_write_object_B,
+):
+    backend = in_memory_backend.InMemoryBackend(settings=settings)
+    too_long = subject_one_write_object_B._replace(
+        predicate="x" * (in_memory_persistence.MAX_PREDICATE_BYTES + 1)
+    )
+
+    with pytest.raises(UnsupportedTriple):
+        await backend.create([subject_one_read_object_A, too_long])
+    await backend.create([subject_one_write_object_B])
+    await backend.snapshot()
+
+    restored = in_memory_backend.InMemoryBackend(settings=settings)
+
+    assert set(backend) == {subject_one_write_object_B}
+    assert set(restored) == {subject_one_write_object_B}
+
+
+def test_torn_log_record_is_ignored(tmp_path, subject_one_read_object_A,
+                                    subject_one_write_object_B):
+    persistence = in_memory_persistence.Persistence(str(tmp_path))
+    list(persistence.replay_logs())
+    persistence.log_create([subject_one_read_object_A, subject_one_write_object_B])
+    persistence.close()
+    log_path = tmp_path / "log.0000000001"
+    log_path.write_bytes(log_path.read_bytes()[:-3])
+
+    operations = list(in_memory_persistence.read_log(str(log_path)))
+
+    assert operations == [(in_memory_persistence.CREATE, subject_one_read_object_A)]
@@ -0,0 +1,25 @@
+import uuid
+
+import pytest
+
+bson = pytest.importorskip("bson")
+pytest.importorskip("motor")
+
+from per_object_permissions.backends import mongodb_backend  # noqa: E402
+from per_object_permissions.uuid_arrays import UUIDArray  # noqa: E402
+
+
+def test_query_with_uuid_arrays_encodes_as_bson(subject_one_uuid, read, object_A_uuid):
+    query = dict(mongodb_backend.query_key_values(
+        subject_uuids=UUIDArray.parse([str(subject_one_uuid)]),
+        predicates=(read,),
+        object_uuids=UUIDArray.parse([object_A_uuid]),
+    ))
+
+    options = bson.CodecOptions(uuid_representation=bson.binary.UuidRepresentation.STANDARD)
+    decoded = bson.decode(bson.encode(query, codec_options=options), codec_options=options)
+
+    assert decoded == {"subject_uuid": {"$in": [subject_one_uuid]},
+                       "predicate": {"$in": [read]},
+                       "object_uuid": {"$in": [object_A_uuid]}}
+    assert isinstance(decoded["subject_uuid"]["$in"][0], uuid.UUID)
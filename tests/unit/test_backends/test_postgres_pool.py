@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+from per_object_permissions.backends.postgres.pool import ConnectionPool
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.closed = False
+        self.broken = False
+        self.events = []
+
+    async def commit(self):
+        self.events.append("commit")
+
+    async def rollback(self):
+        self.events.append("rollback")
+
+    async def close(self):
+        self.closed = True
+
+
+class Connector:
+
+    def __init__(self):
+        self.connections = []
+
+    async def __call__(self):
+        self.connections.append(FakeConnection())
+        return self.connections[-1]
+
+
+@pytest.mark.asyncio
+async def test_connections_are_reused_and_committed():
+    connect = Connector()
+    pool = ConnectionPool(connect, min_size=1, max_size=2)
+    await pool.open()
+
+    for _ in range(3):
+        async with pool.connection() as connection:
+            assert connection is connect.connections[0]
+
+    assert len(connect.connections) == 1
+    assert connection.events == ["commit"] * 3
+
+
+@pytest.mark.asyncio
+async def test_failed_borrowers_roll_back():
+    pool = ConnectionPool(Connector(), min_size=0)
+
+    with pytest.raises(ValueError):
+        async with pool.connection() as connection:
+            raise ValueError
+
+    assert connection.events == ["rollback"]
+    async with pool.connection() as reused:
+        assert reused is connection
+
+
+@pytest.mark.asyncio
+async def test_broken_connections_are_replaced():
+    connect = Connector()
+    pool = ConnectionPool(connect, min_size=0)
+
+    async with pool.connection() as connection:
+        connection.broken = True
+    async with pool.connection() as replacement:
+        pass
+
+    assert connection.closed
+    assert replacement is not connection
+
+
+@pytest.mark.asyncio
+async def test_borrowers_wait_for_a_connection_at_max_size():
+    connect = Connector()
+    pool = ConnectionPool(connect, min_size=0, max_size=1)
+    borrowed = []
+
+    async def borrow():
+        async with pool.connection() as connection:
+            borrowed.append(connection)
+            await asyncio.sleep(0)
+
+    await asyncio.gather(borrow(), borrow(), borrow())
+
+    assert len(connect.connections) == 1
+    assert len(borrowed) == 3
+
+
+@pytest.mark.asyncio
+async def test_close_closes_idle_and_returned_connections():
+    connect = Connector()
+    pool = ConnectionPool(connect, min_size=1, max_size=2)
+    await pool.open()
+
+    async with pool.connection() as first:
+        async with pool.connection() as second:
+            await pool.close()
+            assert first.closed is False
+        assert second.closed
+
+    assert first.closed
+    with pytest.raises(RuntimeError):
+        async with pool.connection():
+            pass
+
+
+@pytest.mark.asyncio
+async def test_dropped_connections_are_disconnected_once():
+    connect, disconnected = Connector(), []
+
+    async def disconnect(connection):
+        disconnected.append(connection)
+        await connection.close()
+
+    async def fail_rollback():
+        raise OSError
+
+    pool = ConnectionPool(connect, min_size=0, max_size=3, disconnect=disconnect)
+    async with pool.connection() as closed_by_borrower:
+        await closed_by_borrower.close()
+    with pytest.raises(ValueError):
+        async with pool.connection() as unrecoverable:
+            unrecoverable.rollback = fail_rollback
+            raise ValueError
+    async with pool.connection() as idle:
+        pass
+    await pool.close()
+
+    assert disconnected == [closed_by_borrower, unrecoverable, idle]
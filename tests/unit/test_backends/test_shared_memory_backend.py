@@ -0,0 +1,277 @@
+import asyncio
+import fcntl
+import multiprocessing
+import os
+import uuid
+from collections import namedtuple
+
+import pytest
+
+from per_object_permissions.backends import shared_memory_backend
+from per_object_permissions.protocols import UnsupportedTriple
+
+Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "perms")
+
+
+@pytest.fixture(scope="module")
+def subject_one_read_object_A(subject_one_uuid, read, object_A_uuid):
+    return Triple(subject_one_uuid, read, object_A_uuid)
+
+
+@pytest.fixture(scope="module")
+def subject_one_write_object_B(subject_one_uuid, write, object_B_uuid):
+    return Triple(subject_one_uuid, write, object_B_uuid)
+
+
+@pytest.fixture(scope="module")
+def subject_two_write_object_B(subject_two_uuid, write, object_B_uuid):
+    return Triple(subject_two_uuid, write, object_B_uuid)
+
+
+@pytest.fixture(scope="module")
+def subject_three_delete_object_C(subject_three_uuid, delete, object_C_uuid):
+    return Triple(subject_three_uuid, delete, object_C_uuid)
+
+
+@pytest.fixture
+def triples(
+    subject_one_read_object_A,
+    subject_one_write_object_B,
+    subject_two_write_object_B,
+    subject_three_delete_object_C,
+):
+    return [
+        subject_one_read_object_A,
+        subject_one_write_object_B,
+        subject_two_write_object_B,
+        subject_three_delete_object_C,
+    ]
+
+
+def _create_in_other_process(path, triples):
+    backend = shared_memory_backend.SharedMemoryBackend(path=path)
+    asyncio.run(backend.create([shared_memory_backend.Triple(*triple) for triple in triples]))
+
+
+@pytest.mark.asyncio
+async def test_create_same_triple_twice(path, subject_one_read_object_A):
+    backend = shared_memory_backend.SharedMemoryBackend(path=path, initial_capacity=4)
+
+    await backend.create([subject_one_read_object_A, subject_one_read_object_A])
+    await backend.create([subject_one_read_object_A])
+
+    assert set(backend) == {subject_one_read_object_A}
+
+
+@pytest.mark.asyncio
+async def test_read_with_filters(
+    path,
+    triples,
+    subject_one_write_object_B,
+    subject_two_write_object_B,
+    write,
+    object_B_uuid,
+    subject_one_uuid,
+):
+    backend = shared_memory_backend.SharedMemoryBackend(path=path, initial_capacity=2)
+    await backend.create(triples)
+
+    assert set(backend) == set(triples)
+    assert await backend.read(predicates=[write], object_uuids=[object_B_uuid]) == {
+        subject_one_write_object_B, subject_two_write_object_B
+    }
+    assert await backend.read(subject_uuids=[subject_one_uuid], predicates=["share"]) == set()
+
+
+@pytest.mark.asyncio
+async def test_writes_are_visible_to_other_mappings(
+    path,
+    triples,
+    subject_one_read_object_A,
+    subject_three_delete_object_C,
+    object_B_uuid,
+):
+    writer = shared_memory_backend.SharedMemoryBackend(path=path, initial_capacity=2)
+    reader = shared_memory_backend.SharedMemoryBackend(path=path)
+
+    await writer.create(triples)
+    deleted = await reader.delete(object_uuids=[object_B_uuid])
+
+    assert len(deleted) == 2
+    assert set(writer) == {subject_one_read_object_A, subject_three_delete_object_C}
+
+
+@pytest.mark.asyncio
+async def test_writes_are_visible_to_other_processes(path, triples):
+    backend = shared_memory_backend.SharedMemoryBackend(path=path, initial_capacity=2)
+
+    process = multiprocessing.get_context("spawn").Process(
+        target=_create_in_other_process, args=(path, [tuple(triple) for triple in triples])
+    )
+    process.start()
+    process.join()
+
+    assert process.exitcode == 0
+    assert set(backend) == set(triples)
+
+
+@pytest.mark.asyncio
+async def test_exists(path, triples, subject_one_uuid, subject_two_uuid, object_A_uuid, read):
+    backend = shared_memory_backend.SharedMemoryBackend(path=path)
+    await backend.create(triples)
+
+    assert await backend.exists(subject_one_uuid, read, object_A_uuid)
+    assert not await backend.exists(subject_two_uuid, read, object_A_uuid)
+    assert not await backend.exists(subject_one_uuid, "share", object_A_uuid)
+
+
+@pytest.mark.asyncio
+async def test_check(
+    path,
+    triples,
+    subject_two_write_object_B,
+    subject_one_uuid,
+    object_C_uuid,
+    read,
+):
+    backend = shared_memory_backend.SharedMemoryBackend(path=path)
+    await backend.create(triples)
+
+    results = await backend.check([Triple(subject_one_uuid, read, object_C_uuid),
+                                   subject_two_write_object_B,
+                                   Triple(subject_one_uuid, "share", object_C_uuid)])
+
+    assert results == [False, True, False]
+
+
+@pytest.mark.asyncio
+async def test_stream(path, triples, subject_one_uuid):
+    backend = shared_memory_backend.SharedMemoryBackend(path=path)
+    await backend.create(triples)
+
+    results = [triple async for triple in backend.stream(subject_uuids=[subject_one_uuid])]
+
+    assert sorted(results) == sorted(triples[:2])
+
+
+@pytest.mark.asyncio
+async def test_read_page_walks_every_triple_once(path, triples):
+    backend = shared_memory_backend.SharedMemoryBackend(path=path)
+    await backend.create(triples)
+
+    first_page, cursor = await backend.read_page(limit=3)
+    second_page, last_cursor = await backend.read_page(limit=3, cursor=cursor)
+
+    assert len(first_page) == 3
+    assert set(first_page + second_page) == set(triples)
+    assert last_cursor is None
+
+
+@pytest.mark.asyncio
+async def test_read_page_sees_writes_from_other_mappings(monkeypatch, path, triples, read):
+    monkeypatch.setattr(shared_memory_backend, "PAGE_SCAN_CHUNK_SIZE", 1)
+    backend = shared_memory_backend.SharedMemoryBackend(path=path)
+    other = shared_memory_backend.SharedMemoryBackend(path=path)
+    await backend.create(triples)
+    last = Triple(uuid.UUID(int=(1 << 128) - 1), read, uuid.UUID(int=0))
+
+    results, cursor = await backend.read_page(limit=1)
+    await other.create([last])
+    while cursor is not None:
+        page, cursor = await backend.read_page(limit=1, cursor=cursor)
+        results.extend(page)
+
+    assert len(results) == len(triples) + 1
+    assert set(results) == {*triples, last}
+    assert results[-1] == last
+
+
+@pytest.mark.asyncio
+async def test_count_and_delete_without_returning(path, triples, write, object_B_uuid):
+    backend = shared_memory_backend.SharedMemoryBackend(path=path)
+
+    assert await backend.create(triples, returning=False) == len(triples)
+    assert await backend.count(predicates=[write]) == 2
+    assert await backend.delete(object_uuids=[object_B_uuid], returning=False) == 2
+    assert await backend.count() == len(triples) - 2
+
+
+@pytest.mark.asyncio
+async def test_recovers_from_a_writer_that_died_mid_write(path, triples,
+                                                         subject_one_read_object_A):
+    backend = shared_memory_backend.SharedMemoryBackend(path=path)
+    await backend.create(triples[1:])
+    backend._set_generation(backend._header()[0] + 1)
+
+    await backend.create([subject_one_read_object_A])
+
+    assert backend._header()[0] % 2 == 0
+    backend._set_generation(backend._header()[0] + 1)
+    assert set(backend) == set(triples)
+    assert backend._header()[0] % 2 == 0
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("tail_limit", [3, shared_memory_backend.TAIL_LIMIT])
+async def test_checks_triples_created_in_any_order(monkeypatch, path, read, write, tail_limit):
+    monkeypatch.setattr(shared_memory_backend, "TAIL_LIMIT", tail_limit)
+    backend = shared_memory_backend.SharedMemoryBackend(path=path)
+    triples = [Triple(uuid.uuid4(), predicate, uuid.uuid4())
+               for _ in range(50) for predicate in (read, write)]
+    for start in range(0, len(triples), 7):
+        await backend.create(triples[start:start + 7] + triples[:3])
+    missing = Triple(triples[0].subject_uuid, read, triples[1].object_uuid)
+
+    assert await backend.check([*triples, missing]) == [True] * len(triples) + [False]
+    assert await backend.exists(*triples[-1])
+    assert not await backend.exists(*missing)
+    assert await backend.count() == len(triples)
+
+    await backend.delete(predicates=[write])
+    await backend.create(triples[:5])
+    kept = [triple for triple in triples if triple.predicate == read] + triples[1:5:2]
+    page, cursor = await backend.read_page(limit=len(triples))
+    assert cursor is None
+    assert page == sorted(
+        kept, key=lambda triple: (triple.subject_uuid.bytes, triple.object_uuid.bytes)
+    )
+    assert await backend.check(triples) == [triple in kept for triple in triples]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("predicate_count,predicate_length", [
+    (1, shared_memory_backend.PREDICATE_SLOT_SIZE + 1),
+    (shared_memory_backend.MAX_PREDICATES + 1, 8),
+])
+async def test_rejects_predicates_it_cannot_store(path, predicate_count, predicate_length):
+    backend = shared_memory_backend.SharedMemoryBackend(path=path)
+    triples = [Triple(uuid.uuid4(), f"{index:0{predicate_length}}", uuid.uuid4())
+               for index in range(predicate_count)]
+
+    with pytest.raises(UnsupportedTriple):
+        await backend.create(triples)
+
+    assert await backend.count() == 0
+
+
+@pytest.mark.asyncio
+async def test_waits_for_the_write_lock_without_blocking(monkeypatch, path, triples):
+    monkeypatch.setattr(shared_memory_backend, "OPTIMISTIC_READ_ATTEMPTS", 0)
+    backend = shared_memory_backend.SharedMemoryBackend(path=path)
+    await backend.create(triples)
+    other_fd = os.open(path, os.O_RDWR)
+    fcntl.flock(other_fd, fcntl.LOCK_EX)
+    try:
+        count = asyncio.ensure_future(backend.count())
+        await asyncio.sleep(0.05)
+        assert not count.done()
+    finally:
+        os.close(other_fd)
+
+    assert await count == len(triples)
+
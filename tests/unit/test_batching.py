@@ -0,0 +1,112 @@
+import asyncio
+from collections import namedtuple
+
+import pytest
+
+from per_object_permissions.api import batching
+from per_object_permissions.backends import in_memory_backend
+from per_object_permissions.uuid_arrays import UUIDArray
+
+Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
+
+
+class Loader:
+    """A batch function recording the batches it is given."""
+
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+
+    async def __call__(self, items):
+        self.batches.append(items)
+        if self.error:
+            raise self.error
+        return [item * 2 for item in items]
+
+
+@pytest.mark.asyncio
+async def test_items_loaded_together_are_batched():
+    loader = Loader()
+    batcher = batching.Batcher(loader)
+
+    results = await asyncio.gather(*(batcher.load(item) for item in range(3)))
+
+    assert results == [0, 2, 4]
+    assert loader.batches == [[0, 1, 2]]
+
+
+@pytest.mark.asyncio
+async def test_full_batches_are_loaded_straight_away():
+    loader = Loader()
+    batcher = batching.Batcher(loader, window=60, max_size=2)
+
+    results = await asyncio.gather(*(batcher.load(item) for item in range(4)))
+
+    assert results == [0, 2, 4, 6]
+    assert loader.batches == [[0, 1], [2, 3]]
+
+
+@pytest.mark.asyncio
+async def test_window_collects_items_arriving_later():
+    loader = Loader()
+    batcher = batching.Batcher(loader, window=0.01)
+
+    first = asyncio.ensure_future(batcher.load(1))
+    await asyncio.sleep(0)
+    second = asyncio.ensure_future(batcher.load(2))
+
+    assert await asyncio.gather(first, second) == [2, 4]
+    assert loader.batches == [[1, 2]]
+
+
+@pytest.mark.asyncio
+async def test_errors_are_raised_to_every_caller():
+    batcher = batching.Batcher(Loader(error=ValueError("failed")))
+
+    results = await asyncio.gather(batcher.load(1), batcher.load(2), return_exceptions=True)
+
+    assert [str(result) for result in results] == ["failed", "failed"]
+
+
+@pytest.mark.asyncio
+async def test_check_batch(subject_one_uuid, read, write, object_A_uuid):
+    perm = Triple(subject_one_uuid, read, object_A_uuid)
+    backend = in_memory_backend.InMemoryBackend(initial_data=[perm])
+
+    results = await batching.check_batch(
+        backend, [perm, Triple(subject_one_uuid, write, object_A_uuid)]
+    )
+
+    assert results == [True, False]
+
+
+@pytest.mark.asyncio
+async def test_read_subjects_batch_filters_each_query(
+    subject_one_uuid, subject_two_uuid, read, write, object_A_uuid, object_B_uuid
+):
+    triples = [
+        Triple(subject_one_uuid, read, object_A_uuid),
+        Triple(subject_one_uuid, write, object_B_uuid),
+        Triple(subject_two_uuid, read, object_A_uuid),
+        Triple(subject_two_uuid, read, object_B_uuid),
+    ]
+    backend = in_memory_backend.InMemoryBackend(initial_data=triples)
+
+    def query(subject_uuid, predicates=None, object_uuids=None):
+        return {
+            "subject_uuids": UUIDArray.parse([subject_uuid]),
+            "predicates": predicates,
+            "object_uuids": UUIDArray.parse(object_uuids) if object_uuids else None,
+        }
+
+    results = await batching.read_subjects_batch(backend, [
+        query(subject_one_uuid),
+        query(subject_one_uuid, predicates=[write]),
+        query(subject_two_uuid, object_uuids=[object_B_uuid]),
+    ])
+
+    assert [set(matches) for matches in results] == [
+        set(triples[:2]),
+        {triples[1]},
+        {triples[3]},
+    ]
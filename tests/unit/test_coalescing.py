@@ -0,0 +1,98 @@
+import asyncio
+import uuid
+
+import pytest
+
+from per_object_permissions.api import coalescing
+from per_object_permissions.uuid_arrays import UUIDArray
+
+
+class Call:
+    """A backend call that finishes when released, counting how often it is made."""
+
+    def __init__(self, result=None):
+        self.result = result
+        self.calls = 0
+        self.released = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        await self.released.wait()
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+
+def test_query_key_ignores_filter_order_and_form():
+    first, second = uuid.uuid4(), uuid.uuid4()
+
+    key = coalescing.query_key("read", subject_uuids=UUIDArray.parse([str(first), str(second)]),
+                               predicates=["read", "write"], object_uuids=None)
+
+    assert key == coalescing.query_key("read", object_uuids=[],
+                                       predicates=["write", "read", "read"],
+                                       subject_uuids=UUIDArray.parse([str(second), str(first)]))
+    assert key != coalescing.query_key("count", subject_uuids=UUIDArray.parse([str(first)]),
+                                       predicates=["read", "write"], object_uuids=None)
+
+
+@pytest.mark.asyncio
+async def test_concurrent_calls_with_the_same_key_are_shared():
+    flights, call = coalescing.SingleFlight(), Call(result=["triple"])
+
+    waiting = [asyncio.ensure_future(flights.do("key", call)) for _ in range(3)]
+    await asyncio.sleep(0)
+    assert flights.in_flight == 1
+    call.released.set()
+
+    assert await asyncio.gather(*waiting) == [["triple"]] * 3
+    assert call.calls == 1
+    assert flights.in_flight == 0
+
+
+@pytest.mark.asyncio
+async def test_calls_with_different_keys_are_not_shared():
+    flights, call = coalescing.SingleFlight(), Call()
+    call.released.set()
+
+    await asyncio.gather(flights.do("first", call), flights.do("second", call))
+
+    assert call.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_finished_calls_are_not_reused():
+    flights, call = coalescing.SingleFlight(), Call()
+    call.released.set()
+
+    await flights.do("key", call)
+    await flights.do("key", call)
+
+    assert call.calls == 2
+
+
+@pytest.mark.asyncio
+async def test_errors_are_raised_to_every_caller():
+    flights, call = coalescing.SingleFlight(), Call(result=ValueError("failed"))
+
+    waiting = [asyncio.ensure_future(flights.do("key", call)) for _ in range(2)]
+    await asyncio.sleep(0)
+    call.released.set()
+    results = await asyncio.gather(*waiting, return_exceptions=True)
+
+    assert [str(result) for result in results] == ["failed", "failed"]
+    assert call.calls == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelling_one_caller_does_not_cancel_the_others():
+    flights, call = coalescing.SingleFlight(), Call(result=1)
+
+    first = asyncio.ensure_future(flights.do("key", call))
+    second = asyncio.ensure_future(flights.do("key", call))
+    await asyncio.sleep(0)
+    first.cancel()
+    call.released.set()
+
+    assert await second == 1
+    assert first.cancelled()
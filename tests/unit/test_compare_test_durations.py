@@ -0,0 +1,128 @@
+import json
+
+import pytest
+
+import compare_test_durations
+
+CLASSNAME = "tests.integration.test_api"
+
+
+def write_run(output_dir, filename, durations):
+    """Writes a junit XML file of one run, with the duration of each named test."""
+    cases = "".join(f'<testcase classname="{CLASSNAME}" name="{name}" time="{time}"/>'
+                    for name, time in durations.items())
+    (output_dir / filename).write_text(
+        '<?xml version="1.0" encoding="utf-8"?>'
+        f'<testsuites><testsuite name="pytest">{cases}</testsuite></testsuites>'
+    )
+
+
+def write_runs(output_dir, backend_name, *runs):
+    for number, durations in enumerate(runs, start=1):
+        suffix = "" if number == 1 else f".{number}"
+        write_run(output_dir, f"{backend_name}{suffix}.xml", durations)
+
+
+@pytest.fixture
+def output_dir(tmp_path):
+    path = tmp_path / "test_output"
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def baseline_path(tmp_path):
+    return tmp_path / "baseline.json"
+
+
+def run(output_dir, baseline_path, *args):
+    return compare_test_durations.main(["--output-dir", str(output_dir),
+                                        "--baseline", str(baseline_path), *args])
+
+
+def save_baseline(output_dir, baseline_path, backend_name, *runs):
+    write_runs(output_dir, backend_name, *runs)
+    assert run(output_dir, baseline_path, "--save-baseline") == 0
+    for path in output_dir.iterdir():
+        path.unlink()
+
+
+def test_save_baseline_summarises_runs(output_dir, baseline_path):
+    write_runs(output_dir, "postgres",
+               {"test_create": 1.0, "test_read": 0.5},
+               {"test_create": 1.25, "test_read": 0.5},
+               {"test_create": 0.75, "test_read": 0.5})
+
+    assert run(output_dir, baseline_path, "--save-baseline") == 0
+
+    baseline = json.loads(baseline_path.read_text())
+    assert baseline == {"postgres": {
+        f"{CLASSNAME}::test_create": {"median": 1.0, "mad": 0.25, "runs": 3},
+        f"{CLASSNAME}::test_read": {"median": 0.5, "mad": 0.0, "runs": 3},
+    }}
+
+
+def test_save_baseline_replaces_only_the_backends_run(output_dir, baseline_path):
+    save_baseline(output_dir, baseline_path, "postgres", {"test_create": 1.0})
+    save_baseline(output_dir, baseline_path, "mongodb", {"test_create": 2.0})
+    save_baseline(output_dir, baseline_path, "postgres", {"test_read": 3.0})
+
+    baseline = json.loads(baseline_path.read_text())
+    assert baseline == {
+        "mongodb": {f"{CLASSNAME}::test_create": {"median": 2.0, "mad": 0.0, "runs": 1}},
+        "postgres": {f"{CLASSNAME}::test_read": {"median": 3.0, "mad": 0.0, "runs": 1}},
+    }
+
+
+def test_check_fails_on_a_slowdown(output_dir, baseline_path, capsys):
+    save_baseline(output_dir, baseline_path, "postgres",
+                  {"test_create": 1.0, "test_read": 0.5},
+                  {"test_create": 1.1, "test_read": 0.5},
+                  {"test_create": 0.9, "test_read": 0.5})
+    write_runs(output_dir, "postgres",
+               {"test_create": 2.0, "test_read": 0.5},
+               {"test_create": 2.1, "test_read": 0.5},
+               {"test_create": 1.9, "test_read": 0.5})
+
+    assert run(output_dir, baseline_path, "--check") == 1
+
+    slowdowns = capsys.readouterr().out.split("SLOWDOWNS")[1].split("SPEEDUPS")[0]
+    assert f"{CLASSNAME}::test_create" in slowdowns
+    assert "test_read" not in slowdowns
+
+
+def test_check_passes_changes_within_the_noise(output_dir, baseline_path, capsys):
+    save_baseline(output_dir, baseline_path, "postgres",
+                  {"test_create": 1.0}, {"test_create": 1.2}, {"test_create": 0.8})
+    # Beyond --min-change of the baseline, but within --mads scaled MADs
+    write_runs(output_dir, "postgres",
+               {"test_create": 1.3}, {"test_create": 1.5}, {"test_create": 1.1})
+
+    assert run(output_dir, baseline_path, "--check") == 0
+
+    assert f"{CLASSNAME}::test_create" not in capsys.readouterr().out
+
+
+def test_check_passes_speedups(output_dir, baseline_path, capsys):
+    save_baseline(output_dir, baseline_path, "postgres", {"test_create": 1.0})
+    write_runs(output_dir, "postgres", {"test_create": 0.5})
+
+    assert run(output_dir, baseline_path, "--check") == 0
+
+    speedups = capsys.readouterr().out.split("SPEEDUPS")[1]
+    assert f"{CLASSNAME}::test_create" in speedups
+
+
+def test_check_reports_tests_without_a_baseline(output_dir, baseline_path, capsys):
+    save_baseline(output_dir, baseline_path, "postgres",
+                  {"test_create": 1.0, "test_removed": 1.0})
+    write_runs(output_dir, "postgres", {"test_create": 1.0, "test_added": 9.0})
+    write_runs(output_dir, "redis", {"test_create": 1.0})
+
+    assert run(output_dir, baseline_path, "--check") == 0
+
+    out = capsys.readouterr().out
+    assert "2 tests have no baseline:" in out
+    assert f"postgres::{CLASSNAME}::test_added" in out
+    assert f"redis::{CLASSNAME}::test_create" in out
+    assert "test_removed" not in out
@@ -0,0 +1,124 @@
+from collections import namedtuple
+
+import pytest
+
+from per_object_permissions import metrics
+from per_object_permissions.backends import in_memory_backend, instrumented_backend
+
+Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
+
+
+@pytest.fixture
+def registry():
+    return metrics.Registry()
+
+
+def test_counter_renders_labelled_samples(registry):
+    counter = metrics.Counter("requests_total", "Requests.", ["path"], registry=registry)
+    counter.labels("/a").inc()
+    counter.labels("/a").inc(2)
+    counter.labels('say "hi"\n').inc()
+
+    assert registry.render() == (
+        "# HELP requests_total Requests.\n"
+        "# TYPE requests_total counter\n"
+        'requests_total{path="/a"} 3\n'
+        'requests_total{path="say \\"hi\\"\\n"} 1\n'
+    )
+
+
+def test_histogram_renders_cumulative_buckets(registry):
+    histogram = metrics.Histogram("seconds", "Latency.", buckets=[0.1, 1], registry=registry)
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.labels().observe(value)
+
+    assert registry.render().splitlines()[2:] == [
+        'seconds_bucket{le="0.1"} 2',
+        'seconds_bucket{le="1"} 3',
+        'seconds_bucket{le="+Inf"} 4',
+        "seconds_sum 2.65",
+        "seconds_count 4",
+    ]
+
+
+def test_collected_metric_reads_values_at_render(registry):
+    values = {("hits",): 1}
+    metrics.Collected("cache_total", "Cache.", "counter", lambda: values,
+                      labelnames=["event"], registry=registry)
+    values[("hits",)] = 5
+
+    assert registry.render().splitlines()[-1] == 'cache_total{event="hits"} 5'
+
+
+def _sample(name: str, labels: str) -> float:
+    prefix = f"{name}{{{labels}}} "
+    for line in metrics.REGISTRY.render().splitlines():
+        if line.startswith(prefix):
+            return float(line[len(prefix):])
+    return 0.0
+
+
+@pytest.mark.asyncio
+async def test_instrumented_backend_records_operations(subject_one_uuid, read, object_A_uuid):
+    backend = instrumented_backend.InstrumentedBackend(in_memory_backend.InMemoryBackend(),
+                                                       name="TestBackend")
+    perm = Triple(subject_one_uuid, read, object_A_uuid)
+    labels = 'backend="TestBackend",operation="{}"'
+
+    await backend.create([perm])
+    assert [triple async for triple in backend.stream()] == [perm]
+    assert await backend.delete(returning=False) == 1
+
+    for operation in ("create", "stream", "delete"):
+        assert _sample("perms_backend_operation_seconds_count",
+                       labels.format(operation)) == 1
+        assert _sample("perms_backend_rows_total", labels.format(operation)) == 1
+        assert _sample("perms_backend_operations_in_flight", labels.format(operation)) == 0
+
+
+class DescribedBackend(in_memory_backend.InMemoryBackend):
+
+    def describe_query(self, operation, subject_uuids=None, predicates=None,
+                       object_uuids=None, returning=True, cursor=None):
+        return f"{operation} query" + (" after cursor" if cursor is not None else "")
+
+
+@pytest.mark.asyncio
+async def test_slow_queries_are_logged_with_their_shape(caplog, subject_one_uuid, read,
+                                                        object_A_uuid):
+    backend = instrumented_backend.InstrumentedBackend(DescribedBackend(),
+                                                       slow_query_seconds=1e-9)
+    await backend.create([Triple(subject_one_uuid, read, object_A_uuid)])
+    caplog.clear()
+
+    await backend.delete(predicates=[read], returning=False)
+
+    assert caplog.records[0].getMessage().startswith("Slow delete on DescribedBackend took ")
+    assert caplog.records[0].getMessage().endswith(
+        ": subject_uuids=unset predicates=1 object_uuids=unset rows=1 query='delete query'"
+    )
+
+
+@pytest.mark.asyncio
+async def test_slow_pages_are_described_with_their_cursor(caplog, subject_one_uuid, read,
+                                                          object_A_uuid, object_B_uuid):
+    backend = instrumented_backend.InstrumentedBackend(DescribedBackend(),
+                                                       slow_query_seconds=1e-9)
+    await backend.create([Triple(subject_one_uuid, read, object_A_uuid),
+                          Triple(subject_one_uuid, read, object_B_uuid)])
+    _, cursor = await backend.read_page(limit=1)
+    caplog.clear()
+
+    await backend.read_page(limit=1, cursor=cursor)
+
+    assert caplog.records[0].getMessage().endswith("query='read_page query after cursor'")
+
+
+@pytest.mark.asyncio
+async def test_fast_queries_are_not_logged(caplog):
+    backend = instrumented_backend.InstrumentedBackend(DescribedBackend(),
+                                                       slow_query_seconds=60)
+
+    await backend.read()
+
+    assert not caplog.records
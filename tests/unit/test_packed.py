@@ -0,0 +1,59 @@
+import asyncio
+from collections import namedtuple
+
+import pytest
+
+from per_object_permissions.api import packed
+
+Triple = namedtuple("PermTriple", ["subject_uuid", "predicate", "object_uuid"])
+
+
+@pytest.fixture(scope="module")
+def triples(subject_one_uuid, subject_two_uuid, object_A_uuid, object_B_uuid, read, write):
+    return [
+        Triple(subject_one_uuid, read, object_A_uuid),
+        Triple(subject_one_uuid, write, object_B_uuid),
+        Triple(subject_two_uuid, "partagé", object_A_uuid),
+    ]
+
+
+def test_encode_and_decode(triples):
+    data = packed.encode(triples)
+
+    assert packed.decode(data) == triples
+
+
+def test_encode_uuid_strings(triples):
+    data = packed.encode([Triple(str(subject_uuid), predicate, str(object_uuid))
+                          for subject_uuid, predicate, object_uuid in triples])
+
+    assert packed.decode(data) == triples
+
+
+def test_decode_in_pieces(triples):
+    data = packed.encode(triples)
+
+    async def body():
+        for start in range(0, len(data), 5):
+            yield data[start:start + 5]
+
+    async def decode_all():
+        return [triple async for triple in packed.aiter_decode(body())]
+
+    assert asyncio.run(decode_all()) == triples
+
+
+@pytest.mark.parametrize("corrupt", [
+    lambda data: data[:-1],
+    lambda data: data + b"\0",
+    lambda data: b"JSON" + data[4:],
+])
+def test_decode_invalid_data(triples, corrupt):
+    with pytest.raises(ValueError):
+        packed.decode(corrupt(packed.encode(triples)))
+
+
+def test_pack_bits():
+    assert packed.pack_bits([]) == b""
+    assert packed.pack_bits([True, False, True]) == b"\x05"
+    assert packed.pack_bits([False] * 8 + [True]) == b"\x00\x01"
@@ -0,0 +1,46 @@
+import uuid
+
+import pytest
+
+from per_object_permissions.uuid_arrays import UUIDArray, uuid_bytes, uuid_strings
+
+
+def test_parse_canonical_strings(subject_one_uuid, object_A_uuid):
+    array = UUIDArray.parse([str(subject_one_uuid), str(object_A_uuid).upper()])
+
+    assert array.strings == [str(subject_one_uuid), str(object_A_uuid)]
+    assert array.raw == subject_one_uuid.bytes + object_A_uuid.bytes
+    assert list(array) == [subject_one_uuid, object_A_uuid]
+
+
+def test_parse_other_forms(subject_one_uuid):
+    array = UUIDArray.parse([subject_one_uuid.hex, f"{{{subject_one_uuid}}}", subject_one_uuid])
+
+    assert list(array) == [subject_one_uuid] * 3
+    assert array.raw == subject_one_uuid.bytes * 3
+
+
+@pytest.mark.parametrize("invalid", [
+    "not a uuid",
+    "0123456789ab-cdef-0123-4567-89abcdef0123",
+    "01234567-89ab-cdef-0123-456789abcdeg",
+    7,
+])
+def test_parse_reports_invalid_item(subject_one_uuid, invalid):
+    with pytest.raises(ValueError, match="item 1"):
+        UUIDArray.parse([str(subject_one_uuid), invalid])
+
+
+def test_helpers_accept_uuid_lists(subject_one_uuid):
+    array = UUIDArray.parse([str(subject_one_uuid)])
+
+    assert uuid_strings(array) == uuid_strings([subject_one_uuid]) == [str(subject_one_uuid)]
+    assert uuid_bytes(array) == uuid_bytes([subject_one_uuid]) == subject_one_uuid.bytes
+
+
+def test_repeated_uuids_share_objects():
+    value = str(uuid.uuid4())
+
+    first, second = UUIDArray.parse([value, value])
+
+    assert first is second